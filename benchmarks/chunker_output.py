@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark: building chunk trees from ChunkerME output with the single-pass parser of
+OpenNLPChunker, compared to the former regex/Tree.fromstring conversion.
+
+    python benchmarks/chunker_output.py [--tokens 25] [--number 2000]
+"""
+
+import argparse
+import os
+import re
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from nltk.tree import Tree
+from nltk_opennlp.chunkers import OpenNLPChunker
+
+_encodings = {"(": "xleftbrackx", ")": "xrightbrackx"}
+
+
+def regex_tree(output, use_punc_tag=False):
+    """
+    The conversion used before the single-pass parser, kept for comparison. Escaped brackets were
+    decoded later, during tree normalization, which is not included here.
+    """
+    output = " {} ".format(output)
+    for enc in _encodings:
+        output = output.replace(enc, _encodings[enc])
+    output = output.replace("[", "(").replace("]", " )")
+    pattern = re.compile(r'\s+([^_\(\)]+)_([^_\(\)]+)\s+')
+    output = re.sub(pattern, r' (\2 \1) ', output)
+    output = re.sub(pattern, r' (\2 \1) ', output)
+    if use_punc_tag:
+        output = re.sub(r'\(\s*([' + string.punctuation + ']+)\s+([' + string.punctuation + ']+)\s*\)',
+                        r'(PUNC \1)', output)
+    output = "(S {} )".format(output)
+    try:
+        return Tree.fromstring(output, remove_empty_top_bracketing=True)
+    except Exception:
+        return None
+
+
+def chunker_output(tokens):
+    pattern = ['[NP Pierre_NNP Vinken_NNP ]', ',_,', '[NP 61_CD years_NNS ]', '[ADJP old_JJ ]', ',_,',
+               '[VP will_MD join_VB ]', '[NP the_DT board_NN ]', '[PP as_IN ]',
+               '[NP a_DT nonexecutive_JJ director_NN ]', '[NP Nov._NNP 29_CD ]']
+    output, count = [], 0
+    while count < tokens:
+        for chunk in pattern:
+            output.append(chunk)
+            count += len(chunk.split()) - (2 if chunk.startswith('[') else 0)
+    return ' '.join(output + ['._.'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tokens', type=int, default=25, help='approximate sentence length')
+    parser.add_argument('--number', type=int, default=2000, help='conversions per measurement')
+    parser.add_argument('--punc', action='store_true', help='use PUNC tags')
+    args = parser.parse_args()
+
+    chunker = OpenNLPChunker.__new__(OpenNLPChunker)
+    chunker.use_punc_tag = args.punc
+    output = chunker_output(args.tokens)
+    assert chunker.__chunker_output_tree__(output) == regex_tree(output, args.punc)
+
+    results = {}
+    for name, convert in (('regex', lambda: regex_tree(output, args.punc)),
+                          ('single-pass', lambda: chunker.__chunker_output_tree__(output))):
+        results[name] = min(timeit.repeat(convert, number=args.number, repeat=5)) / args.number
+        print('{:12} {:10.2f} us/sentence'.format(name, results[name] * 1e6))
+    print('speedup      {:10.2f}x'.format(results['regex'] / results['single-pass']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for the OpenNLP run file, so that the wrappers can be benchmarked without Java and models:
+
+    python benchmarks/fake_opennlp.py POSTagger|ChunkerME|TokenNameFinder model.bin < input
+
+It reads stdin line by line and answers each line in the output format of the real tool, flushing
+after every line, and ends with the ``Execution time:`` trailer. Tags, chunks and entities are made up
+by simple rules; the name type found by TokenNameFinder is the last dash-separated part of the model
+file name (en-ner-person.bin finds persons).
+
+Environment variables:
+    FAKE_OPENNLP_STARTUP_DELAY  seconds to wait before reading input, simulating JVM and model loading
+    FAKE_OPENNLP_LINE_DELAY     seconds to wait for each input line
+"""
+
+import os
+import string
+import sys
+import time
+
+_punctuation = set(string.punctuation)
+_chunk_types = {'DT': 'NP', 'JJ': 'NP', 'NN': 'NP', 'NNS': 'NP', 'NNP': 'NP', 'CD': 'NP', 'PRP': 'NP',
+                'MD': 'VP', 'VB': 'VP', 'VBD': 'VP', 'IN': 'PP'}
+_words = {'the': 'DT', 'a': 'DT', 'an': 'DT', 'will': 'MD', 'can': 'MD', 'was': 'VBD', 'is': 'VB',
+          'in': 'IN', 'on': 'IN', 'as': 'IN', 'of': 'IN', 'for': 'IN', 'he': 'PRP', 'she': 'PRP'}
+
+
+def pos_tag(word):
+    if all(c in _punctuation for c in word):
+        return word
+    if word[0].isdigit():
+        return 'CD'
+    if word[0].isupper():
+        return 'NNP'
+    if word.lower() in _words:
+        return _words[word.lower()]
+    if word.endswith('ed'):
+        return 'VBD'
+    if word.endswith('ly') or word.endswith('al'):
+        return 'JJ'
+    return 'NNS' if word.endswith('s') else 'NN'
+
+
+def pos_tagger(line):
+    return ' '.join('{}_{}'.format(word, pos_tag(word)) for word in line.split())
+
+
+def chunker(line):
+    output, current = [], None
+    for token in line.split():
+        chunk = _chunk_types.get(token.rsplit('_', 1)[-1])
+        if chunk != current or token.endswith('_DT'):
+            if current is not None:
+                output.append(']')
+            if chunk is not None:
+                output.append('[' + chunk)
+            current = chunk
+        output.append(token)
+    if current is not None:
+        output.append(']')
+    return ' '.join(output)
+
+
+def name_finder(line, name_type):
+    # Runs of capitalized tokens (persons, organizations, locations) or of numbers (dates, money)
+    numeric = name_type in ('date', 'time', 'money', 'percentage')
+    output, tokens, i = [], line.split(), 0
+    while i < len(tokens):
+        j = i
+        while j < len(tokens) and (tokens[j][0].isdigit() if numeric else tokens[j][0].isupper()):
+            j += 1
+        if j > i and (numeric or i > 0):
+            output += ['<START:{}>'.format(name_type)] + tokens[i:j] + ['<END>']
+            i = j
+        else:
+            output.append(tokens[i])
+            i += 1
+    return ' '.join(output)
+
+
+def main(args):
+    if len(args) != 2:
+        sys.stderr.write('Usage: fake_opennlp.py TOOL model.bin\n')
+        return 1
+    tool, model = args
+    name_type = os.path.splitext(os.path.basename(model))[0].split('-')[-1]
+    tools = {'POSTagger': pos_tagger, 'ChunkerME': chunker,
+             'TokenNameFinder': lambda line: name_finder(line, name_type)}
+    if tool not in tools:
+        sys.stderr.write('Tool {} is not supported\n'.format(tool))
+        return 1
+    process = tools[tool]
+    time.sleep(float(os.environ.get('FAKE_OPENNLP_STARTUP_DELAY', 0)))
+    line_delay = float(os.environ.get('FAKE_OPENNLP_LINE_DELAY', 0))
+    sys.stderr.write('Loading model ... done\n')
+    start = time.time()
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    for line in iter(stdin.readline, b''):
+        if line_delay:
+            time.sleep(line_delay)
+        # Empty lines (document breaks of TokenNameFinder) are answered with empty lines
+        stdout.write(process(line.decode('utf-8').strip()).encode('utf-8') + b'\n')
+        stdout.flush()
+    stdout.write('\nExecution time: {:.3f} seconds\n'.format(time.time() - start).encode('utf-8'))
+    stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
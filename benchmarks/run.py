@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite: throughput, latency and memory of tagging, chunking, NER and multi-model NER
+across sentence lengths and batch sizes, run against the stand-in OpenNLP of fake_opennlp.py, so
+that no Java installation is needed.
+
+    python benchmarks/run.py [--output results.json] [--baseline baseline.json] [--persistent]
+
+Each case runs in a separate Python process, so that its peak RSS is not affected by the other
+cases. Results are written as JSON; with --baseline, cases whose throughput dropped or whose p99
+latency grew by more than --tolerance are reported and the exit status is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, os.pardir))
+
+from fake_opennlp import pos_tag
+from nltk_opennlp.chunkers import OpenNERChunker, OpenNERChunkerMulti, OpenNLPChunker
+from nltk_opennlp.instrumentation import StatsCollector
+from nltk_opennlp.taggers import OpenNLPTagger
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+modes = ('tag', 'chunk', 'ner', 'multi-ner')
+_models = {'pos': 'en-pos-maxent.bin', 'chunker': 'en-chunker.bin',
+           'ner': ['en-ner-person.bin', 'en-ner-location.bin', 'en-ner-date.bin']}
+_vocabulary = ('the', 'a', 'board', 'director', 'years', 'will', 'join', 'as', 'in', 'of', 'company',
+               'announced', 'quarterly', 'results', 'Pierre', 'Vinken', 'London', 'Smith', '29', '2018', ',')
+
+
+def create_environment(directory):
+    """
+    Create an OpenNLP bin directory running fake_opennlp.py, and empty model files.
+    :return: Paths of the bin and model directories
+    """
+    bin_dir = os.path.join(directory, 'bin')
+    models_dir = os.path.join(directory, 'models')
+    os.makedirs(bin_dir)
+    os.makedirs(models_dir)
+    run_file = os.path.join(bin_dir, 'opennlp')
+    with open(run_file, 'w') as f:
+        f.write('#!/bin/sh\nexec "{}" "{}" "$@"\n'.format(sys.executable, os.path.join(here, 'fake_opennlp.py')))
+    os.chmod(run_file, 0o755)
+    for model in [_models['pos'], _models['chunker']] + _models['ner']:
+        open(os.path.join(models_dir, model), 'wb').close()
+    return bin_dir, models_dir
+
+
+def create_sentences(count, length, seed=0):
+    rng = random.Random(seed)
+    sentences = []
+    for _ in range(count):
+        words = [rng.choice(_vocabulary) for _ in range(length - 1)] + ['.']
+        sentences.append([words[0].capitalize()] + words[1:])
+    return sentences
+
+
+def create_component(mode, bin_dir, models_dir, persistent, instrumentation):
+    # Return the component of a mode and the function processing a batch of sentences with it
+    model = lambda name: os.path.join(models_dir, name)
+    if mode == 'tag':
+        tagger = OpenNLPTagger(bin_dir, model(_models['pos']), persistent=persistent,
+                               instrumentation=instrumentation)
+        return tagger, tagger.tag_sents
+    if mode == 'chunk':
+        chunker = OpenNLPChunker(bin_dir, model(_models['chunker']), persistent=persistent,
+                                 instrumentation=instrumentation)
+    elif mode == 'ner':
+        chunker = OpenNERChunker(model(_models['ner'][0]), bin_dir, model(_models['chunker']),
+                                 persistent=persistent, instrumentation=instrumentation)
+    else:
+        chunker = OpenNERChunkerMulti([model(name) for name in _models['ner']], bin_dir, model(_models['chunker']),
+                                      persistent=persistent, instrumentation=instrumentation)
+    return chunker, chunker.parse_sents
+
+
+def peak_rss():
+    """
+    :return: Peak resident set size in KiB of this process and of its largest finished child
+        process, or None where it cannot be measured
+    """
+    if resource is None:
+        return None, None
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    scale = 1024 if sys.platform == 'darwin' else 1
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale)
+
+
+def run_case(mode, length, batch_size, count, persistent, startup_delay):
+    """
+    Run one benchmark case in this process.
+    :return: Dictionary of results
+    """
+    os.environ['FAKE_OPENNLP_STARTUP_DELAY'] = str(startup_delay)
+    directory = tempfile.mkdtemp(prefix='opennlp-benchmark-')
+    try:
+        bin_dir, models_dir = create_environment(directory)
+        sentences = create_sentences(count, length)
+        if mode != 'tag':
+            sentences = [[(word, pos_tag(word)) for word in sentence] for sentence in sentences]
+        batches = [sentences[i:i + batch_size] for i in range(0, len(sentences), batch_size)]
+        collector = StatsCollector()
+        component, process = create_component(mode, bin_dir, models_dir, persistent, collector)
+        try:
+            # Untimed warm-up, which starts the processes of persistent components
+            process(batches[0])
+            collector.reset()
+            start = default_timer()
+            for batch in batches:
+                with collector.timer('call'):
+                    process(batch)
+            elapsed = default_timer() - start
+        finally:
+            component.close()
+    finally:
+        shutil.rmtree(directory)
+
+    summary = collector.summary(percentiles=(50, 99))
+    rss, children_rss = peak_rss()
+    return {'mode': mode, 'sentence_length': length, 'batch_size': batch_size, 'sentences': count,
+            'persistent': persistent, 'seconds': elapsed, 'sentences_per_sec': count / elapsed,
+            'p50_latency': summary['call']['p50'], 'p99_latency': summary['call']['p99'],
+            'peak_rss_kb': rss, 'peak_rss_children_kb': children_rss,
+            'stages': dict((stage, stats['total']) for stage, stats in summary.items() if stage != 'call'),
+            'counters': collector.counters}
+
+
+def case_key(result):
+    return result['mode'], result['sentence_length'], result['batch_size'], result['persistent']
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline.
+    :return: List of messages, one for each regression
+    """
+    previous = dict((case_key(result), result) for result in baseline['results'])
+    regressions = []
+    for result in results:
+        base = previous.get(case_key(result))
+        if base is None:
+            continue
+        name = '{} length={} batch={}'.format(*case_key(result)[:3])
+        if result['sentences_per_sec'] < base['sentences_per_sec'] * (1 - tolerance):
+            regressions.append('{}: {:.1f} sentences/sec, was {:.1f}'.format(
+                name, result['sentences_per_sec'], base['sentences_per_sec']))
+        if result['p99_latency'] > base['p99_latency'] * (1 + tolerance):
+            regressions.append('{}: p99 latency {:.2f} ms, was {:.2f} ms'.format(
+                name, result['p99_latency'] * 1e3, base['p99_latency'] * 1e3))
+    return regressions
+
+
+def integers(value):
+    return [int(item) for item in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', default=','.join(modes), help='comma-separated subset of ' + ', '.join(modes))
+    parser.add_argument('--lengths', type=integers, default=[10, 25, 50], help='sentence lengths in tokens')
+    parser.add_argument('--batch-sizes', type=integers, default=[10, 100, 500], help='sentences per call')
+    parser.add_argument('--sentences', type=int, default=500, help='sentences per case')
+    parser.add_argument('--persistent', action='store_true', help='keep OpenNLP processes running between calls')
+    parser.add_argument('--startup-delay', type=float, default=0.0,
+                        help='seconds each OpenNLP process takes to start, simulating JVM and model loading')
+    parser.add_argument('--output', help='file to write the JSON results to; standard output by default')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown')
+    parser.add_argument('--case', nargs=3, metavar=('MODE', 'LENGTH', 'BATCH_SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        mode, length, batch_size = args.case
+        json.dump(run_case(mode, int(length), int(batch_size), args.sentences, args.persistent,
+                           args.startup_delay), sys.stdout)
+        return 0
+
+    selected = args.modes.split(',')
+    for mode in selected:
+        if mode not in modes:
+            parser.error('Unknown mode: {}'.format(mode))
+    results = []
+    for mode in selected:
+        for length in args.lengths:
+            for batch_size in args.batch_sizes:
+                command = [sys.executable, os.path.abspath(__file__), '--case', mode, str(length), str(batch_size),
+                           '--sentences', str(args.sentences), '--startup-delay', str(args.startup_delay)]
+                if args.persistent:
+                    command.append('--persistent')
+                result = json.loads(subprocess.check_output(command).decode('utf-8'))
+                sys.stderr.write('{:10} length={:<4} batch={:<5} {:10.1f} sentences/sec  p50 {:8.2f} ms  '
+                                 'p99 {:8.2f} ms\n'.format(mode, length, batch_size, result['sentences_per_sec'],
+                                                           result['p50_latency'] * 1e3, result['p99_latency'] * 1e3))
+                results.append(result)
+
+    report = {'python': platform.python_version(), 'platform': platform.platform(),
+              'startup_delay': args.startup_delay, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            sys.stderr.write('Regression: {}\n'.format(regression))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,18 @@
 import os, shutil, sys, errno
+import hashlib
 import tarfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from zipfile import ZipFile
 if sys.version_info >= (3,):
     import urllib.request as urllib2
     import urllib.parse as urlparse
-    from urllib.error import HTTPError
+    from urllib.error import HTTPError, URLError
 else:
     import urllib2
     import urlparse
     import urllib2.HTTPError as HTTPError
+    import urllib2.URLError as URLError
 from pybuilder.core import init, task, Author
 
 
@@ -25,68 +29,210 @@ languages = ['en','de']
 OPENNLP_VER = '1.8.4'
 OPENNLP_DIR = 'apache-opennlp'
 OPENNLP_MODELS_DIR = 'opennlp_models'
+OPENNLP_URL = f'https://archive.apache.org/dist/opennlp/opennlp-{OPENNLP_VER}'
+OPENNLP_MODELS_URL = 'http://opennlp.sourceforge.net/models-1.5'
+# Base URL (http://, https:// or file://) or local directory holding the distribution archive and the models,
+# used instead of the sites above; can also be set with pyb -P opennlp_mirror=...
+OPENNLP_MIRROR = os.environ.get('OPENNLP_MIRROR')
+# SHA-256 checksums of the downloaded files, in sha256sum format; files without a checksum get one recorded
+# when they are first downloaded
+CHECKSUMS_FILE = 'opennlp-sha256sums.txt'
+# Marker of an extracted distribution, holding the checksum of its archive
+INSTALL_MARKER = '.installed'
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_BLOCK_SIZE = 1 << 20
+# Tools (and their models) run when recording the classes of the class data sharing archive
+CDS_RUNS = [('POSTagger', 'en-pos-maxent.bin'), ('ChunkerME', 'en-chunker.bin'), ('TokenNameFinder', 'en-ner-person.bin')]
 
 
-# Adopted from https://stackoverflow.com/questions/22676/how-do-i-download-a-file-over-http-using-python
-def download_file(url, desc=None):
-    u = urllib2.urlopen(url)
+def source_url(base_url, filename, mirror=None):
+    if mirror:
+        scheme = urlparse.urlsplit(mirror).scheme
+        # A local directory (single-letter schemes are Windows drives)
+        base_url = mirror if len(scheme) > 1 else \
+            urlparse.urljoin('file:', urllib2.pathname2url(os.path.abspath(mirror)))
+    return '{0}/{1}'.format(base_url.rstrip('/'), filename)
+
+
+def file_sha256(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(DOWNLOAD_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_checksums(filename):
+    checksums = {}
+    if os.path.isfile(filename):
+        with open(filename) as f:
+            for line in f:
+                checksum, _, name = line.strip().partition(' ')
+                if checksum and name:
+                    checksums[name.strip().lstrip('*')] = checksum.lower()
+    return checksums
+
+
+def write_checksums(filename, checksums):
+    with open(filename + '.tmp', 'w') as f:
+        f.write(''.join('{0}  {1}\n'.format(checksums[name], name) for name in sorted(checksums)))
+    os.replace(filename + '.tmp', filename)
+
+
+def download_file(url, desc=None, logger=None, expected=None):
+    # The file is written to a .part file first; a .part file left by an interrupted run is resumed
+    # with an HTTP Range request, or downloaded again if the server does not support it. expected is
+    # the known SHA-256 checksum of the file, if any
     scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
     filename = os.path.basename(path)
     if not filename:
         filename = 'downloaded.file'
     if desc:
         filename = os.path.join(desc, filename)
+    partial = filename + '.part'
+    offset = os.path.getsize(partial) if os.path.isfile(partial) else 0
+    request = urllib2.Request(url)
+    if offset:
+        request.add_header('Range', 'bytes={0}-'.format(offset))
+    try:
+        u = urllib2.urlopen(request)
+    except HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        # Range not satisfiable: the partial file may be complete, but it is only kept if its checksum
+        # is known and matches, as it would otherwise be recorded as the trusted checksum
+        if expected is not None and file_sha256(partial) == expected:
+            os.replace(partial, filename)
+            return filename
+        os.remove(partial)
+        return download_file(url, desc, logger, expected)
+
+    with u:
+        resumed = offset and u.getcode() == 206
+        message = "Downloading: {0} Bytes: {1}{2}".format(url, u.headers.get('Content-Length'),
+                                                         " (resuming at {0})".format(offset) if resumed else "")
+        logger.info(message) if logger else print(message)
+        with open(partial, 'ab' if resumed else 'wb') as f:
+            shutil.copyfileobj(u, f, DOWNLOAD_BLOCK_SIZE)
+    os.replace(partial, filename)
+    return filename
 
-    with open(filename, 'wb') as f:
-        meta = u.info()
-        meta_func = meta.getheaders if hasattr(meta, 'getheaders') else meta.get_all
-        meta_length = meta_func("Content-Length")
-        file_size = None
-        if meta_length:
-            file_size = int(meta_length[0])
-        print("Downloading: {0} Bytes: {1}".format(url, file_size))
-
-        file_size_dl = 0
-        block_sz = 8192
-        while True:
-            buffer = u.read(block_sz)
-            if not buffer:
-                break
-            file_size_dl += len(buffer)
-            f.write(buffer)
-
-            status = "{0:16}".format(file_size_dl)
-            if file_size:
-                status += "   [{0:6.2f}%]".format(file_size_dl * 100 / file_size)
-            status += chr(13)
-            print(status, end="")
-        print()
 
+def get_file(url, targetDir, checksums, logger):
+    # Path of a verified copy of the file, downloaded unless it is present with the expected checksum
+    name = os.path.basename(urlparse.urlsplit(url).path)
+    filename = os.path.join(targetDir, name) if targetDir else name
+    expected = checksums.get(name)
+    if os.path.isfile(filename):
+        if expected is None:
+            checksums[name] = file_sha256(filename)
+            return filename
+        if file_sha256(filename) == expected:
+            return filename
+        logger.warn("Checksum of '{}' does not match, downloading it again".format(filename))
+        os.remove(filename)
+    try:
+        download_file(url, desc=targetDir, logger=logger, expected=expected)
+    except HTTPError as e:
+        logger.error("Error downloading file from '{}': {}".format(url, e.reason))
+        return None
+    except (URLError, OSError) as e:
+        logger.error("Error downloading file from '{}': {}".format(url, e))
+        return None
+    checksum = file_sha256(filename)
+    if expected is not None and checksum != expected:
+        logger.error("Checksum of '{}' downloaded from '{}' does not match".format(filename, url))
+        os.remove(filename)
+        return None
+    checksums[name] = checksum
     return filename
 
-def get_file(source, url, targetDir, logger):
-    if not targetDir is None:
-        source = os.path.join(targetDir, source)
-    if not os.path.isfile(source):
-        try:
-            download_file(url, desc=targetDir)
-        except HTTPError as e:
-            logger.error("Error downloading file from '{}': {}".format(url, e.reason))
+
+def get_files(downloads, logger):
+    """
+    Download files concurrently, checking them against the checksums file.
+    :param downloads: List of (url, target directory or None) pairs
+    :return: List of the paths of the files, None for those which could not be downloaded
+    """
+    checksums = read_checksums(CHECKSUMS_FILE)
+    # Each download only sets the checksum of its own file
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        filenames = list(executor.map(lambda download: get_file(download[0], download[1], checksums, logger),
+                                      downloads))
+    write_checksums(CHECKSUMS_FILE, checksums)
+    return filenames
+
+
+def _is_extracted(target, size, crc=None, mtime=None):
+    if not os.path.isfile(target) or os.path.getsize(target) != size:
+        return False
+    if mtime is not None:
+        return int(os.path.getmtime(target)) == int(mtime)
+    checksum = 0
+    with open(target, 'rb') as f:
+        for block in iter(lambda: f.read(DOWNLOAD_BLOCK_SIZE), b''):
+            checksum = zlib.crc32(block, checksum)
+    return checksum & 0xFFFFFFFF == crc
 
 
 def extract_file(source, targetdir):
-    topdir = targetdir
+    # Extract the files of the archive into targetdir without its top directory; files which are already
+    # extracted and unchanged are skipped. Returns the number of files written
     if source.endswith(".tar.gz") or source.endswith(".tar.bz2"):
-        tar = tarfile.open(source)
-        tar.extractall(targetdir)
-        topdir = os.path.commonprefix(tar.getnames()).rstrip("/")
-        tar.close()
+        archive = tarfile.open(source)
+        members = [(member.name, member.size, None, member.mtime, member) for member in archive.getmembers()
+                   if member.isfile()]
+        open_member = archive.extractfile
     elif source.endswith(".zip"):
-        zip = ZipFile(source, 'r')
-        zip.extractall(targetdir)
-        topdir = os.path.commonprefix(zip.namelist()).rstrip("/")
-        zip.close()
-    return topdir if targetdir is None else targetdir
+        archive = ZipFile(source, 'r')
+        members = [(info.filename, info.file_size, info.CRC, None, info) for info in archive.infolist()
+                   if not info.filename.endswith('/')]
+        open_member = archive.open
+    else:
+        raise ValueError("Unsupported archive: {}".format(source))
+    written = 0
+    with archive:
+        tops = set(name.split('/', 1)[0] for name, _, _, _, _ in members)
+        strip = len(tops.pop()) + 1 if len(tops) == 1 and all('/' in name for name, _, _, _, _ in members) else 0
+        for name, size, crc, mtime, member in members:
+            parts = name[strip:].split('/')
+            if name.startswith('/') or '..' in parts:
+                continue
+            target = os.path.join(targetdir, *parts)
+            if _is_extracted(target, size, crc, mtime):
+                continue
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            with open_member(member) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst, DOWNLOAD_BLOCK_SIZE)
+            if mtime is not None:
+                os.utime(target, (mtime, mtime))
+            written += 1
+    return written
+
+
+def install_distribution(source, targetdir, logger):
+    # Extract the OpenNLP distribution unless the same archive is installed; returns whether it was extracted
+    checksum = file_sha256(source)
+    marker = os.path.join(targetdir, INSTALL_MARKER)
+    installed = None
+    if os.path.isfile(marker):
+        with open(marker) as f:
+            installed = f.read().strip()
+    if installed == checksum:
+        logger.info('OpenNLP installation is up to date')
+        return False
+    if installed is not None:
+        # Another distribution: its files (such as other versions of the jars) must not be kept
+        shutil.rmtree(targetdir)
+    # Without a marker, files extracted by an interrupted run are kept if unchanged
+    logger.info('Extracted {} files'.format(extract_file(source, targetdir)))
+    for root, dirs, files in os.walk(os.path.join(targetdir, 'bin')):
+        for file in files:
+            os.chmod(os.path.join(root, file), 0o777)
+    with open(marker, 'w') as f:
+        f.write(checksum)
+    return True
 
 
 def copy_source(source, target, logger, isTargetDir=False):
@@ -111,8 +257,8 @@ def copy_source(source, target, logger, isTargetDir=False):
             logger.error(exc.strerror)
 
 
-def download_opennlp_files(langlist, logger):
-    opennlp_url = 'http://opennlp.sourceforge.net/models-1.5'
+def opennlp_model_files(langlist, mirror=None):
+    # (url, target directory) of the models of the languages
     lang_map = {
         'da': ['da-token.bin', 'da-sent.bin', 'da-pos-maxent.bin', 'da-pos-perceptron.bin'],
         'de': ['de-token.bin', 'de-sent.bin', 'de-pos-maxent.bin', 'de-pos-perceptron.bin'],
@@ -126,13 +272,30 @@ def download_opennlp_files(langlist, logger):
         'pt': ['pt-token.bin', 'pt-sent.bin', 'pt-pos-maxent.bin', 'pt-pos-perceptron.bin'],
         'se': ['se-token.bin', 'se-sent.bin', 'se-pos-maxent.bin', 'se-pos-perceptron.bin'],
     }
-    for lang in langlist:
-        for file in lang_map.get(lang, []):
-            if not os.path.isfile(os.path.join(OPENNLP_MODELS_DIR, file)):
-                try:
-                    download_file("{0}/{1}".format(opennlp_url, file), desc=OPENNLP_MODELS_DIR)
-                except HTTPError as exc:
-                    logger.error(exc.reason)
+    return [(source_url(OPENNLP_MODELS_URL, file, mirror), OPENNLP_MODELS_DIR)
+            for lang in langlist for file in lang_map.get(lang, [])]
+
+
+def download_opennlp_files(langlist, logger, mirror=None):
+    if not (os.path.exists(OPENNLP_MODELS_DIR) and os.path.isdir(OPENNLP_MODELS_DIR)):
+        os.mkdir(OPENNLP_MODELS_DIR)
+    get_files(opennlp_model_files(langlist, mirror), logger)
+
+
+def build_cds_archive(logger, rebuild=True):
+    # The archive only speeds up JVM startup, so OpenNLP remains usable without it
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        from nltk_opennlp.launcher import cds_archive_name, create_cds_archive
+        if not rebuild and os.path.isfile(os.path.join(OPENNLP_DIR, 'lib', cds_archive_name)):
+            logger.info("Class data sharing archive is up to date")
+            return
+        runs = [(tool, os.path.join(OPENNLP_MODELS_DIR, model)) for tool, model in CDS_RUNS
+                if os.path.isfile(os.path.join(OPENNLP_MODELS_DIR, model))]
+        archive = create_cds_archive(os.path.join(OPENNLP_DIR, 'bin'), runs)
+        logger.info("Created class data sharing archive {}".format(archive))
+    except (ImportError, LookupError, OSError) as exc:
+        logger.warn("Class data sharing archive was not created: {}".format(exc))
 
 
 # @init
@@ -149,21 +312,19 @@ def download_opennlp_files(langlist, logger):
 
 
 @task
-def setup_opennlp(logger):
-    opennlp_file = f'https://archive.apache.org/dist/opennlp/opennlp-{OPENNLP_VER}/apache-opennlp-{OPENNLP_VER}-bin.zip'
-    logger.info('Downloading OpenNLP')
-    if os.path.exists(OPENNLP_DIR) and os.path.isdir(OPENNLP_DIR):
-        shutil.rmtree(OPENNLP_DIR)
-    opennlp_filename = opennlp_file.split("/")[-1]
-    get_file(opennlp_filename, opennlp_file, None, logger)
-    extracted_dir = extract_file(opennlp_filename, None)
-    os.remove(opennlp_filename)
-    os.rename(extracted_dir, OPENNLP_DIR)
-    for root, dirs, files in os.walk(os.path.join(OPENNLP_DIR, 'bin')):
-        for file in files:
-            os.chmod(os.path.join(root, file), 0o777)
-    logger.info('Downloading OpenNLP models for selected languages')
+def setup_opennlp(project, logger):
+    mirror = project.get_property('opennlp_mirror', OPENNLP_MIRROR)
+    opennlp_filename = f'apache-opennlp-{OPENNLP_VER}-bin.zip'
     if not (os.path.exists(OPENNLP_MODELS_DIR) and os.path.isdir(OPENNLP_MODELS_DIR)):
         os.mkdir(OPENNLP_MODELS_DIR)
-    download_opennlp_files(languages, logger)
+    # The distribution and the models are downloaded together; the archive is kept to detect changes
+    logger.info('Downloading OpenNLP and the models for selected languages')
+    downloads = [(source_url(OPENNLP_URL, opennlp_filename, mirror), None)] + opennlp_model_files(languages, mirror)
+    opennlp_file = get_files(downloads, logger)[0]
+    if opennlp_file is None:
+        logger.error('OpenNLP could not be downloaded')
+        return
+    installed = install_distribution(opennlp_file, OPENNLP_DIR, logger)
+    logger.info('Creating class data sharing archive for faster OpenNLP startup')
+    build_cds_archive(logger, rebuild=installed)
     logger.info("Done")
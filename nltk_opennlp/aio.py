@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: asyncio interface to OpenNLP processes
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for running Apache OpenNLP command line tools from asyncio code without blocking
+the event loop
+"""
+
+import asyncio
+import re
+from collections import deque
+from asyncio.subprocess import PIPE
+from nltk_opennlp.instrumentation import _disabled
+from nltk_opennlp.workers import OpenNLPError, _command, _document_tools, _encode_input, _stderr_lines, \
+    _stderr_tail, _without_empty
+
+# Longest output line read from a persistent process; asyncio streams allow 64 KiB by default, which
+# long tagged sentences may exceed
+_stream_limit = 64 * 1024 * 1024
+
+
+async def arun_tool(opennlp_bin, tool, model, lines, timeout=None, instrumentation=None):
+    """
+    Run an OpenNLP command line tool once over a batch of lines.
+    :param opennlp_bin: Path to the OpenNLP run file, or the command starting the OpenNLP CLI
+    :param tool: OpenNLP command line tool name, such as POSTagger or ChunkerME
+    :param model: The path to the OpenNLP model .bin file used by the tool
+    :param lines: List of input lines (without line breaks)
+    :param timeout: Time limit in seconds; the process is killed when it is exceeded
+    :param instrumentation: Collector for timings and counters (see nltk_opennlp.instrumentation)
+    :return: List of output lines, one per input line
+    """
+    if not all(lines):
+        output = await arun_tool(opennlp_bin, tool, model, [line for line in lines if line], timeout,
+                                 instrumentation) if any(lines) else []
+        return _without_empty(lambda batch: output, lines)
+
+    instrumentation = instrumentation or _disabled
+    with instrumentation.timer('spawn'):
+        p = await asyncio.create_subprocess_exec(*_command(opennlp_bin, tool, model), stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    instrumentation.count('processes_spawned')
+    data = _encode_input(tool, lines)
+    try:
+        with instrumentation.timer('transfer'):
+            (stdout, stderr) = await asyncio.wait_for(p.communicate(data), timeout)
+    finally:
+        # Timed out or cancelled
+        if p.returncode is None:
+            p.kill()
+            await p.wait()
+    instrumentation.count('bytes_in', len(data))
+    instrumentation.count('bytes_out', len(stdout))
+    stdout = stdout.decode('utf-8')
+
+    # Check the return code.
+    if p.returncode != 0:
+        raise OpenNLPError(returncode=p.returncode, stderr=_stderr_tail(stderr))
+
+    # Clean the execution time information
+    output = re.sub(r"\nExecution time:(.*)$", "", stdout)
+    output = output.splitlines()
+    if tool in _document_tools:
+        output = output[::2]
+    if len(output) < len(lines):
+        raise OpenNLPError('OpenNLP command returned too few lines!', p.returncode, _stderr_tail(stderr))
+    return output[:len(lines)]
+
+
+def create_async_worker(opennlp_bin, tool, model, workers=1, instrumentation=None):
+    """
+    Create a persistent asyncio backend for an OpenNLP tool: a single worker or a pool of them.
+    :param workers: Number of OpenNLP processes to keep running
+    :param instrumentation: Collector for timings and counters (see nltk_opennlp.instrumentation)
+    """
+    if workers > 1:
+        return AsyncOpenNLPWorkerPool(opennlp_bin, tool, model, workers=workers, instrumentation=instrumentation)
+    return AsyncOpenNLPWorker(opennlp_bin, tool, model, instrumentation=instrumentation)
+
+
+class AsyncOpenNLPWorker(object):
+    """
+    A long-lived OpenNLP command line tool process driven by asyncio streams. Requests are pipelined:
+    any number of them may be in flight, and each output line is routed to the request that wrote
+    the corresponding input line. Cancelled requests have their output discarded; a request which
+    exceeds its own time limit, or is cancelled while no other request is in flight, stops the
+    process, which is restarted for the next request.
+    """
+
+    def __init__(self, opennlp_bin, tool, model, stderr_lines=_stderr_lines, instrumentation=None):
+        """
+        Initialize the worker; the process itself is started on first use.
+        :param opennlp_bin: Path to the OpenNLP run file, or the command starting the OpenNLP CLI
+        :param tool: OpenNLP command line tool name, such as POSTagger or ChunkerME
+        :param model: The path to the OpenNLP model .bin file used by the tool
+        :param stderr_lines: Number of most recent stderr lines to keep for error reporting
+        :param instrumentation: Collector for timings and counters (see nltk_opennlp.instrumentation)
+        """
+        self._args = _command(opennlp_bin, tool, model)
+        self._tool = tool
+        self._instrumentation = instrumentation or _disabled
+        self._process = None
+        self._reader = None
+        self._stderr_reader = None
+        self._pending = deque()
+        self._stderr = deque(maxlen=stderr_lines)
+        self._lock = None
+        # Processes stopped by close(), which aclose() waits for
+        self._stopped = []
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+    def __len__(self):
+        return len(self._pending)
+
+
+    def alive(self):
+        """Check whether the OpenNLP process is running"""
+        return self._process is not None and self._process.returncode is None
+
+
+    def stderr(self):
+        """Most recent stderr output of the OpenNLP process"""
+        return '\n'.join(self._stderr)
+
+
+    async def start(self):
+        """Start the OpenNLP process if it is not running"""
+        if self.alive():
+            return
+        self.close()
+        self._stderr.clear()
+        with self._instrumentation.timer('spawn'):
+            self._process = await asyncio.create_subprocess_exec(*self._args, stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                                                                 limit=_stream_limit)
+        self._instrumentation.count('processes_spawned')
+        self._stderr_reader = asyncio.ensure_future(self.__drain_stderr__(self._process.stderr))
+        self._reader = asyncio.ensure_future(self.__read__(self._process, self._pending, self._stderr_reader))
+
+
+    async def __drain_stderr__(self, stream):
+        # Keep reading stderr so that the process never blocks on a full pipe
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            self._stderr.append(line.decode('utf-8', 'replace').rstrip())
+
+
+    async def __read__(self, process, pending, stderr_reader):
+        message = 'OpenNLP command failed!'
+        try:
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                self._instrumentation.count('bytes_out', len(line))
+                if pending:
+                    future = pending.popleft()
+                    if future is not None and not future.done():
+                        future.set_result(line.decode('utf-8').rstrip('\r\n'))
+        except (OSError, ValueError) as e:
+            # An output line over the stream limit (or undecodable); the output can no longer be
+            # matched to the requests, so the process is stopped
+            message = 'Reading OpenNLP output failed: {}'.format(e)
+            if process.returncode is None:
+                process.kill()
+            # Discard the rest of the output, as the process is not reaped until its stdout is closed
+            while await process.stdout.read(_stream_limit):
+                pass
+        # The process has exited; fail whatever is still waiting for output
+        await process.wait()
+        await asyncio.wait([stderr_reader], timeout=1)
+        while pending:
+            future = pending.popleft()
+            if future is not None and not future.done():
+                future.set_exception(OpenNLPError(message, process.returncode, self.stderr()))
+
+
+    async def process(self, lines, timeout=None):
+        """
+        Send lines to the OpenNLP process and return its output, one line per input line.
+        :param lines: List of input lines (without line breaks)
+        :param timeout: Time limit in seconds for this request; when it is exceeded, the process is killed
+            (failing the other requests in flight) and a new one is started for the next request. A
+            cancelled request only discards its output, unless it was the only one in flight
+        :return: List of output lines
+        """
+        if not all(lines):
+            output = await self.process([line for line in lines if line], timeout) if any(lines) else []
+            return _without_empty(lambda batch: output, lines)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        loop = asyncio.get_event_loop()
+        futures = [loop.create_future() for _ in lines]
+        async with self._lock:
+            if not self.alive():
+                await self.start()
+            process = self._process
+            for future in futures:
+                self._pending.append(future)
+                # The empty line written after every line of document tools is answered as well
+                if self._tool in _document_tools:
+                    self._pending.append(None)
+            data = _encode_input(self._tool, lines)
+            self._process.stdin.write(data)
+            self._instrumentation.count('bytes_in', len(data))
+            try:
+                await self._process.stdin.drain()
+            except (OSError, ValueError):
+                # The process died; the reader fails the pending requests on EOF
+                pass
+        try:
+            with self._instrumentation.timer('transfer'):
+                await asyncio.wait_for(asyncio.gather(*futures), timeout)
+        except BaseException as e:
+            for future in futures:
+                future.cancel()
+            if process is self._process:
+                if isinstance(e, asyncio.TimeoutError):
+                    # The process does not answer in time; a new one is started for the next request
+                    self.close()
+                elif isinstance(e, asyncio.CancelledError) and \
+                        all(future is None or future.done() for future in self._pending):
+                    # The caller gave up waiting (such as on an outer deadline) and no other request
+                    # waits for the process, which may be stuck; the reader skips the output otherwise
+                    self.close()
+            raise
+        return [future.result() for future in futures]
+
+
+    def close(self):
+        """Stop the OpenNLP process without waiting for it"""
+        process, self._process = self._process, None
+        self._stopped = [stopped for stopped in self._stopped if stopped.returncode is None]
+        if process is not None and process.returncode is None:
+            process.kill()
+            self._stopped.append(process)
+        for task in (self._reader, self._stderr_reader):
+            if task is not None:
+                task.cancel()
+        self._reader = self._stderr_reader = None
+        while self._pending:
+            future = self._pending.popleft()
+            if future is not None and not future.done():
+                future.set_exception(OpenNLPError('OpenNLP process was stopped!'))
+
+
+    async def aclose(self):
+        """Stop the OpenNLP process and wait for it (and those stopped by close()) to exit"""
+        self.close()
+        stopped, self._stopped = self._stopped, []
+        await asyncio.gather(*(process.wait() for process in stopped))
+
+
+class AsyncOpenNLPWorkerPool(object):
+    """
+    A pool of asyncio OpenNLP workers running the same tool and model. Requests are split across the
+    workers with the fewest lines in flight; the output is returned in input order.
+    """
+
+    def __init__(self, opennlp_bin, tool, model, workers=2, instrumentation=None):
+        """
+        Initialize the pool; the processes are started on first use.
+        :param opennlp_bin: Path to the OpenNLP run file, or the command starting the OpenNLP CLI
+        :param tool: OpenNLP command line tool name, such as POSTagger or ChunkerME
+        :param model: The path to the OpenNLP model .bin file used by the tool
+        :param workers: Number of OpenNLP processes
+        :param instrumentation: Collector for timings and counters (see nltk_opennlp.instrumentation)
+        """
+        if workers < 1:
+            raise ValueError('At least one worker is required!')
+        self._workers = [AsyncOpenNLPWorker(opennlp_bin, tool, model, instrumentation=instrumentation)
+                         for _ in range(workers)]
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+    async def process(self, lines, timeout=None):
+        """
+        Send lines to the pool and return the output, one line per input line.
+        :param lines: List of input lines (without line breaks)
+        :param timeout: Time limit in seconds for this request
+        :return: List of output lines
+        """
+        if not lines:
+            return []
+        workers = sorted(self._workers, key=len)[:len(lines)]
+        size = -(-len(lines) // len(workers))
+        batches = [lines[i:i + size] for i in range(0, len(lines), size)]
+        results = await asyncio.gather(*(worker.process(batch, timeout) for worker, batch in zip(workers, batches)))
+        return [line for result in results for line in result]
+
+
+    def close(self):
+        """Stop all OpenNLP processes of the pool without waiting for them"""
+        for worker in self._workers:
+            worker.close()
+
+
+    async def aclose(self):
+        """Stop all OpenNLP processes of the pool and wait for them to exit"""
+        await asyncio.gather(*(worker.aclose() for worker in self._workers))
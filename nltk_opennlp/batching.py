@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: Micro-batching of OpenNLP requests
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for combining single-sentence requests of concurrent callers (e.g. the threads of
+an API server) into batches, so that OpenNLP receives one newline-delimited batch instead of a round
+trip per sentence. Requests are collected until the batch is full or the first of them has waited
+for the maximum delay; each caller receives its own result.
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from timeit import default_timer
+from nltk.chunk.api import ChunkParserI
+from nltk.tag.api import TaggerI
+from nltk_opennlp.instrumentation import _disabled, _nearest_rank
+from nltk_opennlp.workers import _end, _start_thread
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+
+class MicroBatcher(object):
+    """
+    Collects items submitted by concurrent callers into batches processed by a single call.
+    While all batches in progress are busy, new requests keep queueing, so batches grow with load.
+    """
+
+    def __init__(self, process, max_batch_size=64, max_delay=0.005, concurrency=1, instrumentation=None):
+        """
+        :param process: Function taking a list of items and returning a list of results, one per item
+        :param max_batch_size: Maximum number of items in a batch
+        :param max_delay: Maximum time in seconds a request waits for other requests to join its batch
+        :param concurrency: Number of batches processed at the same time, e.g. the number of workers
+            of the tagger or chunker
+        :param instrumentation: Collector receiving the queueing delay of each request (stage 'queue')
+            and the number of batches and requests (counters 'batches' and 'batched_requests')
+        """
+        if max_batch_size < 1 or concurrency < 1:
+            raise ValueError('Batch size and concurrency must be positive!')
+        self._process = process
+        self._max_batch_size = max_batch_size
+        self._max_delay = max_delay
+        self._instrumentation = instrumentation or _disabled
+        self._queue = Queue()
+        self._slots = threading.Semaphore(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._requests = 0
+        self._batches = 0
+        self._batch_sizes = deque(maxlen=1000)
+        self._delays = deque(maxlen=10000)
+        self._dispatcher = _start_thread(self.__dispatch__)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def submit(self, item):
+        """
+        Add an item to the next batch.
+        :return: concurrent.futures.Future receiving the result of the item
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Batcher is closed!')
+            self._queue.put((item, future, default_timer()))
+        return future
+
+
+    def __dispatch__(self):
+        closing = False
+        while not closing:
+            request = self._queue.get()
+            if request is _end:
+                break
+            batch = [request]
+            deadline = request[2] + self._max_delay
+            while len(batch) < self._max_batch_size:
+                try:
+                    request = self._queue.get(timeout=max(deadline - default_timer(), 0))
+                except Empty:
+                    break
+                if request is _end:
+                    closing = True
+                    break
+                batch.append(request)
+            # Wait for a free slot; meanwhile new requests queue up for the next batch
+            self._slots.acquire()
+            self._executor.submit(self.__run__, batch)
+
+
+    def __run__(self, batch):
+        try:
+            start = default_timer()
+            requests, delays = [], []
+            for item, future, submitted in batch:
+                # Requests cancelled by their callers are left out
+                if future.set_running_or_notify_cancel():
+                    requests.append((item, future))
+                    delays.append(start - submitted)
+            if not requests:
+                return
+            for delay in delays:
+                self._instrumentation.timing('queue', delay)
+            self._instrumentation.count('batches')
+            self._instrumentation.count('batched_requests', len(requests))
+            with self._lock:
+                self._requests += len(requests)
+                self._batches += 1
+                self._batch_sizes.append(len(requests))
+                self._delays.extend(delays)
+            try:
+                results = self._process([item for item, _ in requests])
+                if len(results) != len(requests):
+                    raise ValueError('Expected {} results, got {}'.format(len(requests), len(results)))
+            except BaseException as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                return
+            for (_, future), result in zip(requests, results):
+                future.set_result(result)
+        finally:
+            self._slots.release()
+
+
+    def stats(self):
+        """
+        Batching statistics; sizes and delays are those of the most recent batches and requests.
+        :return: Dictionary with the number of requests and batches, the mean and maximum batch size,
+            and the median and 99th percentile of the queueing delay in seconds
+        """
+        with self._lock:
+            sizes, delays = list(self._batch_sizes), sorted(self._delays)
+            stats = {'requests': self._requests, 'batches': self._batches}
+        stats['mean_batch_size'] = float(sum(sizes)) / len(sizes) if sizes else 0.0
+        stats['max_batch_size'] = max(sizes) if sizes else 0
+        stats['queue_delay_p50'] = _nearest_rank(delays, 50) if delays else 0.0
+        stats['queue_delay_p99'] = _nearest_rank(delays, 99) if delays else 0.0
+        return stats
+
+
+    def close(self):
+        """Process the requests already submitted and stop the batcher"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_end)
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+
+class BatchingTagger(TaggerI):
+    """
+    Front-end of an OpenNLPTagger for many threads tagging one sentence at a time: concurrent calls
+    of tag() are sent to the tagger as batches.
+    """
+
+    def __init__(self, tagger, max_batch_size=64, max_delay=0.005, concurrency=1, instrumentation=None):
+        """
+        :param tagger: nltk_opennlp.taggers.OpenNLPTagger, preferably persistent; it is not closed by close()
+        :param max_batch_size: Maximum number of sentences in a batch
+        :param max_delay: Maximum time in seconds a sentence waits for others to join its batch
+        :param concurrency: Number of batches tagged at the same time, e.g. the number of tagger workers
+        :param instrumentation: Collector for the batching metrics (see MicroBatcher)
+        """
+        self._tagger = tagger
+        self._batcher = MicroBatcher(tagger.tag_sents, max_batch_size, max_delay, concurrency, instrumentation)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def tag(self, tokens, timeout=None):
+        """
+        Tag a sentence as part of a batch.
+        :param tokens: Sentence given as a list of tokens or as a string
+        :param timeout: Time limit in seconds for waiting for the result
+        :return: List of (token, tag) tuples
+        """
+        return self._batcher.submit(tokens).result(timeout)
+
+
+    def tag_sents(self, sentences):
+        # Batches of the caller are tagged directly
+        return self._tagger.tag_sents(sentences)
+
+
+    def stats(self):
+        """Batching statistics, see MicroBatcher.stats()"""
+        return self._batcher.stats()
+
+
+    def close(self):
+        """Tag the sentences already submitted and stop batching"""
+        self._batcher.close()
+
+
+class BatchingChunker(ChunkParserI):
+    """
+    Front-end of an OpenNLPChunker (or a NER chunker) for many threads chunking one sentence at a
+    time: concurrent calls of parse() are sent to the chunker as batches.
+    """
+
+    def __init__(self, chunker, max_batch_size=64, max_delay=0.005, concurrency=1, instrumentation=None):
+        """
+        :param chunker: nltk_opennlp.chunkers.OpenNLPChunker, preferably persistent; it is not closed by close()
+        :param max_batch_size: Maximum number of sentences in a batch
+        :param max_delay: Maximum time in seconds a sentence waits for others to join its batch
+        :param concurrency: Number of batches chunked at the same time, e.g. the number of chunker workers
+        :param instrumentation: Collector for the batching metrics (see MicroBatcher)
+        """
+        self._chunker = chunker
+        self._options = (max_batch_size, max_delay, concurrency, instrumentation)
+        # A batcher for each output type, created on first use
+        self._batchers = {}
+        self._lock = threading.Lock()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def __batcher__(self, output):
+        with self._lock:
+            batcher = self._batchers.get(output)
+            if batcher is None:
+                self._chunker.__check_output__(output)
+                process = lambda sentences: self._chunker.parse_sents(sentences, len(sentences), output)
+                batcher = self._batchers[output] = MicroBatcher(process, *self._options)
+            return batcher
+
+
+    def parse(self, tokens, output='trees', timeout=None):
+        """
+        Chunk a POS-tagged sentence as part of a batch.
+        :param tokens: List of (token, tag) tuples
+        :param output: 'trees', 'spans' or 'iob', see OpenNLPChunker.parse()
+        :param timeout: Time limit in seconds for waiting for the result
+        :return: Parse tree or list of entity spans
+        """
+        return self.__batcher__(output).submit(tokens).result(timeout)
+
+
+    def parse_sents(self, sentences, output='trees'):
+        # Batches of the caller are chunked directly
+        return self._chunker.parse_sents(sentences, output=output)
+
+
+    def stats(self):
+        """Batching statistics of each output type, see MicroBatcher.stats()"""
+        with self._lock:
+            batchers = dict(self._batchers)
+        return dict((output, batcher.stats()) for output, batcher in batchers.items())
+
+
+    def close(self):
+        """Chunk the sentences already submitted and stop batching"""
+        with self._lock:
+            batchers, self._batchers = list(self._batchers.values()), {}
+        for batcher in batchers:
+            batcher.close()
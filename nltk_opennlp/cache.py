@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: Caching of OpenNLP output
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for memoizing the output of Apache OpenNLP command line tools, so that repeated
+sentences are processed only once. Output lines are cached by tool, model identity (path, size and
+modification time, or content hash) and input line, in a bounded in-memory LRU and optionally in a
+sqlite database which survives restarts.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class OutputCache(object):
+    """
+    Cache of OpenNLP output lines. A single cache may be shared by several taggers and chunkers;
+    it is thread-safe.
+    """
+
+    def __init__(self, maxsize=100000, path=None, hash_models=False):
+        """
+        Initialize the cache.
+        :param maxsize: Maximum number of output lines kept in memory
+        :param path: Path to a sqlite database used as persistent store; None keeps the cache in memory only
+        :param hash_models: Identify models by SHA-1 of their content instead of path, size and
+            modification time, so that persistent entries remain valid when models are moved
+        """
+        if maxsize < 1:
+            raise ValueError('Cache size must be positive!')
+        self._maxsize = maxsize
+        self._hash_models = hash_models
+        self._entries = OrderedDict()
+        self._model_ids = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS outputs (tool TEXT, model TEXT, line TEXT, output TEXT, '
+                             'PRIMARY KEY (tool, model, line))')
+            self._db.commit()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def model_id(self, model):
+        """
+        Identity of a model file, which changes whenever the file does.
+        :param model: The path to the OpenNLP model .bin file
+        """
+        stat = os.stat(model)
+        identity = '{}:{}:{}'.format(os.path.abspath(model), stat.st_size, stat.st_mtime_ns)
+        if not self._hash_models:
+            return identity
+        with self._lock:
+            digest = self._model_ids.get(identity)
+        if digest is None:
+            sha1 = hashlib.sha1()
+            with open(model, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha1.update(block)
+            digest = sha1.hexdigest()
+            with self._lock:
+                self._model_ids[identity] = digest
+        return digest
+
+
+    def __lookup__(self, tool, model, lines):
+        # Split the distinct lines into cached ones (returned with their output) and missing ones
+        model = self.model_id(model)
+        found, missing, seen = {}, [], set()
+        with self._lock:
+            for line in lines:
+                if line in seen:
+                    continue
+                seen.add(line)
+                key = (tool, model, line)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[line] = self._entries[key]
+                elif self._db is not None:
+                    row = self._db.execute('SELECT output FROM outputs WHERE tool = ? AND model = ? AND line = ?',
+                                           key).fetchone()
+                    if row is not None:
+                        found[line] = row[0]
+                        self.__remember__(key, row[0])
+                    else:
+                        missing.append(line)
+                else:
+                    missing.append(line)
+            self.misses += len(missing)
+            self.hits += len(lines) - len(missing)
+        return model, found, missing
+
+
+    def __remember__(self, key, output):
+        self._entries[key] = output
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+
+    def __store__(self, tool, model, found, missing, output):
+        with self._lock:
+            for line, result in zip(missing, output):
+                found[line] = result
+                self.__remember__((tool, model, line), result)
+            if self._db is not None:
+                self._db.executemany('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)',
+                                     [(tool, model, line, result) for line, result in zip(missing, output)])
+                self._db.commit()
+
+
+    def process(self, tool, model, lines, run):
+        """
+        Return the output for lines, running the tool only over the distinct lines not found in the cache.
+        :param tool: OpenNLP command line tool name, such as POSTagger or ChunkerME
+        :param model: The path to the OpenNLP model .bin file used by the tool
+        :param lines: List of input lines (without line breaks)
+        :param run: Function taking a list of input lines and returning their output lines
+        :return: List of output lines, one per input line
+        """
+        model_id, found, missing = self.__lookup__(tool, model, lines)
+        if missing:
+            self.__store__(tool, model_id, found, missing, run(missing))
+        return [found[line] for line in lines]
+
+
+    async def aprocess(self, tool, model, lines, run):
+        """
+        Asynchronous counterpart of process(); run is a coroutine function.
+        """
+        model_id, found, missing = self.__lookup__(tool, model, lines)
+        if missing:
+            self.__store__(tool, model_id, found, missing, await run(missing))
+        return [found[line] for line in lines]
+
+
+    def stats(self):
+        """
+        Cache statistics.
+        :return: Dictionary with the number of lines answered from the cache ('hits'), lines sent to
+            OpenNLP ('misses'), their ratio ('hit_rate') and the number of lines kept in memory ('size')
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries),
+                    'hit_rate': float(self.hits) / total if total else 0.0}
+
+
+    def clear(self):
+        """Remove all entries, including the persistent ones, and reset the statistics"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+            if self._db is not None:
+                self._db.execute('DELETE FROM outputs')
+                self._db.commit()
+
+
+    def close(self):
+        """Close the persistent store"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
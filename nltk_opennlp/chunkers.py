@@ -8,264 +8,639 @@
 A Python module for interfacing with the Apache OpenNLP package and obtaining chunk parse tree
 """
 
-import gc
-import os
-import sys
+import asyncio
 import re
 import string
-from subprocess import Popen, PIPE
-from nltk.internals import find_binary
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from nltk.chunk.api import ChunkParserI
 from nltk.tree import Tree, ParentedTree
+from nltk_opennlp import engine, files
+from nltk_opennlp.aio import arun_tool, create_async_worker
+from nltk_opennlp.instrumentation import _disabled
+from nltk_opennlp.registry import default_registry, find_opennlp
+from nltk_opennlp.server import OpenNLPClient
+from nltk_opennlp.workers import _FanOut, create_worker, run_tool, stream_tool
 
 
 class OpenNLPChunker(ChunkParserI):
 
     use_punc_tag = False
+    _instrumentation = _disabled
 
-    def __init__(self, path_to_bin=None, path_to_chunker=None, verbose=False, use_punc_tag=False):
+    def __init__(self, path_to_bin=None, path_to_chunker=None, verbose=False, use_punc_tag=False,
+                 persistent=False, workers=1, instrumentation=None, cache=None, server=None, shared=False,
+                 timeout=None, hedge=None, launcher=None, backend='opennlp'):
         """
         Initialize the OpenNLPChunker.
         :param path_to_bin: Path to bin directory of OpenNLP installation
         :param path_to_chunker: The path to OpenNLP POS chunker .bin file.
         :param use_punc_tag: Whether standalone punctuation marks should be tagged using PUNC tag
+        :param persistent: Keep the ChunkerME (and TokenNameFinder) processes running between calls;
+            call close() (or use the chunker as a context manager) to stop them
+        :param workers: Number of processes to keep running for each model; batches passed to
+            parse_sents() are spread across them. Implies persistent mode when greater than 1. The
+            asyncio methods use a separate set of processes, started on first use
+        :param instrumentation: Collector receiving per-stage timings and counters, such as
+            nltk_opennlp.instrumentation.StatsCollector; disabled by default
+        :param cache: nltk_opennlp.cache.OutputCache used to memoize the output of ChunkerME and
+            TokenNameFinder; only sentences not found in it are sent to OpenNLP
+        :param server: Path of the socket of a running nltk_opennlp.server daemon (or an OpenNLPClient)
+            serving the models; sentences are then processed by the daemon instead of local OpenNLP processes
+        :param shared: Use persistent processes shared with other taggers and chunkers of this process
+            using the same models: True for nltk_opennlp.registry.default_registry, or a BackendRegistry.
+            Shared processes do not report to instrumentation
+        :param timeout: Time limit in seconds for each call to an OpenNLP tool; the process is killed (and
+            replaced) and nltk_opennlp.workers.OpenNLPTimeoutError raised when it is exceeded
+        :param hedge: With several workers, a latency percentile (e.g. 95) after which a batch is sent to
+            an idle worker as well, using the first answer
+        :param launcher: nltk_opennlp.launcher.JavaLauncher starting OpenNLP with java directly, with its
+            JVM options, instead of the opennlp run file
+        :param backend: 'opennlp' to run the OpenNLP TokenNameFinder tool, or 'python' to run the NER models
+            in this process with nltk_opennlp.engine; ChunkerME still needs OpenNLP, so no Java is needed only
+            without a chunker model. NER models with unsupported feature generators raise ValueError
 
         """
-        if path_to_chunker is None:
+        if path_to_chunker is None and not self.__ner_requests__([]):
             raise LookupError('OpenNLP model file is not set!')
         self._model_path = path_to_chunker
         self.use_punc_tag = use_punc_tag
+        self._persistent = persistent or workers > 1 or bool(shared)
+        self._registry = (default_registry if shared is True else shared) or None
+        self._num_workers = workers
+        self._backends = {}
+        self._backends_lock = threading.Lock()
+        self._async_backends = {}
+        self._instrumentation = instrumentation or _disabled
+        self._cache = cache
+        self._timeout = timeout
+        self._hedge = hedge
+        self._client = OpenNLPClient(server, timeout) if isinstance(server, str) else server
+        self._opennlp_bin = None
+        self._name_finders = None
+        if backend not in ('opennlp', 'python'):
+            raise ValueError('Unknown backend: {}'.format(backend))
+        if backend == 'python':
+            self._name_finders = dict((model, engine.load_name_finder_model(model))
+                                      for _, model, _ in self.__ner_requests__([]))
+            if path_to_chunker is None:
+                # Only the NER models are used, so OpenNLP is not needed
+                return
+        if self._client is not None:
+            # OpenNLP is run by the daemon
+            return
+        self._opennlp_bin = find_opennlp(path_to_bin, verbose) if launcher is None else \
+            launcher.command(path_to_bin, verbose)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+    def close(self):
+        """Stop the persistent OpenNLP processes (or close the connection to the daemon), if there are any"""
+        if self._client is not None:
+            self._client.close()
+        with self._backends_lock:
+            backends, self._backends = self._backends, {}
+        async_backends, self._async_backends = self._async_backends, {}
+        for backend in list(backends.values()) + list(async_backends.values()):
+            backend.close()
+
+
+    async def aclose(self):
+        """Stop the persistent OpenNLP processes and wait for the asyncio ones to exit"""
+        async_backends = list(self._async_backends.values())
+        self.close()
+        await asyncio.gather(*(backend.aclose() for backend in async_backends))
+
+
+    def __run__(self, tool, model, lines):
+        if self._cache is not None:
+            return self._cache.process(tool, model, lines, lambda missing: self.__process__(tool, model, missing))
+        return self.__process__(tool, model, lines)
+
+
+    def __process__(self, tool, model, lines):
+        if self._client is not None:
+            return self._client.process(tool, model, lines)
+        if not self._persistent:
+            return run_tool(self._opennlp_bin, tool, model, lines, self._instrumentation, self._timeout)
+        with self._backends_lock:
+            backend = self._backends.get((tool, model))
+            if backend is None:
+                if self._registry is not None:
+                    backend = self._registry.acquire(self._opennlp_bin, tool, model, self._num_workers)
+                else:
+                    backend = create_worker(self._opennlp_bin, tool, model, self._num_workers, self._instrumentation,
+                                            self._hedge)
+                self._backends[(tool, model)] = backend
+        return backend.process(lines, self._timeout)
+
+
+    async def __arun__(self, tool, model, lines, timeout):
+        if self._cache is not None:
+            return await self._cache.aprocess(tool, model, lines,
+                                              lambda missing: self.__aprocess__(tool, model, missing, timeout))
+        return await self.__aprocess__(tool, model, lines, timeout)
+
+
+    async def __aprocess__(self, tool, model, lines, timeout):
+        if self._client is not None:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, self._client.process, tool, model, lines)
+        if not self._persistent:
+            return await arun_tool(self._opennlp_bin, tool, model, lines, timeout, self._instrumentation)
+        backend = self._async_backends.get((tool, model))
+        if backend is None:
+            backend = create_async_worker(self._opennlp_bin, tool, model, self._num_workers, self._instrumentation)
+            self._async_backends[(tool, model)] = backend
+        return await backend.process(lines, timeout)
+
+
+    def __find_names__(self, models, lines):
+        with self._instrumentation.timer('engine'):
+            return engine.find_names([self._name_finders[model] for model in models], lines)
+
+
+    def __split_requests__(self, requests):
+        # Indices of the requests run by OpenNLP, and of the TokenNameFinder ones run in Python
+        in_python = [i for i, (tool, _, _) in enumerate(requests)
+                     if tool == "TokenNameFinder" and self._name_finders is not None]
+        return [i for i in range(len(requests)) if i not in in_python], in_python
+
+
+    def __run_requests__(self, requests):
+        # Independent OpenNLP runs (e.g. the chunker and NER models) are done in parallel; the NER models
+        # run in Python are done together, as a single run
+        opennlp, in_python = self.__split_requests__(requests)
+        runs = [([i], lambda i=i: [self.__run__(*requests[i])]) for i in opennlp]
+        if in_python:
+            models = [requests[i][1] for i in in_python]
+            runs.append((in_python, lambda: self.__find_names__(models, requests[in_python[0]][2])))
+        if len(runs) > 1:
+            with ThreadPoolExecutor(max_workers=len(runs)) as executor:
+                results = list(executor.map(lambda run: run[1](), runs))
+        else:
+            results = [run() for _, run in runs]
+        outputs = [None] * len(requests)
+        for (indices, _), result in zip(runs, results):
+            for i, output in zip(indices, result):
+                outputs[i] = output
+        return outputs
+
+
+    async def __arun_requests__(self, requests, timeout=None):
+        opennlp, in_python = self.__split_requests__(requests)
+        runs = [self.__arun__(*requests[i], timeout=timeout) for i in opennlp]
+        if in_python:
+            loop = asyncio.get_event_loop()
+            runs.append(loop.run_in_executor(None, self.__find_names__, [requests[i][1] for i in in_python],
+                                             requests[in_python[0]][2]))
+        results = await asyncio.gather(*runs)
+        outputs = [None] * len(requests)
+        for i, output in zip(opennlp, results):
+            outputs[i] = output
+        if in_python:
+            for i, output in zip(in_python, results[-1]):
+                outputs[i] = output
+        return outputs
+
+
+    def __batches__(self, sentences, batch_size):
+        sentences = iter(sentences)
+        while True:
+            batch = list(islice(sentences, batch_size))
+            if not batch:
+                break
+            yield batch
+
+
+    def __requests__(self, sentences):
+        # OpenNLP runs needed for a batch of sentences, as (tool, model, input lines)
+        if self._model_path is None:
+            raise LookupError('OpenNLP chunker model file is not set!')
+        _input = [' '.join([token[0] + "_" + token[1] for token in tokens]) for tokens in sentences]
+        return [("ChunkerME", self._model_path, _input)]
+
+
+    def __ner_requests__(self, lines):
+        # TokenNameFinder runs over lines of space-separated tokens, one per NER model
+        return []
+
+
+    def __ner_input__(self, sentences):
+        return [' '.join([token if isinstance(token, str) else token[0] for token in tokens]) for tokens in sentences]
+
+
+    def __check_output__(self, output):
+        if output not in ('trees', 'spans', 'iob'):
+            raise ValueError('Unknown output type: {}'.format(output))
+        if output == 'spans' and not self.__ner_requests__([]):
+            raise ValueError('NER models are required for entity spans!')
+
+
+    def __output_requests__(self, sentences, output):
+        if output == 'spans':
+            return self.__ner_requests__(self.__ner_input__(sentences))
+        if output == 'iob':
+            return OpenNLPChunker.__requests__(self, sentences)
+        return self.__requests__(sentences)
+
+
+    def __build_output__(self, sentences, outputs, output):
+        if output == 'trees':
+            return self.__build_parses__(sentences, outputs)
+        if output == 'iob':
+            instrumentation = self._instrumentation
+            with instrumentation.timer('chunk_iob'):
+                tagged = [self.__chunker_output_iob__(chunks) for chunks in outputs[0]]
+            instrumentation.count('sentences', len(sentences))
+            instrumentation.count('tokens', sum(map(len, sentences)))
+            return tagged
+        # Entity spans straight from the TokenNameFinder outputs of each model
+        instrumentation = self._instrumentation
+        with instrumentation.timer('entities'):
+            spans = [self.__merge_spans__([span for names in found for span in self.__name_spans__(names)])
+                     for found in zip(*outputs)]
+        instrumentation.count('sentences', len(sentences))
+        instrumentation.count('tokens', sum(map(len, sentences)))
+        return spans
+
+
+    def __build_parses__(self, sentences, outputs):
+        # Turn the outputs of the runs listed by __requests__ (ChunkerME, followed by TokenNameFinder
+        # for each NER model) into parse trees
+        instrumentation = self._instrumentation
+        with instrumentation.timer('chunk_tree'):
+            trees = [self.__chunker_output_tree__(chunks) for chunks in outputs[0]]
+        if len(outputs) > 1:
+            with instrumentation.timer('entities'):
+                for i, tree in enumerate(trees):
+                    spans = [span for names in outputs[1:] for span in self.__name_spans__(names[i])]
+                    if tree is not None and spans:
+                        trees[i] = self.__attach_entities__(tree, self.__merge_spans__(spans))
+        with instrumentation.timer('normalize'):
+            parses = [None if tree is None else self.__get_nltk_parse_tree__(tree) for tree in trees]
+        instrumentation.count('sentences', len(sentences))
+        instrumentation.count('tokens', sum(map(len, sentences)))
+        return parses
+
+
+    __punctuation__ = frozenset(string.punctuation) - frozenset('()')
+
+    def __chunker_output_tree__(self, output):
+        """
+        Build a chunk tree from a line of ChunkerME output in a single pass.
+        :param output: ChunkerME output line, e.g. '[NP Pierre_NNP Vinken_NNP ] ,_, [NP 61_CD years_NNS ]'
+        :return: Tree with a subtree for every chunk and a (tag word) subtree for every token, or None
+            if the output is malformed
+        """
+        nodes = []
+        chunk = None
+        for token in output.split():
+            if token == ']':
+                if chunk is None:
+                    return None
+                nodes.append(chunk)
+                chunk = None
+            elif token[0] == '[' and '_' not in token:
+                if chunk is not None:
+                    return None
+                chunk = Tree(token[1:], [])
+            else:
+                word, _, tag = token.rpartition('_')
+                if not word or not tag:
+                    return None
+                # Add punctuation tags if use_punc_tag is set
+                if self.use_punc_tag and self.__punctuation__.issuperset(word) \
+                        and self.__punctuation__.issuperset(tag):
+                    word, tag = tag, 'PUNC'
+                node = Tree(tag, [word])
+                if chunk is None:
+                    nodes.append(node)
+                else:
+                    chunk.append(node)
+        if chunk is not None:
+            return None
+        return Tree('S', nodes)
 
-        opennlp_paths = ['.', '/usr/bin', '/usr/local/apache-opennlp', '/opt/local/apache-opennlp', '~/apache-opennlp']
-        opennlp_paths = list(map(os.path.expanduser, opennlp_paths))
 
-        opennlp_bin_name = "opennlp"
-        if sys.platform.startswith("win"):
-            opennlp_bin_name += ".bat"
-        try:
-            self._opennlp_bin = find_binary(opennlp_bin_name, os.path.join(path_to_bin, opennlp_bin_name),
-                                          env_vars=('OPENNLP_HOME', 'OPENNLP'),
-                                          searchpath=opennlp_paths, verbose=verbose)
-        except LookupError:
-            print('Unable to find the Apache OpenNLP run file!')
+    def __chunker_output_iob__(self, output):
+        """
+        Read a line of ChunkerME output into IOB triples in a single pass, without building a tree.
+        :param output: ChunkerME output line, e.g. '[NP Pierre_NNP Vinken_NNP ] ,_, [NP 61_CD years_NNS ]'
+        :return: List of (word, tag, chunk tag) tuples, or None if the output is malformed
+        """
+        triples = []
+        label = None
+        for token in output.split():
+            if token == ']':
+                if label is None:
+                    return None
+                label = None
+            elif token[0] == '[' and '_' not in token:
+                if label is not None:
+                    return None
+                label, prefix = token[1:], 'B-'
+            else:
+                word, _, tag = token.rpartition('_')
+                if not word or not tag:
+                    return None
+                # Unlike the parse trees, the word is kept, so that the text can be recovered from the triples
+                if self.use_punc_tag and self.__punctuation__.issuperset(word) \
+                        and self.__punctuation__.issuperset(tag):
+                    tag = 'PUNC'
+                if label is None:
+                    triples.append((word, tag, 'O'))
+                else:
+                    triples.append((word, tag, prefix + label))
+                    prefix = 'I-'
+        if label is not None:
+            return None
+        return triples
 
 
-    def __parse_punc_tags__(self, output):
-        if self.use_punc_tag == True:
-            return re.sub(r'\(\s*([' + string.punctuation + ']+)\s+([' + string.punctuation + ']+)\s*\)',
-                          r'(PUNC \1)', output)
-        return output
+    def parse(self, tokens, output='trees'):
+        """
+        Chunk a POS-tagged sentence.
+        :param tokens: List of (token, tag) tuples; for 'spans' output, a list of tokens is accepted as well
+        :param output: 'trees' for the parse tree, 'spans' for the named entities only, as
+            (start_token, end_token, label) tuples with exclusive end (ChunkerME is not run for spans), or
+            'iob' for (word, tag, chunk tag) triples with B-/I-/O chunk tags, as nltk.chunk.tree2conlltags()
+            returns for a chunk tree, built without the tree; named entities are not included
+        :return: Parse tree, list of entity spans or list of IOB triples
+        """
+        return self.parse_sents([tokens], output=output)[0]
 
 
-    def __perform_parsing__(self, tokens):
-        _input = ' '.join([token[0] + "_" + token[1] for token in tokens])
+    def parse_sents(self, sentences, batch_size=1000, output='trees'):
+        """
+        Chunk a sequence of POS-tagged sentences, running each OpenNLP tool once per batch of sentences.
+        :param sentences: Iterable of sentences, each given as a list of (token, tag) tuples
+        :param batch_size: Maximum number of sentences sent to a single OpenNLP run
+        :param output: 'trees', 'spans' or 'iob', see parse()
+        :return: List of parse trees, of lists of entity spans or of lists of IOB triples, one per sentence
+        """
+        self.__check_output__(output)
+        parses = []
+        for batch in self.__batches__(sentences, batch_size):
+            outputs = self.__run_requests__(self.__output_requests__(batch, output))
+            parses.extend(self.__build_output__(batch, outputs, output))
+        return parses
 
-        gc.collect()
-        p = Popen([self._opennlp_bin, "ChunkerME", self._model_path],
-                  shell=False, stdin=PIPE, stdout=PIPE, stderr=PIPE)
 
-        if sys.version_info >= (3,):
-            (stdout, stderr) = p.communicate(bytes(_input, 'UTF-8'))
-            stdout = stdout.decode('utf-8')
-        else:
-            (stdout, stderr) = p.communicate(_input)
-
-        # Check the return code.
-        if p.returncode != 0:
-            raise OSError('OpenNLP command failed!')
-
-        # Clean the execution time information
-        output = re.sub(r"\nExecution time:(.*)$", "", stdout)
-        # Transform into compatible parse tree string
-        output = self.__encode__(output)
-        output = output.replace("[", "(").replace("]", " )")
-        pattern = re.compile(r'\s+([^_\(\)]+)_([^_\(\)]+)\s+')
-        output = re.sub(pattern, r' (\2 \1) ', output)
-        output = re.sub(pattern, r' (\2 \1) ', output)
-        # Add punctuation tags if use_punc_tag is set
-        output = self.__parse_punc_tags__(output)
-        output = "(S {} )".format(output)
+    def parse_stream(self, sentences, window=1000, output='trees'):
+        """
+        Chunk an iterable of POS-tagged sentences of any length, yielding parse trees as soon as they
+        are available. Dedicated processes are started for the stream (ChunkerME and, for the NER
+        chunkers, TokenNameFinder for each model); they are fed from a single thread and at most
+        window sentences are in flight, so memory use does not depend on the number of sentences.
+        :param sentences: Iterable of sentences, each given as a list of (token, tag) tuples
+        :param window: Maximum number of sentences sent to each OpenNLP process ahead of the output read back
+        :param output: 'trees', 'spans' or 'iob', see parse()
+        :return: Generator of parse trees, of lists of entity spans or of lists of IOB triples, one per sentence
+        """
+        self.__check_output__(output)
+        if self._client is not None or self._name_finders is not None:
+            # The daemon (or the Python NER engine) processes batches of window sentences
+            for batch in self.__batches__(sentences, window):
+                for parse in self.parse_sents(batch, window, output):
+                    yield parse
+            return
+        tools = [(tool, model) for tool, model, _ in self.__output_requests__([], output)]
+        fan_out = _FanOut(sentences,
+                          lambda tokens: [tokens] + [lines[0] for _, _, lines in self.__output_requests__([tokens], output)],
+                          len(tools) + 1, window)
+        streams = [stream_tool(self._opennlp_bin, tool, model, lines, window, self._instrumentation)
+                   for (tool, model), lines in zip(tools, fan_out.outputs[1:])]
         try:
-            parse = Tree.fromstring(output, remove_empty_top_bracketing=True)
-        except Exception:
-            parse = None
+            for results in zip(fan_out.outputs[0], *streams):
+                yield self.__build_output__([results[0]], [[line] for line in results[1:]], output)[0]
         finally:
-            return parse
+            fan_out.close()
+            for stream in streams:
+                stream.close()
 
 
-    def parse(self, tokens):
-        parse = self.__perform_parsing__(tokens)
-        return self.__get_nltk_parse_tree__(parse)
+    def chunk_file(self, input_path, output_path, format='conll', batch_size=10000, checkpoint=None):
+        """
+        Chunk a file of POS-tagged sentences into an output file, without building parse trees.
+        See nltk_opennlp.files for the formats.
+        :param input_path: Path of the input file, one sentence per line given as word_tag pairs
+            separated by spaces, as written by OpenNLPTagger.tag_file() in the 'opennlp' format
+        :param output_path: Path of the output file
+        :param format: Output format: 'opennlp', 'conll' or 'jsonl'
+        :param batch_size: Number of sentences sent to ChunkerME at once
+        :param checkpoint: Path of a checkpoint file recording the progress; an interrupted job resumes
+            from it when run again
+        :return: Number of sentences processed
+        """
+        return files.chunk_file(self, input_path, output_path, format, batch_size, checkpoint)
 
 
-    __encodings__ = {
-        "(": "xleftbrackx", ")": "xrightbrackx"
-    }
+    def ner_file(self, input_path, output_path, format='conll', batch_size=10000, checkpoint=None):
+        """
+        Find the named entities of a file of tokenized sentences with the NER models of the chunker,
+        writing them to an output file; ChunkerME is not run. See nltk_opennlp.files for the formats.
+        :param input_path: Path of the input file, one sentence per line with tokens separated by spaces
+        :param output_path: Path of the output file
+        :param format: Output format: 'opennlp', 'conll' or 'jsonl'
+        :param batch_size: Number of sentences sent to TokenNameFinder at once
+        :param checkpoint: Path of a checkpoint file recording the progress; an interrupted job resumes
+            from it when run again
+        :return: Number of sentences processed
+        """
+        return files.ner_file(self, input_path, output_path, format, batch_size, checkpoint)
 
-    def __encode__(self, token):
-        if token is None:
-            return token
-        for enc in self.__encodings__:
-            token = token.replace(enc, self.__encodings__[enc])
-        return token
 
+    async def aparse(self, tokens, timeout=None, output='trees'):
+        """
+        Chunk a POS-tagged sentence without blocking the event loop.
+        :param tokens: List of (token, tag) tuples
+        :param timeout: Time limit in seconds, after which asyncio.TimeoutError is raised
+        :param output: 'trees', 'spans' or 'iob', see parse()
+        :return: Parse tree, list of entity spans or list of IOB triples
+        """
+        return (await self.aparse_sents([tokens], timeout, output))[0]
 
-    def __decode_(self, token):
-        if token is None:
-            return token
-        inv_map = {v: k for k, v in self.__encodings__.items()}
-        for enc in inv_map:
-            token = token.replace(enc, inv_map[enc])
-        return token
 
+    async def aparse_sents(self, sentences, timeout=None, output='trees'):
+        """
+        Chunk a list of POS-tagged sentences without blocking the event loop. The OpenNLP tools
+        needed for the sentences run concurrently.
+        :param sentences: List of sentences, each given as a list of (token, tag) tuples
+        :param timeout: Time limit in seconds, after which asyncio.TimeoutError is raised
+        :param output: 'trees', 'spans' or 'iob', see parse()
+        :return: List of parse trees, of lists of entity spans or of lists of IOB triples, one per sentence
+        """
+        self.__check_output__(output)
+        timeout = self._timeout if timeout is None else timeout
+        sentences = list(sentences)
+        # The deadline is passed to the OpenNLP processes as well, so that those which do not answer in time are killed
+        outputs = await asyncio.wait_for(self.__arun_requests__(self.__output_requests__(sentences, output), timeout),
+                                         timeout)
+        return self.__build_output__(sentences, outputs, output)
 
-    def __get_nltk_parse_tree__(self, tree):
 
-        def create_tree(tree):
-            nodes = []
-            for n in tree:
-                subtrees = [subtree for subtree in n.subtrees(filter=lambda k: k != n)]
-                if len(subtrees) > 0:
-                    subnodes = create_tree(n)
-                    nodes.append(ParentedTree(n.label(), subnodes))
+    __name_marker__ = re.compile(r'<START(?::([^>]*))?>|<END>')
+
+    def __name_spans__(self, output):
+        """
+        Read TokenNameFinder output into entity spans.
+        :param output: TokenNameFinder output line, e.g. '<START:person> Pierre Vinken <END> , 61'
+        :return: List of (start_token, end_token, label) tuples; end_token is exclusive
+        """
+        spans = []
+        index = 0
+        start = label = None
+        for token in output.split():
+            marker = self.__name_marker__.match(token)
+            if marker is None or marker.end() != len(token):
+                index += 1
+            elif token == '<END>':
+                if start is not None and label:
+                    spans.append((start, index, label))
+                start = None
+            else:
+                start, label = index, marker.group(1)
+        return spans
+
+
+    def __merge_spans__(self, spans):
+        """
+        Resolve overlapping entity spans, given in priority order (the order of the NER models).
+        As in OpenNLP's multi-model TokenNameFinder, the leftmost span is kept and then the longest
+        one; identical ranges keep the label of the earliest model. Spans overlapping a kept span
+        are dropped.
+        :param spans: List of (start_token, end_token, label) tuples
+        :return: Sorted list of non-overlapping spans
+        """
+        ordered = sorted(enumerate(spans), key=lambda item: (item[1][0], -item[1][1], item[0]))
+        merged = []
+        for _, span in ordered:
+            if not merged or span[0] >= merged[-1][1]:
+                merged.append(span)
+        return merged
+
+
+    def __attach_entities__(self, tree, spans):
+        """
+        Add entity nodes (labelled with the upper-cased entity type) to a chunk tree in one pass.
+        An entity which covers a whole NP chunk replaces its label; one inside a chunk becomes a
+        subtree of it; one covering whole top-level constituents merges their tokens. Entities that
+        cross a chunk boundary are left out.
+        :param tree: Chunk tree as built from ChunkerME output
+        :param spans: Non-overlapping (start_token, end_token, label) tuples
+        :return: New chunk tree
+        """
+        def is_chunk(node):
+            return len(node) > 0 and isinstance(node[0], Tree)
+
+        children = list(tree)
+        # Constituent and position within the chunk (None for tokens outside chunks) of each token
+        positions = []
+        for i, node in enumerate(children):
+            if is_chunk(node):
+                positions.extend((i, j) for j in range(len(node)))
+            else:
+                positions.append((i, None))
+
+        inner, outer = {}, {}
+        for start, end, label in spans:
+            if end > len(positions) or start >= end:
+                continue
+            (i, j), (k, l) = positions[start], positions[end - 1]
+            whole_start = j is None or j == 0
+            whole_end = l is None or l == len(children[k]) - 1
+            label = label.upper()
+            if i == k and j is not None and not (whole_start and whole_end and children[i].label() == 'NP'):
+                inner.setdefault(i, []).append((j, l + 1, label))
+            elif whole_start and whole_end:
+                outer[i] = (k, label)
+
+        nodes = []
+        i = 0
+        while i < len(children):
+            if i in outer:
+                k, label = outer[i]
+                nodes.append(Tree(label, [leaf for node in children[i:k + 1]
+                                          for leaf in (node if is_chunk(node) else [node])]))
+                i = k + 1
+                continue
+            node = children[i]
+            if i in inner:
+                subnodes, last = [], 0
+                for start, end, label in inner[i]:
+                    subnodes.extend(node[last:start])
+                    subnodes.append(Tree(label, node[start:end]))
+                    last = end
+                subnodes.extend(node[last:])
+                node = Tree(node.label(), subnodes)
+            nodes.append(node)
+            i += 1
+        return Tree(tree.label(), nodes)
+
+
+    def __get_nltk_parse_tree__(self, tree):
+        """
+        Convert a chunk tree into the resulting parse tree in a single traversal: chunks and entities
+        keep their labels and get (word, tag) leaves, and tokens outside of them become (word, tag)
+        leaves of the root.
+        :param tree: Chunk tree with (tag word) subtrees for tokens
+        :return: ParentedTree labelled S
+        """
+        def convert(node):
+            children = []
+            for child in node:
+                if len(child) > 0 and not isinstance(child[0], Tree):
+                    children.append((child[0], child.label()))
                 else:
-                    parent_label = n.parent().label() if n.parent() is not None \
-                                                         and n.parent().label() not in ['S', 'ROOT'] else None
-                    nodes.append(ParentedTree(parent_label, [(self.__decode_(n[0]), self.__decode_(n.label()))]))
-            return nodes
-
-        def move_up(tree):
-            for i in range(len(tree[:])):
-                n = tree[i]
-                if isinstance(n, Tree):
-                    subtrees = [(ind, subtree) for ind, subtree in enumerate(n.subtrees(filter=lambda k: k != n or k.label() is None))]
-                    if i == 0:
-                        subtrees = subtrees[::-1]
-                    for ind, subtree in subtrees:
-                        if subtree.label() == n.label() or subtree.label() is None:
-                            parent = subtree.parent()
-                            if parent is not None:
-                                parent.remove(subtree)
-                            subsub = [s for s in subtree.subtrees(filter=lambda k: k != subtree)]
-                            if len(subsub) == 0:
-                                for k in range(len(subtree.leaves())-1, -1, -1):
-                                    if parent is not None:
-                                        parent.insert(i, subtree.leaves()[k])
-                            else:
-                                move_up(n)
-            return tree
-
-        tree = ParentedTree.convert(tree)
-        new_tree = ParentedTree('S', create_tree(tree))
-        print(new_tree)
-        return move_up(new_tree)
+                    children.append(ParentedTree(child.label(), convert(child)))
+            return children
+
+        return ParentedTree('S', convert(tree))
 
 
 class OpenNERChunker(OpenNLPChunker):
 
     def __init__(self, path_to_ner_model = None, *args, **kwargs):
-        OpenNLPChunker.__init__(self, *args, **kwargs)
         self._ner_model = path_to_ner_model
+        OpenNLPChunker.__init__(self, *args, **kwargs)
 
 
-    def parse(self, tokens):
-
-        treeObj = self.__perform_parsing__(tokens)
-        treeStr = treeObj.__str__()
-
-        _input = ' '.join([token[0] for token in tokens])
+    def __requests__(self, sentences):
+        return OpenNLPChunker.__requests__(self, sentences) + self.__ner_requests__(self.__ner_input__(sentences))
 
-        gc.collect()
-        p = Popen([self._opennlp_bin, "TokenNameFinder", self._ner_model],
-                  shell=False, stdin=PIPE, stdout=PIPE, stderr=PIPE)
 
-        if sys.version_info >= (3,):
-            (stdout, stderr) = p.communicate(bytes(_input, 'UTF-8'))
-            stdout = stdout.decode('utf-8')
-        else:
-            (stdout, stderr) = p.communicate(_input)
-
-        # Check the return code.
-        if p.returncode != 0:
-            raise OSError('OpenNLP command failed!')
-
-        # Clean the execution time information
-        output = re.sub(r"\nExecution time:(.*)$", "", stdout)
-        # Extract entities
-        tag_match = re.compile('<START:(.*?)>(.*?)<END>')
-        matches = tag_match.findall(output)
-        for match in matches:
-            tagname = match[0].upper()
-            pattern = '\s+'.join('\(\s*[A-Z]+\s+' + token + '\s*\)'
-                                 for token in match[1].strip().split(' '))
-            tpattern = '(?P<token>'+ pattern + ')'
-            tagged_pattern = '('+ tagname + ' \g<token>)'
-            treeStr = re.sub(tpattern, tagged_pattern, treeStr, flags=re.UNICODE)
-            # "Move up" NER tags when possible
-            treeStr = re.sub('\(\s*NP\s+(?P<subtree>\(' + tagname + '(.*)\s*\)\s*\))\s*\)',
-                             '\g<1>', treeStr, flags=re.UNICODE)
-        # Add punctuation tags if use_punc_tag is set
-        treeStr = self.__parse_punc_tags__(treeStr)
-        try:
-            parse = Tree.fromstring(treeStr, remove_empty_top_bracketing=True)
-            parse = self.__get_nltk_parse_tree__(parse)
-        except Exception:
-            parse = None
-        finally:
-            return parse
+    def __ner_requests__(self, lines):
+        return [("TokenNameFinder", self._ner_model, lines)] if self._ner_model is not None else []
 
 
 
 class OpenNERChunkerMulti(OpenNLPChunker):
 
     def __init__(self, ner_models = [], *args, **kwargs):
-        OpenNLPChunker.__init__(self, *args, **kwargs)
         self._ner_models = ner_models
+        OpenNLPChunker.__init__(self, *args, **kwargs)
 
 
-    def parse(self, tokens):
-
-        treeObj = self.__perform_parsing__(tokens)
-        treeStr = treeObj.__str__()
-
-        _input = ' '.join([token[0] for token in tokens])
+    def __requests__(self, sentences):
+        return OpenNLPChunker.__requests__(self, sentences) + self.__ner_requests__(self.__ner_input__(sentences))
 
-        for model in self._ner_models:
-            gc.collect()
-            p = Popen([self._opennlp_bin, "TokenNameFinder", model],
-                      shell=False, stdin=PIPE, stdout=PIPE, stderr=PIPE)
 
-            if sys.version_info >= (3,):
-                (stdout, stderr) = p.communicate(bytes(_input, 'UTF-8'))
-                stdout = stdout.decode('utf-8')
-            else:
-                (stdout, stderr) = p.communicate(_input)
-
-            # Check the return code.
-            if p.returncode != 0:
-                raise OSError('OpenNLP command failed!')
-
-            # Clean the execution time information
-            output = re.sub(r"\nExecution time:(.*)$", "", stdout)
-            # Extract entities
-            tag_match = re.compile('<START:(.*?)>(.*?)<END>')
-            matches = tag_match.findall(output)
-            for match in matches:
-                tagname = match[0].upper()
-                pattern = '\s+'.join('\(\s*[A-Z]+\s+' + token + '\s*\)'
-                                     for token in match[1].strip().split(' '))
-                tpattern = '(?P<token>'+ pattern + ')'
-                tagged_pattern = '('+ tagname + ' \g<token>)'
-                treeStr = re.sub(tpattern, tagged_pattern, treeStr, flags=re.UNICODE)
-                # "Move up" NER tags when possible
-                treeStr = re.sub('\(\s*NP\s+(?P<subtree>\(' + tagname + '(.*)\s*\)\s*\))\s*\)',
-                                 '\g<1>', treeStr, flags=re.UNICODE)
-        # Add punctuation tags if use_punc_tag is set
-        treeStr = self.__parse_punc_tags__(treeStr)
-        try:
-            parse = Tree.fromstring(treeStr, remove_empty_top_bracketing=True)
-            parse = self.__get_nltk_parse_tree__(parse)
-        except Exception:
-            parse = None
-        finally:
-            return parse
+    def __ner_requests__(self, lines):
+        return [("TokenNameFinder", model, lines) for model in self._ner_models]
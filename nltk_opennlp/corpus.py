@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: Compact storage of tagged corpora
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for storing large POS-tagged corpora compactly. Instead of a (word, tag) tuple of two
+strings per token, the words are kept UTF-8 encoded in one contiguous buffer with an array of their
+offsets, and the tags as 16-bit ids into an interned tag set, with an array of sentence boundaries.
+"""
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _frombuffer(buffer, dtype):
+    # numpy.frombuffer() does not accept empty buffers in all versions
+    return numpy.frombuffer(buffer, dtype=dtype) if len(buffer) else numpy.zeros(0, dtype=dtype)
+
+
+class TaggedCorpus(object):
+    """
+    Sequence of POS-tagged sentences in columnar form. Indexing decodes a single sentence into a list
+    of (word, tag) tuples; slicing returns a corpus sharing the buffers of this one, without copying.
+    Sentences can only be added to a corpus which is not a slice of another one.
+    """
+
+    def __init__(self, sentences=None):
+        """
+        :param sentences: Iterable of sentences, each given as a list of (word, tag) tuples
+        """
+        self._data = bytearray()
+        # Offsets of the words in _data, and of the sentences in _tags, each starting with 0
+        self._token_offsets = array('Q', [0])
+        self._tags = array('H')
+        self._sentence_offsets = array('Q', [0])
+        self._tagset = []
+        self._tag_ids = {}
+        self._start = 0
+        self._stop = None
+        if sentences is not None:
+            self.extend(sentences)
+
+
+    def __len__(self):
+        return self.__stop__() - self._start
+
+
+    def __stop__(self):
+        return len(self._sentence_offsets) - 1 if self._stop is None else self._stop
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('Only contiguous slices of a corpus are supported!')
+            view = TaggedCorpus.__new__(TaggedCorpus)
+            view.__dict__.update(self.__dict__)
+            view._start = self._start + start
+            view._stop = self._start + max(start, stop)
+            return view
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Sentence index out of range')
+        index += self._start
+        tokens = range(self._sentence_offsets[index], self._sentence_offsets[index + 1])
+        return [(self.__word__(i), self._tagset[self._tags[i]]) for i in tokens]
+
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+    def __word__(self, token):
+        return self._data[self._token_offsets[token]:self._token_offsets[token + 1]].decode('utf-8')
+
+
+    def __tag_id__(self, tag):
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is None:
+            if len(self._tagset) > 0xFFFF:
+                raise ValueError('Too many distinct tags!')
+            tag_id = self._tag_ids[tag] = len(self._tagset)
+            self._tagset.append(tag)
+        return tag_id
+
+
+    def __check_appendable__(self):
+        if self._stop is not None:
+            raise ValueError('Cannot add sentences to a slice of a corpus!')
+
+
+    def append(self, sentence):
+        """
+        Add a sentence.
+        :param sentence: List of (word, tag) tuples
+        """
+        self.__check_appendable__()
+        for word, tag in sentence:
+            self._data += word.encode('utf-8')
+            self._token_offsets.append(len(self._data))
+            self._tags.append(self.__tag_id__(tag))
+        self._sentence_offsets.append(len(self._tags))
+
+
+    def extend(self, sentences):
+        """
+        Add sentences.
+        :param sentences: Iterable of sentences, each given as a list of (word, tag) tuples
+        """
+        for sentence in sentences:
+            self.append(sentence)
+
+
+    def __append_output__(self, output):
+        # Add a sentence from a line of POSTagger output (word_tag pairs), without building tuples
+        self.__check_appendable__()
+        for tagged_word in output.split():
+            word, _, tag = tagged_word.rpartition('_')
+            self._data += word.encode('utf-8')
+            self._token_offsets.append(len(self._data))
+            self._tags.append(self.__tag_id__(tag))
+        self._sentence_offsets.append(len(self._tags))
+
+
+    @property
+    def tagset(self):
+        """Tuple of the distinct tags; tag ids are indices into it"""
+        return tuple(self._tagset)
+
+
+    @property
+    def num_tokens(self):
+        """Total number of tokens of the sentences"""
+        return self._sentence_offsets[self.__stop__()] - self._sentence_offsets[self._start]
+
+
+    def words(self, index):
+        """
+        :param index: Sentence index
+        :return: List of the words of a sentence
+        """
+        return [word for word, _ in self[index]]
+
+
+    def tag_ids(self, index):
+        """
+        :param index: Sentence index
+        :return: Array of the tag ids of a sentence
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Sentence index out of range')
+        index += self._start
+        return self._tags[self._sentence_offsets[index]:self._sentence_offsets[index + 1]]
+
+
+    def to_lists(self):
+        """
+        :return: List of lists of (word, tag) tuples, one per sentence, as returned by OpenNLPTagger.tag_sents()
+        """
+        return list(self)
+
+
+    def to_numpy(self):
+        """
+        Export the corpus as NumPy arrays. The tag ids and the word buffer share memory with the corpus,
+        which cannot grow while they are referenced.
+        :return: Dictionary of arrays: 'tags' (uint16 tag ids of all tokens), 'sentence_offsets' (the
+            tokens of sentence i are tags[sentence_offsets[i]:sentence_offsets[i + 1]]), 'data' (uint8
+            UTF-8 encoded words) and 'token_offsets' (word i is data[token_offsets[i]:token_offsets[i + 1]])
+        """
+        if numpy is None:
+            raise ImportError('NumPy is required for exporting a corpus to arrays!')
+        sentences = _frombuffer(self._sentence_offsets, numpy.uint64)[self._start:self.__stop__() + 1]
+        first, last = int(sentences[0]), int(sentences[-1])
+        tokens = _frombuffer(self._token_offsets, numpy.uint64)[first:last + 1]
+        start, end = int(tokens[0]), int(tokens[-1])
+        return {'tags': _frombuffer(self._tags, numpy.uint16)[first:last],
+                'sentence_offsets': (sentences - first).astype(numpy.int64),
+                'data': _frombuffer(self._data, numpy.uint8)[start:end],
+                'token_offsets': (tokens - start).astype(numpy.int64)}
@@ -0,0 +1,873 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: In-process engine for OpenNLP models
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for running Apache OpenNLP POS and name finder models without Java. Model archives
+(such as en-pos-maxent.bin, en-pos-perceptron.bin and en-ner-person.bin) are read directly: the binary
+maxent (GIS) or perceptron model, the tag dictionary and the n-gram dictionary of POS models, and the
+feature generator descriptor of name finder models. Features are generated as by OpenNLP's
+DefaultPOSContextGenerator and DefaultNameContextGenerator, and outcomes are found by the same beam
+search, so that the tags and names match those of the POSTagger and TokenNameFinder command line tools.
+Features of the tokens which do not depend on the outcomes are generated once per sentence for all
+name finder models using the same feature generators.
+
+The parameters of each feature are kept in flat arrays (outcome ids and weights, with offsets per
+feature); outcomes are scored with NumPy when it is installed, and in pure Python otherwise. Loaded
+models are cached, so taggers using the same model file share it.
+"""
+
+import math
+import os
+import re
+import struct
+import threading
+import unicodedata
+import xml.etree.ElementTree as ElementTree
+import zipfile
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_int = struct.Struct('>i')
+_double = struct.Struct('>d')
+_ushort = struct.Struct('>H')
+
+# Sequences scoring below this are dropped by the beam search, as in OpenNLP
+_min_sequence_score = -100000.0
+_default_beam_size = 3
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+class _Reader(object):
+    # Reader of values written by java.io.DataOutputStream
+
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+
+
+    def read_int(self):
+        value = _int.unpack_from(self._data, self._position)[0]
+        self._position += 4
+        return value
+
+
+    def read_double(self):
+        value = _double.unpack_from(self._data, self._position)[0]
+        self._position += 8
+        return value
+
+
+    def read_doubles(self, count):
+        values = struct.unpack_from('>{}d'.format(count), self._data, self._position)
+        self._position += 8 * count
+        return values
+
+
+    def read_utf(self):
+        length = _ushort.unpack_from(self._data, self._position)[0]
+        raw = self._data[self._position + 2:self._position + 2 + length]
+        self._position += 2 + length
+        try:
+            return raw.decode('utf-8')
+        except UnicodeDecodeError:
+            # Modified UTF-8: NUL is written as two bytes, and supplementary characters as surrogate pairs
+            text = raw.replace(b'\xc0\x80', b'\x00').decode('utf-8', 'surrogatepass')
+            return text.encode('utf-16', 'surrogatepass').decode('utf-16')
+
+
+class MaxentModel(object):
+    """
+    Maxent (GIS) or perceptron model of OpenNLP, as read from its binary format.
+    """
+
+    def __init__(self, model_type, outcomes, predicates, offsets, outcome_ids, parameters,
+                 correction_constant=1, correction_param=0.0):
+        """
+        :param model_type: 'GIS' or 'Perceptron'
+        :param outcomes: List of outcome labels
+        :param predicates: List of predicate (feature) names
+        :param offsets: Array of len(predicates) + 1 offsets; the parameters of predicate i are at
+            offsets[i]:offsets[i + 1] in outcome_ids and parameters
+        :param outcome_ids: Array of the outcome ids of the parameters
+        :param parameters: Array of the parameter weights
+        """
+        self.model_type = model_type
+        self.outcomes = outcomes
+        self._index = dict((predicate, i) for i, predicate in enumerate(predicates))
+        self._offsets = offsets
+        self._outcome_ids = outcome_ids
+        self._parameters = parameters
+        self._correction_constant = correction_constant
+        self._correction_param = correction_param
+        if numpy is not None:
+            self._np_offsets = numpy.frombuffer(offsets, dtype=numpy.int64)
+            self._np_outcome_ids = numpy.frombuffer(outcome_ids, dtype=numpy.uint16) if len(outcome_ids) \
+                else numpy.zeros(0, dtype=numpy.uint16)
+            self._np_parameters = numpy.frombuffer(parameters, dtype=numpy.float64) if len(parameters) \
+                else numpy.zeros(0, dtype=numpy.float64)
+
+
+    def __len__(self):
+        return len(self._index)
+
+
+    def eval(self, context):
+        """
+        :param context: List of predicate names; unknown ones are ignored
+        :return: List of outcome probabilities
+        """
+        return self.eval_all([context])[0]
+
+
+    def eval_all(self, contexts):
+        """
+        :param contexts: List of contexts, each a list of predicate names
+        :return: List of lists of outcome probabilities, one per context
+        """
+        contexts = [self.ids(context) for context in contexts]
+        if numpy is not None:
+            return self.__probabilities_numpy__(contexts).tolist()
+        return [self.__probabilities__(s, c) for s, c in zip(*self.__sums__(contexts))]
+
+
+    def ids(self, predicates):
+        """
+        :param predicates: List of predicate names
+        :return: List of the ids of the predicates known to the model
+        """
+        index = self._index
+        return [index[predicate] for predicate in predicates if predicate in index]
+
+
+    def sums(self, contexts):
+        """
+        :param contexts: List of contexts, each a list of predicate ids (see ids())
+        :return: Pair of lists of the parameter sums and of the numbers of parameters of each outcome,
+            one list per context
+        """
+        if numpy is not None:
+            prior, numfeats = self.__sums_numpy__(contexts)
+            return prior.tolist(), numfeats.tolist()
+        return self.__sums__(contexts)
+
+
+    def best(self, contexts, size, base=None):
+        """
+        Outcomes scoring among the best for each context.
+        :param contexts: List of contexts, each a list of predicate ids (see ids())
+        :param size: Number of best outcomes; more are returned when several score the same
+        :param base: Pair of the parameter sums and numbers of parameters of each outcome (see sums()) of
+            predicates preceding those of every context, or None
+        :return: List of (list of (outcome id, probability) of the best outcomes in outcome order,
+            list of all outcome probabilities) pairs, one per context
+        """
+        size = min(size, len(self.outcomes))
+        if numpy is None or base is not None:
+            # A few predicates added to the base sums are scored faster without NumPy
+            probabilities = [self.__probabilities__(s, c) for s, c in zip(*self.__sums__(contexts, base))]
+            thresholds = [sorted(row)[len(row) - size] for row in probabilities]
+            return [([(i, p) for i, p in enumerate(row) if p >= threshold], row)
+                    for row, threshold in zip(probabilities, thresholds)]
+        probabilities = self.__probabilities_numpy__(contexts)
+        rank = len(self.outcomes) - size
+        thresholds = numpy.partition(probabilities, rank, axis=1)[:, rank]
+        rows, ids = numpy.nonzero(probabilities >= thresholds[:, None])
+        best = [[] for _ in contexts]
+        for row, i, p in zip(rows.tolist(), ids.tolist(), probabilities[rows, ids].tolist()):
+            best[row].append((i, p))
+        return list(zip(best, probabilities))
+
+
+    def __sums__(self, contexts, base=None):
+        offsets, outcome_ids, parameters = self._offsets, self._outcome_ids, self._parameters
+        num_outcomes = len(self.outcomes)
+        sums, counts = [], []
+        for context in contexts:
+            if base is None:
+                prior, numfeats = [0.0] * num_outcomes, [0] * num_outcomes
+            else:
+                prior, numfeats = list(base[0]), list(base[1])
+            for i in context:
+                for j in range(offsets[i], offsets[i + 1]):
+                    prior[outcome_ids[j]] += parameters[j]
+                    numfeats[outcome_ids[j]] += 1
+            sums.append(prior)
+            counts.append(numfeats)
+        return sums, counts
+
+
+    def __probabilities__(self, prior, numfeats):
+        if self.model_type == 'Perceptron':
+            scale = max([1.0] + [abs(value) for value in prior])
+            prior = [math.exp(value / scale) for value in prior]
+        elif self._correction_param != 0:
+            inverse = 1.0 / self._correction_constant
+            prior = [math.exp(value * inverse + (1.0 - float(count) / self._correction_constant) *
+                              self._correction_param) for value, count in zip(prior, numfeats)]
+        else:
+            inverse = 1.0 / self._correction_constant
+            prior = [math.exp(value * inverse) for value in prior]
+        normal = 0.0
+        for value in prior:
+            normal += value
+        return [value / normal for value in prior]
+
+
+    def __sums_numpy__(self, contexts, counts=True):
+        # All parameters of all contexts are gathered and summed per (context, outcome) by one bincount,
+        # which adds them in the order of the predicates, as OpenNLP does
+        num_outcomes = len(self.outcomes)
+        rows, ids = [], []
+        for row, context in enumerate(contexts):
+            rows.extend([row] * len(context))
+            ids.extend(context)
+        ids = numpy.array(ids, dtype=numpy.int64)
+        starts = self._np_offsets[ids]
+        lengths = self._np_offsets[ids + 1] - starts
+        ends = numpy.cumsum(lengths)
+        positions = numpy.arange(int(ends[-1]) if len(ends) else 0) + numpy.repeat(starts - (ends - lengths), lengths)
+        bins = numpy.repeat(numpy.array(rows, dtype=numpy.int64), lengths) * num_outcomes + \
+            self._np_outcome_ids[positions]
+        size = len(contexts) * num_outcomes
+        prior = numpy.bincount(bins, weights=self._np_parameters[positions], minlength=size).reshape(-1, num_outcomes)
+        numfeats = numpy.bincount(bins, minlength=size).reshape(-1, num_outcomes) if counts else None
+        return prior, numfeats
+
+
+    def __probabilities_numpy__(self, contexts):
+        prior, numfeats = self.__sums_numpy__(contexts, self.model_type != 'Perceptron' and
+                                              self._correction_param != 0)
+        if self.model_type == 'Perceptron':
+            scale = numpy.maximum(numpy.abs(prior).max(axis=1), 1.0)
+            prior = numpy.exp(prior / scale[:, None])
+        elif self._correction_param != 0:
+            prior = numpy.exp(prior * (1.0 / self._correction_constant) +
+                              (1.0 - numfeats / float(self._correction_constant)) * self._correction_param)
+        else:
+            prior = numpy.exp(prior * (1.0 / self._correction_constant))
+        # Normalized by sums added in outcome order, as OpenNLP does
+        return prior / numpy.cumsum(prior, axis=1)[:, -1:]
+
+
+def read_maxent_model(data):
+    """
+    Read a model in the binary format of OpenNLP's GIS and perceptron model writers.
+    :param data: Contents of the model file
+    :return: MaxentModel
+    """
+    reader = _Reader(data)
+    model_type = reader.read_utf()
+    if model_type not in ('GIS', 'Perceptron'):
+        raise ValueError('Unsupported OpenNLP model type: {}'.format(model_type))
+    correction_constant, correction_param = 1, 0.0
+    if model_type == 'GIS':
+        correction_constant = reader.read_int()
+        correction_param = reader.read_double()
+    outcomes = [reader.read_utf() for _ in range(reader.read_int())]
+    if len(outcomes) > 0xFFFF:
+        raise ValueError('Too many outcomes!')
+    # Each pattern is the number of predicates sharing it, followed by their outcome ids
+    patterns = [[int(value) for value in reader.read_utf().split()] for _ in range(reader.read_int())]
+    predicates = [reader.read_utf() for _ in range(reader.read_int())]
+    offsets, outcome_ids, parameters = array('q', [0]), array('H'), array('d')
+    for pattern in patterns:
+        count, pattern_outcomes = pattern[0], pattern[1:]
+        parameters.extend(reader.read_doubles(count * len(pattern_outcomes)))
+        for _ in range(count):
+            outcome_ids.extend(pattern_outcomes)
+            offsets.append(len(outcome_ids))
+    if len(offsets) != len(predicates) + 1:
+        raise ValueError('Invalid OpenNLP model: {} predicates, {} parameter sets'.format(
+            len(predicates), len(offsets) - 1))
+    return MaxentModel(model_type, outcomes, predicates, offsets, outcome_ids, parameters,
+                       correction_constant, correction_param)
+
+
+def read_dictionary(data):
+    """
+    Read an OpenNLP XML dictionary.
+    :param data: Contents of the dictionary file
+    :return: Tuple of a list of (tokens, attributes) entries and whether the dictionary is case sensitive
+    """
+    root = ElementTree.fromstring(data)
+    case_sensitive = root.get('case_sensitive', 'false').lower() == 'true'
+    entries = [([token.text or '' for token in entry.iter('token')], dict(entry.attrib))
+               for entry in root.iter('entry')]
+    return entries, case_sensitive
+
+
+def _read_manifest(data):
+    # Java properties of the model archive
+    properties = {}
+    for line in data.decode('latin-1').splitlines():
+        line = line.strip()
+        if line and line[0] not in '#!':
+            key, _, value = line.partition('=')
+            properties[key.strip()] = value.strip()
+    return properties
+
+
+def beam_search(model, length, context, valid=None, size=_default_beam_size, base=None):
+    """
+    Find the most probable sequence of outcomes, as OpenNLP's BeamSearch does: at each position the
+    size best sequences are extended with the outcomes scoring among the size best for it.
+    :param model: MaxentModel
+    :param length: Length of the sequence
+    :param context: Function taking a position and the outcomes so far and returning the predicate ids
+    :param valid: Function taking a position, the outcomes so far and an outcome, and returning whether
+        the outcome may follow them, or None
+    :param size: Beam size
+    :param base: List of the sums of the predicates which precede those returned by context and do not
+        depend on the outcomes (see MaxentModel.sums()), as pairs, one per position; or None
+    :return: List of outcomes
+    """
+    # Sequences as (score, outcomes), best first
+    beam = [(0.0, [])]
+    for i in range(length):
+        candidates = []
+        best = model.best([context(i, outcomes) for _, outcomes in beam], size, None if base is None else base[i])
+        for (score, outcomes), (top, probabilities) in zip(beam, best):
+            extended = []
+            for scored in (top, enumerate(probabilities)):
+                for p, probability in scored:
+                    outcome = model.outcomes[p]
+                    if valid is not None and not valid(i, outcomes, outcome):
+                        continue
+                    total = score + (math.log(probability) if probability > 0 else float('-inf'))
+                    if total > _min_sequence_score:
+                        extended.append((total, outcomes + [outcome]))
+                # All valid outcomes are tried when none of the best ones may follow
+                if extended or candidates:
+                    break
+            candidates.extend(extended)
+        candidates.sort(key=lambda candidate: -candidate[0])
+        beam = candidates[:size]
+        if not beam:
+            return []
+    return beam[0][1]
+
+
+_has_cap = re.compile('[A-Z]')
+_has_num = re.compile('[0-9]')
+
+
+class POSModel(object):
+    """
+    OpenNLP POS tagger model running in Python.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the OpenNLP POS model .bin file (a zip archive)
+        """
+        self.tag_dictionary = None
+        self._tag_dictionary_case_sensitive = True
+        self._ngrams = None
+        self._ngrams_case_sensitive = True
+        model = None
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+            manifest = _read_manifest(archive.read('manifest.properties')) \
+                if 'manifest.properties' in names else {}
+            for name in names:
+                if name.endswith('.model'):
+                    model = read_maxent_model(archive.read(name))
+                elif name.endswith('.tagdict'):
+                    entries, self._tag_dictionary_case_sensitive = read_dictionary(archive.read(name))
+                    self.tag_dictionary = dict(
+                        (tokens[0] if self._tag_dictionary_case_sensitive else tokens[0].lower(),
+                         frozenset(attributes.get('tags', '').split()))
+                        for tokens, attributes in entries if len(tokens) == 1)
+                elif name.endswith('.dictionary'):
+                    entries, self._ngrams_case_sensitive = read_dictionary(archive.read(name))
+                    self._ngrams = set(tokens[0] if self._ngrams_case_sensitive else tokens[0].lower()
+                                       for tokens, _ in entries if len(tokens) == 1)
+        if model is None:
+            raise ValueError('No POS model found in {}'.format(path))
+        self.model = model
+        self.language = manifest.get('Language')
+        self.beam_size = int(manifest.get('BeamSize', _default_beam_size))
+
+
+    def __in_ngrams__(self, word):
+        if self._ngrams is None:
+            return False
+        return (word if self._ngrams_case_sensitive else word.lower()) in self._ngrams
+
+
+    def __tags__(self, word):
+        # Tags allowed for a word by the tag dictionary, or None if any tag is
+        if self.tag_dictionary is None:
+            return None
+        return self.tag_dictionary.get(word if self._tag_dictionary_case_sensitive else word.lower())
+
+
+    def context(self, index, tokens, tags):
+        """
+        Features of a token, as generated by OpenNLP's DefaultPOSContextGenerator.
+        :param index: Position of the token
+        :param tokens: List of the tokens of the sentence
+        :param tags: Tags of the tokens before the position
+        :return: List of predicate names
+        """
+        lex = tokens[index]
+        nxt = tokens[index + 1] if index + 1 < len(tokens) else '*SE*'
+        nextnext = (tokens[index + 2] if index + 2 < len(tokens) else '*SE*') if index + 1 < len(tokens) else None
+        prev, prevprev, tagprev, tagprevprev = '*SB*', None, None, None
+        if index >= 1:
+            prev, tagprev = tokens[index - 1], tags[index - 1]
+            prevprev = '*SB*'
+            if index >= 2:
+                prevprev, tagprevprev = tokens[index - 2], tags[index - 2]
+
+        features = ['default', 'w=' + lex]
+        if not self.__in_ngrams__(lex):
+            features.extend('suf=' + lex[max(len(lex) - i - 1, 0):] for i in range(4))
+            features.extend('pre=' + lex[:i + 1] for i in range(4))
+            if '-' in lex:
+                features.append('h')
+            if _has_cap.search(lex):
+                features.append('c')
+            if _has_num.search(lex):
+                features.append('d')
+        features.append('p=' + prev)
+        if tagprev is not None:
+            features.append('t=' + tagprev)
+        if prevprev is not None:
+            features.append('pp=' + prevprev)
+            if tagprevprev is not None:
+                features.append('t2=' + tagprevprev + ',' + tagprev)
+        features.append('n=' + nxt)
+        if nextnext is not None:
+            features.append('nn=' + nextnext)
+        return features
+
+
+    def tag(self, tokens):
+        """
+        :param tokens: List of tokens
+        :return: List of tags, one per token
+        """
+        allowed = [self.__tags__(token) for token in tokens]
+        valid = lambda i, tags, tag: allowed[i] is None or tag in allowed[i]
+        return beam_search(self.model, len(tokens), lambda i, tags: self.model.ids(self.context(i, tokens, tags)),
+                           valid, self.beam_size)
+
+
+    def process(self, lines):
+        """
+        Tag lines of whitespace-separated tokens, answering each as the POSTagger command line tool does.
+        :param lines: List of input lines
+        :return: List of output lines of word_tag pairs, one per input line
+        """
+        output = []
+        for line in lines:
+            tokens = line.split()
+            output.append(' '.join('{}_{}'.format(token, tag) for token, tag in zip(tokens, self.tag(tokens))))
+        return output
+
+
+def _load_model(path, model_class):
+    path = os.path.abspath(path)
+    status = os.stat(path)
+    key = (model_class, path, status.st_mtime, status.st_size)
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            model = _models[key] = model_class(path)
+        return model
+
+
+def load_pos_model(path):
+    """
+    Load a POS model once; later calls with the same unchanged file return the same model.
+    :param path: Path of the OpenNLP POS model .bin file
+    :return: POSModel
+    """
+    return _load_model(path, POSModel)
+
+
+# Name finder outcomes, optionally prefixed by the name type, as in 'person-start'
+_start, _continue, _other = 'start', 'cont', 'other'
+_typed_outcome = re.compile(r'(.+)-[A-Za-z0-9_]+$')
+_cap_period = re.compile(r'[A-Z]\.$')
+
+# Feature generators of name finder models without a descriptor, as in OpenNLP's ner-default-features.xml
+_default_feature_generators = b'''<generators>
+  <cache>
+    <generators>
+      <window prevLength="2" nextLength="2"><tokenclass/></window>
+      <window prevLength="2" nextLength="2"><token/></window>
+      <definition/>
+      <prevmap/>
+      <bigram/>
+      <sentence begin="true" end="false"/>
+    </generators>
+  </cache>
+</generators>'''
+_generators = {}
+_generators_lock = threading.Lock()
+_valid_names = {}
+
+
+def _java_lower(token):
+    # Lower case of each character, as OpenNLP's StringUtil.toLowerCase
+    if token.isascii():
+        return token.lower()
+    return ''.join(c.lower()[0] for c in token)
+
+
+def token_class(token):
+    """
+    Class of a token, as computed by OpenNLP's FeatureGeneratorUtil.tokenFeature.
+    :param token: Token
+    :return: 'lc', '2d', '4d', 'an', 'dd', 'ds', 'dc', 'dp', 'num', 'sc', 'ac', 'cp', 'ic' or 'other'
+    """
+    all_lower = all_capital = True
+    initial_capital = letters = False
+    digits = 0
+    symbols = set()
+    for i, c in enumerate(token):
+        category = unicodedata.category(c)
+        if category in ('Lu', 'Ll', 'Lt', 'Lm', 'Lo'):
+            letters = True
+            if category == 'Lu':
+                initial_capital = initial_capital or i == 0
+                all_lower = False
+            else:
+                all_capital = False
+        else:
+            all_lower = all_capital = False
+            if category == 'Nd':
+                digits += 1
+            elif c in '-/,.':
+                symbols.add(c)
+    if all_lower:
+        return 'lc'
+    if digits == 2:
+        return '2d'
+    if digits == 4:
+        return '4d'
+    if digits:
+        if letters:
+            return 'an'
+        for symbol, name in (('-', 'dd'), ('/', 'ds'), (',', 'dc'), ('.', 'dp')):
+            if symbol in symbols:
+                return name
+        return 'num'
+    if all_capital:
+        return 'sc' if len(token) == 1 else 'ac'
+    if _cap_period.match(token):
+        return 'cp'
+    if initial_capital:
+        return 'ic'
+    return 'other'
+
+
+class _Sentence(object):
+    # Tokens of a sentence with their lower case forms and classes, and the features of each position
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.lower = [_java_lower(token) for token in tokens]
+        self.classes = [token_class(token) for token in tokens]
+        self.features = None
+
+
+class _AggregatedFeatures(object):
+
+    def __init__(self, generators):
+        self._generators = generators
+
+
+    def __call__(self, sentence, index):
+        return [feature for generator in self._generators for feature in generator(sentence, index)]
+
+
+class _WindowFeatures(object):
+
+    def __init__(self, generator, previous, following):
+        self._generator = generator
+        self._previous = previous
+        self._following = following
+
+
+    def __call__(self, sentence, index):
+        features = self._generator(sentence, index)
+        for i in range(1, self._previous + 1):
+            if index - i >= 0:
+                features += ['p{}{}'.format(i, feature) for feature in self._generator(sentence, index - i)]
+        for i in range(1, self._following + 1):
+            if index + i < len(sentence.tokens):
+                features += ['n{}{}'.format(i, feature) for feature in self._generator(sentence, index + i)]
+        return features
+
+
+def _token_features(sentence, index):
+    return ['w=' + sentence.lower[index]]
+
+
+class _TokenClassFeatures(object):
+
+    def __init__(self, word_and_class):
+        self._word_and_class = word_and_class
+
+
+    def __call__(self, sentence, index):
+        features = ['wc=' + sentence.classes[index]]
+        if self._word_and_class:
+            features.append('w&c=' + sentence.lower[index] + ',' + sentence.classes[index])
+        return features
+
+
+def _outcome_prior_features(sentence, index):
+    return ['def']
+
+
+def _previous_map_features(sentence, index):
+    # Outcome of the token in the previous sentences of the document; each sentence is a document of
+    # its own, as TokenNameFinder is given an empty line after each one, so there are none
+    return ['pd=null']
+
+
+def _bigram_name_features(sentence, index):
+    tokens, classes = sentence.tokens, sentence.classes
+    features = []
+    if index > 0:
+        features.append('pw,w=' + tokens[index - 1] + ',' + tokens[index])
+        features.append('pwc,wc=' + classes[index - 1] + ',' + classes[index])
+    if index + 1 < len(tokens):
+        features.append('w,nw=' + tokens[index] + ',' + tokens[index + 1])
+        features.append('wc,nc=' + classes[index] + ',' + classes[index + 1])
+    return features
+
+
+class _SentenceFeatures(object):
+
+    def __init__(self, begin, end):
+        self._begin = begin
+        self._end = end
+
+
+    def __call__(self, sentence, index):
+        features = []
+        if self._begin and index == 0:
+            features.append('S=begin')
+        if self._end and index + 1 == len(sentence.tokens):
+            features.append('S=end')
+        return features
+
+
+def _flag(element, name):
+    value = element.get(name)
+    return True if not value else value.lower() == 'true'
+
+
+def _feature_generator(element):
+    # Feature generator of an element of an OpenNLP feature generator descriptor
+    children = list(element)
+    if element.tag == 'generators':
+        return _AggregatedFeatures([_feature_generator(child) for child in children])
+    if element.tag == 'cache':
+        # Features are computed once per sentence anyway
+        return _feature_generator(children[0])
+    if element.tag == 'window':
+        return _WindowFeatures(_feature_generator(children[0]), int(element.get('prevLength')),
+                               int(element.get('nextLength')))
+    if element.tag == 'tokenclass':
+        return _TokenClassFeatures(_flag(element, 'wordAndClass'))
+    if element.tag == 'sentence':
+        return _SentenceFeatures(_flag(element, 'begin'), _flag(element, 'end'))
+    generators = {'token': _token_features, 'definition': _outcome_prior_features,
+                  'prevmap': _previous_map_features, 'bigram': _bigram_name_features}
+    if element.tag not in generators:
+        raise ValueError('Unsupported feature generator: {}'.format(element.tag))
+    return generators[element.tag]
+
+
+def _load_feature_generator(descriptor):
+    with _generators_lock:
+        generator = _generators.get(descriptor)
+        if generator is None:
+            generator = _generators[descriptor] = _feature_generator(ElementTree.fromstring(descriptor))
+        return generator
+
+
+def _name_type(outcome):
+    match = _typed_outcome.match(outcome)
+    return match.group(1) if match else None
+
+
+def _valid_name_sequence(previous, outcome):
+    # OpenNLP's NameFinderSequenceValidator: a name continues only after a start or continuation of its type
+    if outcome.endswith(_continue):
+        if previous is None or previous.endswith(_other):
+            return False
+        if previous.endswith(_continue) or previous.endswith(_start):
+            previous_type, name_type = _name_type(previous), _name_type(outcome)
+            if previous_type is not None or name_type is not None:
+                return name_type is not None and name_type == previous_type
+    return True
+
+
+def _valid_name_outcome(i, outcomes, outcome):
+    key = (outcomes[-1] if outcomes else None, outcome)
+    valid = _valid_names.get(key)
+    if valid is None:
+        valid = _valid_names[key] = _valid_name_sequence(*key)
+    return valid
+
+
+def _name_spans(outcomes):
+    # Spans of the start and continuation outcomes, as decoded by OpenNLP's BioCodec
+    spans = []
+    start = end = None
+    for i, outcome in enumerate(outcomes):
+        if outcome.endswith(_start):
+            if start is not None:
+                spans.append((start, end, _name_type(outcomes[i - 1])))
+            start, end = i, i + 1
+        elif outcome.endswith(_continue):
+            end = i + 1
+        elif outcome.endswith(_other) and start is not None:
+            spans.append((start, end, _name_type(outcomes[i - 1])))
+            start = None
+    if start is not None:
+        spans.append((start, end, _name_type(outcomes[-1])))
+    return spans
+
+
+def name_markup(tokens, spans):
+    """
+    Mark names in a sentence as the TokenNameFinder command line tool does.
+    :param tokens: List of tokens
+    :param spans: List of (start_token, end_token, type) tuples; end_token is exclusive
+    :return: Line of tokens with <START:type> and <END> markers, e.g. '<START:person> Pierre Vinken <END> ,'
+    """
+    markup = []
+    for i, token in enumerate(tokens):
+        for start, end, name_type in spans:
+            if start == i:
+                markup.append('<START>' if name_type is None else '<START:{}>'.format(name_type))
+            if end == i:
+                markup.append('<END>')
+        markup.append(token)
+    markup.extend('<END>' for _, end, _ in spans if end == len(tokens))
+    return ' '.join(markup)
+
+
+class NameFinderModel(object):
+    """
+    OpenNLP name finder (TokenNameFinder) model running in Python.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: Path of the OpenNLP name finder model .bin file (a zip archive)
+        """
+        model = None
+        descriptor = _default_feature_generators
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+            manifest = _read_manifest(archive.read('manifest.properties')) \
+                if 'manifest.properties' in names else {}
+            for name in names:
+                if name.endswith('.model'):
+                    model = read_maxent_model(archive.read(name))
+                elif name.endswith('.featuregen'):
+                    descriptor = archive.read(name)
+        if model is None:
+            raise ValueError('No name finder model found in {}'.format(path))
+        codec = manifest.get('sequenceCodecImplName', 'BioCodec')
+        if not codec.endswith('BioCodec'):
+            raise ValueError('Unsupported sequence codec: {}'.format(codec))
+        self.model = model
+        self.language = manifest.get('Language')
+        self.beam_size = int(manifest.get('BeamSize', _default_beam_size))
+        # Models with the same descriptor share the features of a sentence
+        self.feature_descriptor = descriptor
+        self._generator = _load_feature_generator(descriptor)
+
+
+    def features(self, tokens):
+        """
+        Features of each token which do not depend on the outcomes.
+        :param tokens: List of tokens
+        :return: Sentence object for find()
+        """
+        sentence = _Sentence(tokens)
+        sentence.features = [self._generator(sentence, i) for i in range(len(tokens))]
+        return sentence
+
+
+    def find(self, tokens, sentence=None):
+        """
+        :param tokens: List of tokens
+        :param sentence: Features of the tokens returned by features() of a model with the same
+            feature_descriptor, or None to generate them
+        :return: List of (start_token, end_token, type) tuples of the names; end_token is exclusive and
+            type is None for models without name types
+        """
+        if sentence is None:
+            sentence = self.features(tokens)
+        ids = self.model.ids
+        # The token features are scored once; the beam search only adds the previous outcome features,
+        # which OpenNLP's DefaultNameContextGenerator appends to them
+        base = list(zip(*self.model.sums([ids(features) for features in sentence.features])))
+
+        def context(i, outcomes):
+            previous = outcomes[i - 1] if i > 0 else _other
+            return ids(['po=' + previous, 'pow=' + previous + ',' + tokens[i],
+                        'powf=' + previous + ',' + sentence.classes[i],
+                        'ppo=' + (outcomes[i - 2] if i > 1 else _other)])
+
+        return _name_spans(beam_search(self.model, len(tokens), context, _valid_name_outcome, self.beam_size,
+                                       base))
+
+
+    def process(self, lines):
+        """
+        Find names in lines of whitespace-separated tokens, answering each as the TokenNameFinder
+        command line tool does.
+        :param lines: List of input lines
+        :return: List of output lines with the names marked, one per input line
+        """
+        return find_names([self], lines)[0]
+
+
+def find_names(models, lines):
+    """
+    Find names with several name finder models, generating the features of each sentence once for
+    the models using the same feature generators.
+    :param models: List of NameFinderModel
+    :param lines: List of input lines of whitespace-separated tokens
+    :return: List of lists of output lines as written by TokenNameFinder, one list per model
+    """
+    output = [[] for _ in models]
+    for line in lines:
+        tokens = line.split()
+        sentences = {}
+        for model, found in zip(models, output):
+            sentence = sentences.get(model.feature_descriptor)
+            if sentence is None:
+                sentence = sentences[model.feature_descriptor] = model.features(tokens)
+            found.append(name_markup(tokens, model.find(tokens, sentence)))
+    return output
+
+
+def load_name_finder_model(path):
+    """
+    Load a name finder model once; later calls with the same unchanged file return the same model.
+    :param path: Path of the OpenNLP name finder model .bin file
+    :return: NameFinderModel
+    """
+    return _load_model(path, NameFinderModel)
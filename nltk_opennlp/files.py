@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: File-to-file processing with OpenNLP
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for annotating corpus files with Apache OpenNLP tools, for offline jobs which only
+need an annotated output file. Input is read in large blocks, one sentence per line, and batches of
+lines are passed to OpenNLP as they are; its output is converted to the output format line by line,
+without building tuples or trees. Input of tag_file() and ner_file() is tokenized text (tokens
+separated by spaces), and input of chunk_file() is POSTagger output (word_tag pairs), as written by
+tag_file() in the 'opennlp' format.
+
+Output formats: 'opennlp' (the output lines of the OpenNLP tool, one per input line), 'conll' (a
+line of tab-separated columns per token and an empty line after each sentence: word and tag, word,
+tag and B-/I-/O chunk tag, or word and B-/I-/O entity tag) and 'jsonl' (a JSON object per input
+line with 'tokens' and 'tags', 'chunks' or 'entities', the last two as [start, end, label] token spans).
+
+With a checkpoint file, the input and output offsets are recorded after each batch is written, so
+that an interrupted job resumes from the last completed batch when run again. The checkpoint is
+removed when the job completes. The same functions are available as a command line tool:
+
+    python -m nltk_opennlp.files tag --bin /path/to/opennlp/bin --model en-pos-maxent.bin \\
+        --checkpoint corpus.ckpt corpus.txt corpus.conll
+"""
+
+import argparse
+import json
+import os
+from itertools import islice
+
+formats = ('opennlp', 'conll', 'jsonl')
+_block_size = 1 << 20
+
+
+def _read_checkpoint(checkpoint, input_path):
+    if checkpoint is None or not os.path.exists(checkpoint):
+        return None
+    with open(checkpoint) as f:
+        state = json.load(f)
+    if state.get('input') != os.path.abspath(input_path):
+        raise ValueError('Checkpoint {} belongs to another input file: {}'.format(checkpoint, state.get('input')))
+    return state
+
+
+def _write_checkpoint(checkpoint, state):
+    # Replace the checkpoint atomically, so that a crash leaves either the old or the new one
+    temporary = checkpoint + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, checkpoint)
+
+
+def _lines(input_file):
+    # (line, offset after the line) for each line of the input
+    offset = input_file.tell()
+    for line in input_file:
+        offset += len(line)
+        yield line.decode('utf-8').rstrip('\r\n'), offset
+
+
+def process_file(input_path, output_path, run, record, batch_size=10000, checkpoint=None):
+    """
+    Annotate a file one batch of lines at a time.
+    :param input_path: Path of the input file, one sentence per line
+    :param output_path: Path of the output file
+    :param run: Function taking a list of input lines and returning a list of outputs, one per line
+    :param record: Function taking an input line and its output, and returning the text written for it
+    :param batch_size: Number of lines passed to run at once
+    :param checkpoint: Path of a checkpoint file, used to resume an interrupted job
+    :return: Number of sentences processed (in this run, when resumed)
+    """
+    state = _read_checkpoint(checkpoint, input_path)
+    if state is None:
+        state = {'input': os.path.abspath(input_path), 'input_offset': 0, 'output_offset': 0, 'sentences': 0}
+        mode = 'wb'
+    else:
+        if not os.path.exists(output_path) or os.path.getsize(output_path) < state['output_offset']:
+            raise ValueError('Output file {} does not match the checkpoint {}'.format(output_path, checkpoint))
+        mode = 'r+b'
+    sentences = 0
+    with open(input_path, 'rb', buffering=_block_size) as input_file, \
+            open(output_path, mode, buffering=_block_size) as output_file:
+        # Drop the output written after the last checkpoint
+        input_file.seek(state['input_offset'])
+        output_file.seek(state['output_offset'])
+        output_file.truncate()
+        lines = _lines(input_file)
+        while True:
+            batch = list(islice(lines, batch_size))
+            if not batch:
+                break
+            inputs = [line for line, _ in batch]
+            output_file.write(''.join(record(line, output)
+                                      for line, output in zip(inputs, run(inputs))).encode('utf-8'))
+            sentences += len(batch)
+            if checkpoint is not None:
+                output_file.flush()
+                os.fsync(output_file.fileno())
+                state.update(input_offset=batch[-1][1], output_offset=output_file.tell(),
+                             sentences=state['sentences'] + len(batch))
+                _write_checkpoint(checkpoint, state)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return sentences
+
+
+def _check_format(format):
+    if format not in formats:
+        raise ValueError('Unknown output format: {}'.format(format))
+
+
+def _json(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def _conll(rows):
+    return ''.join('\t'.join(row) + '\n' for row in rows) + '\n'
+
+
+def _iob(length, spans):
+    tags = ['O'] * length
+    for start, end, label in spans:
+        tags[start:end] = ['B-' + label] + ['I-' + label] * (end - start - 1)
+    return tags
+
+
+def tag_file(tagger, input_path, output_path, format='conll', batch_size=10000, checkpoint=None):
+    """
+    POS-tag a file of tokenized sentences.
+    :param tagger: nltk_opennlp.taggers.OpenNLPTagger
+    :param input_path: Path of the input file, one sentence per line with tokens separated by spaces
+    :param output_path: Path of the output file
+    :param format: Output format: 'opennlp', 'conll' or 'jsonl'
+    :param batch_size: Number of sentences sent to OpenNLP at once
+    :param checkpoint: Path of a checkpoint file, used to resume an interrupted job
+    :return: Number of sentences processed
+    """
+    _check_format(format)
+
+    def record(line, tagged):
+        if format == 'opennlp':
+            return tagged + '\n'
+        pairs = [token.rpartition('_') for token in tagged.split()]
+        if format == 'conll':
+            return _conll((word, tag) for word, _, tag in pairs)
+        return _json({'tokens': [word for word, _, _ in pairs], 'tags': [tag for _, _, tag in pairs]})
+
+    run = lambda lines: tagger.__run__([tagger.__sentence_line__(line) for line in lines])
+    return process_file(input_path, output_path, run, record, batch_size, checkpoint)
+
+
+def chunk_file(chunker, input_path, output_path, format='conll', batch_size=10000, checkpoint=None):
+    """
+    Chunk a file of POS-tagged sentences.
+    :param chunker: nltk_opennlp.chunkers.OpenNLPChunker
+    :param input_path: Path of the input file, one sentence per line given as word_tag pairs separated
+        by spaces (POSTagger output)
+    :param output_path: Path of the output file
+    :param format: Output format: 'opennlp', 'conll' or 'jsonl'
+    :param batch_size: Number of sentences sent to OpenNLP at once
+    :param checkpoint: Path of a checkpoint file, used to resume an interrupted job
+    :return: Number of sentences processed
+    """
+    _check_format(format)
+    punctuation = chunker.__punctuation__ if chunker.use_punc_tag else None
+
+    def tokens(chunks):
+        # (word, tag) for each token and (start, end, label) for each chunk of ChunkerME output
+        words, spans, start, label = [], [], None, None
+        for token in chunks.split():
+            if token == ']':
+                if label is not None:
+                    spans.append((start, len(words), label))
+                label = None
+            elif token[0] == '[' and '_' not in token:
+                start, label = len(words), token[1:]
+            else:
+                word, _, tag = token.rpartition('_')
+                if punctuation is not None and punctuation.issuperset(word) and punctuation.issuperset(tag):
+                    tag = 'PUNC'
+                words.append((word, tag))
+        return words, spans
+
+    def record(line, chunks):
+        if format == 'opennlp':
+            return chunks + '\n'
+        words, spans = tokens(chunks)
+        if format == 'conll':
+            return _conll((word, tag, iob) for (word, tag), iob in zip(words, _iob(len(words), spans)))
+        return _json({'tokens': [word for word, _ in words], 'tags': [tag for _, tag in words],
+                      'chunks': [list(span) for span in spans]})
+
+    tool, model, _ = chunker.__requests__([])[0]
+    run = lambda lines: chunker.__run__(tool, model, [' '.join(line.split()) for line in lines])
+
+    return process_file(input_path, output_path, run, record, batch_size, checkpoint)
+
+
+def ner_file(chunker, input_path, output_path, format='conll', batch_size=10000, checkpoint=None):
+    """
+    Find named entities in a file of tokenized sentences with the NER models of a chunker. Entities
+    found by several models are resolved as by the chunker.
+    :param chunker: nltk_opennlp.chunkers.OpenNERChunker or OpenNERChunkerMulti
+    :param input_path: Path of the input file, one sentence per line with tokens separated by spaces
+    :param output_path: Path of the output file
+    :param format: Output format: 'opennlp' (TokenNameFinder markup), 'conll' or 'jsonl'
+    :param batch_size: Number of sentences sent to OpenNLP at once
+    :param checkpoint: Path of a checkpoint file, used to resume an interrupted job
+    :return: Number of sentences processed
+    """
+    _check_format(format)
+    chunker.__check_output__('spans')
+
+    def record(line, spans):
+        tokens = line.split()
+        if format == 'opennlp':
+            starts = dict((start, label) for start, _, label in spans)
+            ends = set(end for _, end, _ in spans)
+            markup = []
+            for i, token in enumerate(tokens + ['']):
+                if i in ends:
+                    markup.append('<END>')
+                if i in starts:
+                    markup.append('<START:{}>'.format(starts[i]))
+                markup.append(token)
+            return ' '.join(markup).strip() + '\n'
+        if format == 'conll':
+            return _conll(zip(tokens, _iob(len(tokens), spans)))
+        return _json({'tokens': tokens, 'entities': [list(span) for span in spans]})
+
+    run = lambda lines: chunker.parse_sents([line.split() for line in lines], len(lines), 'spans')
+
+    return process_file(input_path, output_path, run, record, batch_size, checkpoint)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Annotate corpus files with Apache OpenNLP tools')
+    parser.add_argument('task', choices=('tag', 'chunk', 'ner'),
+                        help='tag: POS-tag tokenized text; chunk: chunk POSTagger output; ner: find named entities')
+    parser.add_argument('input', help='Input file, one sentence per line')
+    parser.add_argument('output', help='Output file')
+    parser.add_argument('--bin', help='Path to bin directory of OpenNLP installation')
+    parser.add_argument('--model', action='append', required=True,
+                        help='OpenNLP model: POS tagger, chunker or NER model; may be repeated for ner')
+    parser.add_argument('--language', default='en', help='Language of the POS tagger model')
+    parser.add_argument('--format', choices=formats, default='conll', help='Output format')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Number of sentences sent to OpenNLP at once')
+    parser.add_argument('--workers', type=int, default=1, help='Number of OpenNLP processes for each model')
+    parser.add_argument('--checkpoint', help='Checkpoint file for resuming an interrupted job')
+    args = parser.parse_args(args)
+
+    # Imported here, as the taggers and chunkers use this module
+    from nltk_opennlp.chunkers import OpenNERChunkerMulti, OpenNLPChunker
+    from nltk_opennlp.taggers import OpenNLPTagger
+    if args.task == 'tag':
+        if len(args.model) > 1:
+            parser.error('A single POS tagger model is required')
+        component = OpenNLPTagger(args.bin, args.model[0], args.language, persistent=True, workers=args.workers)
+        process = component.tag_file
+    elif args.task == 'chunk':
+        if len(args.model) > 1:
+            parser.error('A single chunker model is required')
+        component = OpenNLPChunker(args.bin, args.model[0], persistent=True, workers=args.workers)
+        process = component.chunk_file
+    else:
+        component = OpenNERChunkerMulti(args.model, args.bin, persistent=True, workers=args.workers)
+        process = component.ner_file
+    try:
+        sentences = process(args.input, args.output, args.format, args.batch_size, args.checkpoint)
+    finally:
+        component.close()
+    print('Processed {} sentences'.format(sentences))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: Instrumentation of the OpenNLP wrappers
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for measuring where time goes in the OpenNLP wrappers. The taggers, chunkers and
+workers report per-stage durations and counters to a collector passed as ``instrumentation``.
+
+Stages: ``gc`` (garbage collection before starting a process), ``spawn`` (starting an OpenNLP
+process), ``transfer`` (writing input and reading output of OpenNLP), ``postprocess`` (reading the
+tagger output), ``chunk_tree`` (building chunk trees from ChunkerME output), ``entities`` (attaching
+named entities) and ``normalize`` (building the resulting parse trees).
+
+Counters: ``processes_spawned``, ``bytes_in`` (sent to OpenNLP), ``bytes_out`` (received from
+OpenNLP), ``sentences`` and ``tokens``.
+"""
+
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
+
+
+def _nearest_rank(values, percentile):
+    # Nearest-rank percentile of sorted values
+    return values[max(int(-(-percentile * len(values) // 100)), 1) - 1]
+
+
+class Instrumentation(object):
+    """
+    Collector interface; the default implementation discards all measurements. Subclasses override
+    timing() and count() to store or export them.
+    """
+
+    def timing(self, stage, seconds):
+        """
+        Record the duration of a stage.
+        :param stage: Stage name
+        :param seconds: Duration in seconds
+        """
+        pass
+
+
+    def count(self, counter, value=1):
+        """
+        Increase a counter.
+        :param counter: Counter name
+        :param value: Increment
+        """
+        pass
+
+
+    @contextmanager
+    def timer(self, stage):
+        """Context manager recording the duration of its block as a stage"""
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.timing(stage, default_timer() - start)
+
+
+class CallbackCollector(Instrumentation):
+    """Collector forwarding measurements to callables, e.g. to export them to a metrics system"""
+
+    def __init__(self, on_timing=None, on_count=None):
+        """
+        :param on_timing: Called as on_timing(stage, seconds)
+        :param on_count: Called as on_count(counter, value)
+        """
+        self._on_timing = on_timing
+        self._on_count = on_count
+
+
+    def timing(self, stage, seconds):
+        if self._on_timing is not None:
+            self._on_timing(stage, seconds)
+
+
+    def count(self, counter, value=1):
+        if self._on_count is not None:
+            self._on_count(counter, value)
+
+
+class StatsCollector(Instrumentation):
+    """Collector keeping all measurements in memory and summarizing them with percentiles"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._counters = {}
+
+
+    def timing(self, stage, seconds):
+        with self._lock:
+            self._timings.setdefault(stage, []).append(seconds)
+
+
+    def count(self, counter, value=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + value
+
+
+    def reset(self):
+        """Discard all measurements"""
+        with self._lock:
+            self._timings = {}
+            self._counters = {}
+
+
+    @property
+    def counters(self):
+        """Dictionary of counter values"""
+        with self._lock:
+            return dict(self._counters)
+
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """
+        Summarize the recorded stage durations.
+        :param percentiles: Percentiles to compute
+        :return: Dictionary mapping each stage to a dictionary with the number of measurements
+            ('count'), total, mean and maximum duration and the requested percentiles ('p50', ...),
+            all in seconds
+        """
+        with self._lock:
+            timings = dict((stage, sorted(values)) for stage, values in self._timings.items())
+        summary = {}
+        for stage, values in timings.items():
+            stats = {'count': len(values), 'total': sum(values), 'max': values[-1]}
+            stats['mean'] = stats['total'] / len(values)
+            for percentile in percentiles:
+                stats['p{}'.format(percentile)] = _nearest_rank(values, percentile)
+            summary[stage] = stats
+        return summary
+
+
+    def report(self):
+        """Human-readable summary of the stage durations (in milliseconds) and counters"""
+        lines = ['{:17} {:>8} {:>10} {:>9} {:>9} {:>9} {:>9}'.format(
+            'stage', 'count', 'total', 'mean', 'p50', 'p90', 'p99')]
+        for stage, stats in sorted(self.summary().items()):
+            lines.append('{:17} {:>8} {:>10.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+                stage, stats['count'], stats['total'] * 1e3, stats['mean'] * 1e3,
+                stats['p50'] * 1e3, stats['p90'] * 1e3, stats['p99'] * 1e3))
+        for counter, value in sorted(self.counters.items()):
+            lines.append('{:17} {:>8}'.format(counter, value))
+        return '\n'.join(lines)
+
+
+# Shared collector used when instrumentation is not enabled
+_disabled = Instrumentation()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: Direct Java launcher for OpenNLP
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for starting the OpenNLP command line tools with java directly instead of through the
+opennlp run file, which saves the shell started by the script and allows JVM options (heap size, JIT
+compilation level, garbage collector) to be chosen. The command also uses the class data sharing
+(AppCDS) archive of the OpenNLP jars created by create_cds_archive() (or by the setup_opennlp build
+task), which shortens JVM startup for short-lived processes.
+"""
+
+import glob
+import os
+import shutil
+import sys
+import tempfile
+from subprocess import Popen, PIPE
+from nltk_opennlp.registry import find_opennlp
+from nltk_opennlp.workers import OpenNLPError
+
+_cli_class = 'opennlp.tools.cmdline.CLI'
+
+# File name of the class data sharing archive, kept in the lib directory of the installation
+cds_archive_name = 'opennlp.jsa'
+
+_garbage_collectors = {'serial': 'SerialGC', 'parallel': 'ParallelGC', 'g1': 'G1GC', 'z': 'ZGC',
+                       'shenandoah': 'ShenandoahGC'}
+
+# Input used to load the classes of the tools when creating the class data sharing archive
+_sample_sentence = 'Pierre Vinken , 61 years old , will join the board as a nonexecutive director Nov. 29 .'
+_sample_inputs = {
+    'ChunkerME': 'Pierre_NNP Vinken_NNP ,_, 61_CD years_NNS old_JJ ,_, will_MD join_VB the_DT board_NN ._.',
+    'SentenceDetector': _sample_sentence + ' Mr. Vinken is chairman .\n',
+}
+
+
+def opennlp_home(path_to_bin=None, verbose=False):
+    """
+    :param path_to_bin: Path to bin directory of OpenNLP installation
+    :return: Path of the OpenNLP installation directory, or None if the run file was not found
+    """
+    run_file = find_opennlp(path_to_bin, verbose)
+    if run_file is None:
+        return None
+    return os.path.dirname(os.path.dirname(os.path.realpath(run_file)))
+
+
+def find_java(java=None):
+    """
+    :param java: Path of the java executable; found from JAVA_HOME or PATH when not given
+    :return: Path of the java executable
+    """
+    if java is not None:
+        return java
+    name = 'java.exe' if sys.platform.startswith('win') else 'java'
+    java_home = os.environ.get('JAVA_HOME')
+    if java_home and os.path.isfile(os.path.join(java_home, 'bin', name)):
+        return os.path.join(java_home, 'bin', name)
+    java = shutil.which(name)
+    if java is None:
+        raise LookupError('Unable to find the java executable!')
+    return java
+
+
+def class_path(home):
+    """
+    :param home: Path of the OpenNLP installation directory
+    :return: Class path of the OpenNLP jars, in the same order on every call, as AppCDS requires
+    """
+    jars = sorted(glob.glob(os.path.join(home, 'lib', '*.jar')))
+    if not jars:
+        raise LookupError('No OpenNLP jars found in {}!'.format(os.path.join(home, 'lib')))
+    return os.pathsep.join(jars)
+
+
+class JavaLauncher(object):
+    """
+    Command line of the OpenNLP CLI started with java directly; pass it as the launcher of a tagger,
+    chunker or pipeline.
+    """
+
+    def __init__(self, heap=None, tiered_stop_at_level=None, gc=None, jvm_options=(), java=None, cds_archive=None):
+        """
+        :param heap: Maximum heap size, such as '2g' (-Xmx); the JVM default when not given
+        :param tiered_stop_at_level: Highest JIT compilation tier (-XX:TieredStopAtLevel); 1 starts faster
+            and suits short-lived processes, the default suits persistent ones
+        :param gc: Garbage collector: 'serial', 'parallel', 'g1', 'z' or 'shenandoah'
+        :param jvm_options: Other JVM options, such as ['-Xss4m']
+        :param java: Path of the java executable; found from JAVA_HOME or PATH when not given
+        :param cds_archive: Path of a class data sharing archive; by default the archive created in the
+            lib directory of the installation is used if it exists. False disables class data sharing
+        """
+        if gc is not None and gc not in _garbage_collectors:
+            raise ValueError('Unknown garbage collector: {}'.format(gc))
+        self.heap = heap
+        self.tiered_stop_at_level = tiered_stop_at_level
+        self.gc = gc
+        self.jvm_options = list(jvm_options)
+        self.java = java
+        self.cds_archive = cds_archive
+
+
+    def __jvm_options__(self, home):
+        options = []
+        if self.heap is not None:
+            options.append('-Xmx{}'.format(self.heap))
+        if self.tiered_stop_at_level is not None:
+            options.append('-XX:TieredStopAtLevel={}'.format(self.tiered_stop_at_level))
+        if self.gc is not None:
+            options.append('-XX:+Use{}'.format(_garbage_collectors[self.gc]))
+        archive = self.cds_archive
+        if archive is None:
+            archive = os.path.join(home, 'lib', cds_archive_name)
+            archive = archive if os.path.isfile(archive) else None
+        if archive:
+            options.append('-XX:SharedArchiveFile={}'.format(archive))
+        # As set by the run file
+        log_config = os.path.join(home, 'conf', 'log4j2.xml')
+        if os.path.isfile(log_config):
+            options.append('-Dlog4j.configurationFile={}'.format(log_config))
+        return options + self.jvm_options
+
+
+    def command(self, path_to_bin=None, verbose=False):
+        """
+        Build the command starting the OpenNLP CLI; the tool and model are appended to it.
+        :param path_to_bin: Path to bin directory of OpenNLP installation
+        :return: Tuple of command line arguments, or None if OpenNLP was not found
+        """
+        home = opennlp_home(path_to_bin, verbose)
+        if home is None:
+            return None
+        return tuple([find_java(self.java)] + self.__jvm_options__(home) + ['-cp', class_path(home), _cli_class])
+
+
+def create_cds_archive(path_to_bin=None, runs=(), java=None, archive=None):
+    """
+    Create a class data sharing (AppCDS) archive of the classes loaded by OpenNLP tools, so that the
+    JVMs started by JavaLauncher map them instead of loading and verifying them again. The classes are
+    recorded by running each tool over a sample sentence; requires Java 10 or later.
+    :param path_to_bin: Path to bin directory of OpenNLP installation
+    :param runs: List of (tool, model path) pairs to run, such as [('POSTagger', 'en-pos-maxent.bin')];
+        with no runs only the classes of the CLI itself are archived
+    :param java: Path of the java executable; found from JAVA_HOME or PATH when not given
+    :param archive: Path of the archive; by default it is created in the lib directory of the installation,
+        where JavaLauncher finds it
+    :return: Path of the archive
+    """
+    home = opennlp_home(path_to_bin)
+    if home is None:
+        raise LookupError('Unable to find the Apache OpenNLP run file!')
+    java = find_java(java)
+    archive = archive or os.path.join(home, 'lib', cds_archive_name)
+    # JVM options and class path, which must be the same as those of the archive's users
+    options = list(JavaLauncher(java=java, cds_archive=False).command(path_to_bin)[1:-1])
+
+    def check(p, data=b''):
+        _, stderr = p.communicate(data)
+        if p.returncode != 0:
+            stderr = stderr.decode('utf-8', 'replace').strip()
+            raise OpenNLPError('Creating the class data sharing archive failed!', p.returncode,
+                               stderr.splitlines()[-1] if stderr else '')
+
+    directory = tempfile.mkdtemp(prefix='opennlp-cds-')
+    try:
+        classes = set()
+        for i, (tool, model) in enumerate(list(runs) or [(None, None)]):
+            class_list = os.path.join(directory, '{}.lst'.format(i))
+            data = _sample_inputs.get(tool, _sample_sentence) + '\n'
+            args = [_cli_class, tool, model] if tool is not None else [_cli_class]
+            p = Popen([java, '-Xshare:off', '-XX:DumpLoadedClassList={}'.format(class_list)] + options + args,
+                      stdin=PIPE, stdout=PIPE, stderr=PIPE)
+            check(p, data.encode('utf-8'))
+            with open(class_list) as f:
+                classes.update(line.strip() for line in f if line.strip() and not line.startswith('#'))
+        class_list = os.path.join(directory, 'classes.lst')
+        with open(class_list, 'w') as f:
+            f.write(''.join(name + '\n' for name in sorted(classes)))
+        check(Popen([java, '-Xshare:dump', '-XX:SharedClassListFile={}'.format(class_list),
+                     '-XX:SharedArchiveFile={}'.format(archive)] + options, stdin=PIPE, stdout=PIPE, stderr=PIPE))
+    finally:
+        shutil.rmtree(directory)
+    return archive
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: End-to-end OpenNLP pipeline
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for analyzing raw documents with a chain of Apache OpenNLP tools: SentenceDetector,
+TokenizerME, POSTagger, ChunkerME and TokenNameFinder. Each tool runs as a pipelined stage in its own
+process, so that all stages work at the same time on consecutive sentences, and the output of one
+tool is passed to the next one as is.
+"""
+
+import re
+import threading
+from collections import deque
+from concurrent.futures import Future
+from itertools import chain
+from nltk_opennlp.chunkers import OpenNERChunkerMulti
+from nltk_opennlp.taggers import OpenNLPTagger
+from nltk_opennlp.workers import _FanOut, _start_thread, stream_tool
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+# Marks the end of a document between the stages, and the end of input of a persistent pipeline
+_end = None
+
+
+class OpenNLPPipeline(object):
+
+    def __init__(self, path_to_bin=None, path_to_sentence_model=None, path_to_tokenizer=None, path_to_pos_model=None,
+                 path_to_chunker=None, ner_models=[], language='en', verbose=False, use_punc_tag=False,
+                 persistent=False, window=1000, instrumentation=None, launcher=None):
+        """
+        Initialize the OpenNLPPipeline.
+        :param path_to_bin: Path to bin directory of OpenNLP installation
+        :param path_to_sentence_model: The path to OpenNLP sentence detector .bin file (e.g. en-sent.bin)
+        :param path_to_tokenizer: The path to OpenNLP tokenizer .bin file (e.g. en-token.bin)
+        :param path_to_pos_model: The path to OpenNLP POS tagger .bin file; only required for parse trees
+        :param path_to_chunker: The path to OpenNLP chunker .bin file; only required for parse trees
+        :param ner_models: Paths to OpenNLP NER model .bin files
+        :param language: Language to use; default setting is 'en'.
+        :param use_punc_tag: Whether standalone punctuation marks should be tagged using PUNC tag
+        :param persistent: Keep the processes of all stages running between calls; call close() (or use
+            the pipeline as a context manager) to stop them. Otherwise each call starts its own processes
+        :param window: Maximum number of paragraphs or sentences in flight at each stage
+        :param instrumentation: Collector receiving per-stage timings and counters, such as
+            nltk_opennlp.instrumentation.StatsCollector; disabled by default
+        :param launcher: nltk_opennlp.launcher.JavaLauncher starting OpenNLP with java directly, with its
+            JVM options, instead of the opennlp run file
+        """
+        if path_to_sentence_model is None or path_to_tokenizer is None:
+            raise LookupError('OpenNLP model file is not set!')
+        # A pipeline finding only the entities does not need the tagger
+        self._tagger = None
+        if path_to_pos_model is not None:
+            self._tagger = OpenNLPTagger(path_to_bin, path_to_pos_model, language, verbose,
+                                         instrumentation=instrumentation, launcher=launcher)
+        self._chunker = OpenNERChunkerMulti(ner_models, path_to_bin, path_to_chunker, verbose, use_punc_tag,
+                                            instrumentation=instrumentation, launcher=launcher)
+        self._opennlp_bin = self._chunker._opennlp_bin
+        self._sentence_model = path_to_sentence_model
+        self._tokenizer_model = path_to_tokenizer
+        self._pos_model = path_to_pos_model
+        self._chunker_model = path_to_chunker
+        self._ner_models = ner_models
+        self._persistent = persistent
+        self._window = window
+        self._instrumentation = self._chunker._instrumentation
+        self._lock = threading.Lock()
+        self._run = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        """Stop the processes of a persistent pipeline, if they are running"""
+        with self._lock:
+            run, self._run = self._run, None
+        if run is not None:
+            run[0].put(_end)
+            run[2].join()
+
+
+    __paragraph_break__ = re.compile(r'\n[^\S\n]*\n')
+
+    def __paragraphs__(self, documents):
+        # (offset, paragraph) for each paragraph of the documents, and _end after each document.
+        # Line breaks within a paragraph are replaced by spaces, so that the offsets are kept
+        for document in documents:
+            start = 0
+            for match in chain(self.__paragraph_break__.finditer(document), [None]):
+                end = len(document) if match is None else match.start()
+                if document[start:end].strip():
+                    yield start, document[start:end].replace('\r', ' ').replace('\n', ' ')
+                start = end if match is None else match.end()
+            yield _end
+
+
+    def __stage__(self, items, tools, line, fan_outs):
+        # Run tools over the input lines of items in parallel processes; yield (item, outputs)
+        fan_out = _FanOut(items, lambda item: [item] + [line(item) if item is not _end else ''] * len(tools),
+                          len(tools) + 1, self._window)
+        fan_outs.append(fan_out)
+        streams = [stream_tool(self._opennlp_bin, tool, model, lines, self._window, self._instrumentation)
+                   for (tool, model), lines in zip(tools, fan_out.outputs[1:])]
+        try:
+            for results in zip(fan_out.outputs[0], *streams):
+                yield results[0], results[1:]
+        finally:
+            fan_out.close()
+            for stream in streams:
+                stream.close()
+
+
+    def __sentences__(self, paragraphs):
+        # (offset, sentence) for each sentence found in a paragraph
+        for paragraph, (sentences,) in paragraphs:
+            if paragraph is _end:
+                yield _end
+                continue
+            start, text = paragraph
+            cursor = 0
+            for sentence in sentences:
+                begin = text.find(sentence, cursor)
+                if begin < 0:
+                    begin = cursor
+                cursor = begin + len(sentence)
+                yield start + begin, sentence
+
+
+    def __tokens__(self, sentences):
+        # (token line, token offsets) for each sentence
+        for sentence, (tokenized,) in sentences:
+            if sentence is _end:
+                yield _end
+                continue
+            start, text = sentence
+            offsets = []
+            cursor = 0
+            for token in tokenized.split():
+                begin = text.find(token, cursor)
+                if begin < 0:
+                    begin = cursor
+                cursor = begin + len(token)
+                offsets.append((start + begin, start + cursor))
+            yield tokenized, offsets
+
+
+    def __analyze__(self, documents, tagging=True):
+        """
+        Run the stages over documents.
+        :param tagging: Whether POSTagger and ChunkerME are run; only the entities are found otherwise
+        :return: Generator of lists, one per document, of (token offsets, POSTagger output, ChunkerME
+            output, TokenNameFinder outputs) tuples, one per sentence
+        """
+        fan_outs = []
+        stages = self.__stage__(self.__paragraphs__(documents), [("SentenceDetector", self._sentence_model)],
+                                lambda paragraph: paragraph[1], fan_outs)
+        stages = self.__stage__(self.__sentences__(stages), [("TokenizerME", self._tokenizer_model)],
+                                lambda sentence: sentence[1], fan_outs)
+        # The tokenized sentence is the input of both the tagger and the name finders
+        tools = [("POSTagger", self._pos_model)] if tagging else []
+        tools += [("TokenNameFinder", model) for model in self._ner_models]
+        stages = self.__stage__(self.__tokens__(stages), tools, lambda tokens: tokens[0], fan_outs)
+        if tagging:
+            # ... and the tagger output is the input of the chunker
+            stages = ((tokens, outputs[0], outputs[1:]) if tokens is not _end else _end
+                      for tokens, outputs in stages)
+            stages = self.__stage__(stages, [("ChunkerME", self._chunker_model)],
+                                    lambda tagged: tagged[1], fan_outs)
+            records = ((item[0][1], item[1], chunks, item[2]) if item is not _end else _end
+                       for item, (chunks,) in stages)
+        else:
+            records = ((tokens[1], None, None, names) if tokens is not _end else _end
+                       for tokens, names in stages)
+        try:
+            sentences = []
+            for record in records:
+                if record is _end:
+                    yield sentences
+                    sentences = []
+                else:
+                    sentences.append(record)
+        finally:
+            # Stop the stages fed by other threads as well
+            for fan_out in fan_outs:
+                fan_out.close()
+
+
+    def __result__(self, sentences, output):
+        if output == 'spans':
+            spans = []
+            for offsets, _, _, names in sentences:
+                found = [span for line in names for span in self._chunker.__name_spans__(line)]
+                spans.extend((offsets[start][0], offsets[end - 1][1], label)
+                             for start, end, label in self._chunker.__merge_spans__(found)
+                             if end <= len(offsets))
+            return spans
+        results = []
+        for offsets, tagged, chunks, names in sentences:
+            tokens = self._tagger.__parse_tagged__(tagged)
+            tree = self._chunker.__build_parses__([tokens], [[chunks]] + [[line] for line in names])[0]
+            results.append((tree, offsets))
+        return results
+
+
+    def __check_output__(self, output):
+        if output not in ('trees', 'spans'):
+            raise ValueError('Unknown output type: {}'.format(output))
+        if output == 'spans' and not self._ner_models:
+            raise ValueError('NER models are required for entity spans!')
+        if output == 'trees' and not self.__tagging__():
+            raise LookupError('OpenNLP POS tagger and chunker models are required for parse trees!')
+
+
+    def __tagging__(self):
+        # Whether the POSTagger and ChunkerME stages can be run
+        return self._tagger is not None and self._chunker_model is not None
+
+
+    def __submit__(self, document):
+        # Send a document to the persistent pipeline; the future receives its analysis
+        future = Future()
+        with self._lock:
+            if self._run is None:
+                documents, pending = Queue(), deque()
+                collector = _start_thread(self.__collect__, documents, pending)
+                self._run = (documents, pending, collector)
+            documents, pending, _ = self._run
+            pending.append(future)
+            documents.put(document)
+        return future
+
+
+    def __collect__(self, documents, pending):
+        try:
+            for sentences in self.__analyze__(iter(documents.get, _end), tagging=self.__tagging__()):
+                pending.popleft().set_result(sentences)
+        except BaseException as e:
+            with self._lock:
+                if self._run is not None and self._run[0] is documents:
+                    self._run = None
+                while pending:
+                    pending.popleft().set_exception(e)
+
+
+    def parse(self, document, output='trees'):
+        """
+        Analyze a document.
+        :param document: Text of the document
+        :param output: 'trees' for a (parse tree, token offsets) tuple for each sentence, where token
+            offsets are the (start, end) character offsets of the tree leaves in the document; 'spans'
+            for (start, end, label) character offsets of the named entities
+        :return: List of (parse tree, token offsets) tuples or of entity spans
+        """
+        return list(self.parse_stream([document], output))[0]
+
+
+    def parse_stream(self, documents, output='trees'):
+        """
+        Analyze an iterable of documents of any length, yielding the result for each document as soon as
+        it is available. Memory use does not depend on the number of documents.
+        :param documents: Iterable of document texts
+        :param output: 'trees' or 'spans', see parse()
+        :return: Generator of results, one per document
+        """
+        self.__check_output__(output)
+        if not self._persistent:
+            for sentences in self.__analyze__(documents, tagging=output == 'trees'):
+                yield self.__result__(sentences, output)
+            return
+        futures = deque()
+        for document in documents:
+            futures.append(self.__submit__(document))
+            if len(futures) >= self._window:
+                yield self.__result__(futures.popleft().result(), output)
+        while futures:
+            yield self.__result__(futures.popleft().result(), output)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: Shared OpenNLP backends
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for sharing running Apache OpenNLP tools between taggers and chunkers of the same
+process. Backends are keyed by OpenNLP binary, tool, model and number of processes, reference counted,
+stopped when idle and evicted in least-recently-used order when a memory budget is exceeded. Stopped
+backends start their processes again on next use.
+"""
+
+import os
+import sys
+import threading
+import time
+from nltk.internals import find_binary
+from nltk_opennlp.workers import create_worker
+
+_opennlp_paths = ['.', '/usr/bin', '/usr/local/apache-opennlp', '/opt/local/apache-opennlp', '~/apache-opennlp']
+_binaries = {}
+_binaries_lock = threading.Lock()
+
+
+def find_opennlp(path_to_bin=None, verbose=False):
+    """
+    Find the OpenNLP run file; found paths are cached, so that constructing taggers and chunkers is cheap.
+    :param path_to_bin: Path to bin directory of OpenNLP installation
+    :return: Path to the OpenNLP run file, or None if it was not found
+    """
+    key = (path_to_bin, os.getcwd(), os.environ.get('OPENNLP_HOME'), os.environ.get('OPENNLP'))
+    with _binaries_lock:
+        if key in _binaries:
+            return _binaries[key]
+    opennlp_bin_name = "opennlp"
+    if sys.platform.startswith("win"):
+        opennlp_bin_name += ".bat"
+    try:
+        opennlp_bin = find_binary(opennlp_bin_name,
+                                  os.path.join(path_to_bin, opennlp_bin_name) if path_to_bin else None,
+                                  env_vars=('OPENNLP_HOME', 'OPENNLP'),
+                                  searchpath=list(map(os.path.expanduser, _opennlp_paths)), verbose=verbose)
+    except LookupError:
+        print('Unable to find the Apache OpenNLP run file!')
+        return None
+    with _binaries_lock:
+        _binaries[key] = opennlp_bin
+    return opennlp_bin
+
+
+class _SharedBackend(object):
+    """Handle of a backend held by one tagger or chunker; close() releases it"""
+
+    def __init__(self, registry, key):
+        self._registry = registry
+        self._key = key
+        self._closed = False
+
+
+    def process(self, lines, timeout=None):
+        return self._registry.__use__(self._key).process(lines, timeout)
+
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._registry.__release__(self._key)
+
+
+class _Entry(object):
+
+    def __init__(self, backend, size):
+        self.backend = backend
+        self.size = size
+        self.references = 0
+        self.last_used = time.time()
+        self.running = False
+
+
+class BackendRegistry(object):
+    """
+    Registry of shared persistent OpenNLP backends. Backends not used for idle_ttl seconds are stopped,
+    and removed from the registry when they are not referenced any more. When max_memory is set and
+    the running backends exceed it, the least recently used ones are stopped.
+    """
+
+    def __init__(self, idle_ttl=300, max_memory=None):
+        """
+        :param idle_ttl: Seconds after which an unused backend is stopped; None keeps backends running
+        :param max_memory: Memory budget in bytes for the running backends, each estimated as the size
+            of its model file times its number of processes; None for no limit
+        """
+        self._idle_ttl = idle_ttl
+        self._max_memory = max_memory
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reaper = None
+
+
+    def acquire(self, opennlp_bin, tool, model, workers=1):
+        """
+        Get a shared backend for an OpenNLP tool and model, creating it if needed.
+        :param opennlp_bin: Path to the OpenNLP run file, or the command starting the OpenNLP CLI
+        :param tool: OpenNLP command line tool name, such as POSTagger or ChunkerME
+        :param model: The path to the OpenNLP model .bin file used by the tool
+        :param workers: Number of OpenNLP processes
+        :return: Backend with process(lines) and close() methods; close() releases it
+        """
+        key = (opennlp_bin, tool, os.path.abspath(model), workers)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                try:
+                    size = os.path.getsize(model) * workers
+                except OSError:
+                    size = 0
+                entry = self._entries[key] = _Entry(create_worker(opennlp_bin, tool, model, workers), size)
+            entry.references += 1
+            entry.last_used = time.time()
+            if self._reaper is None and self._idle_ttl is not None:
+                self._reaper = threading.Thread(target=self.__reap__)
+                self._reaper.daemon = True
+                self._reaper.start()
+        return _SharedBackend(self, key)
+
+
+    def __use__(self, key):
+        # Mark a backend as used and running, stopping others if the memory budget is exceeded
+        evicted = []
+        with self._lock:
+            entry = self._entries[key]
+            entry.last_used = time.time()
+            if not entry.running:
+                entry.running = True
+                if self._max_memory is not None:
+                    running = sorted((other for other in self._entries.values() if other.running and other is not entry),
+                                     key=lambda other: other.last_used)
+                    total = entry.size + sum(other.size for other in running)
+                    while running and total > self._max_memory:
+                        other = running.pop(0)
+                        other.running = False
+                        total -= other.size
+                        evicted.append(other.backend)
+        for backend in evicted:
+            backend.close()
+        return entry.backend
+
+
+    def __release__(self, key):
+        with self._lock:
+            entry = self._entries[key]
+            entry.references -= 1
+            if entry.references > 0 or self._idle_ttl is not None:
+                return
+            # Without idle eviction, backends are stopped as soon as they are not referenced
+            del self._entries[key]
+        entry.backend.close()
+
+
+    def __reap__(self):
+        while not self._stop.wait(min(max(self._idle_ttl / 2.0, 0.1), 60)):
+            self.evict_idle()
+
+
+    def evict_idle(self, idle_ttl=None):
+        """
+        Stop the backends which have not been used for idle_ttl seconds, and remove those which are
+        not referenced.
+        :param idle_ttl: Seconds of inactivity; the idle_ttl of the registry by default
+        :return: Number of stopped backends
+        """
+        idle_ttl = self._idle_ttl if idle_ttl is None else idle_ttl
+        if idle_ttl is None:
+            return 0
+        stopped = []
+        now = time.time()
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if now - entry.last_used < idle_ttl:
+                    continue
+                if entry.references == 0:
+                    del self._entries[key]
+                elif not entry.running:
+                    continue
+                entry.running = False
+                stopped.append(entry.backend)
+        for backend in stopped:
+            backend.close()
+        return len(stopped)
+
+
+    def stats(self):
+        """
+        :return: List of dictionaries describing the backends: tool, model, workers, references,
+            running, estimated size and seconds since last use ('idle')
+        """
+        now = time.time()
+        with self._lock:
+            return [{'tool': key[1], 'model': key[2], 'workers': key[3], 'references': entry.references,
+                     'running': entry.running, 'size': entry.size, 'idle': now - entry.last_used}
+                    for key, entry in self._entries.items()]
+
+
+    def close(self):
+        """Stop all backends and the idle eviction thread"""
+        self._stop.set()
+        with self._lock:
+            entries, self._entries = list(self._entries.values()), {}
+        for entry in entries:
+            entry.backend.close()
+
+
+# Registry shared by the taggers and chunkers created with shared=True
+default_registry = BackendRegistry()
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: Routing of mixed-language batches
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for tagging and chunking batches which mix sentences of several languages. Each
+sentence is given a language code or has its language detected by a stopword and diacritics
+heuristic; sentences are grouped by language, the groups are processed by the tagger or chunker of
+their language in parallel, and the results are returned in input order. The tagger or chunker of a
+language is created on first use, so languages which do not occur start no OpenNLP processes.
+"""
+
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from nltk.chunk.api import ChunkParserI
+from nltk.tag.api import TaggerI
+from nltk_opennlp.chunkers import OpenNERChunkerMulti
+from nltk_opennlp.corpus import TaggedCorpus
+from nltk_opennlp.taggers import OpenNLPTagger, _opennlp_languages
+
+# Frequent function words of each language; 'se' is Swedish, as named by the OpenNLP models
+_stopwords = {
+    'da': 'og i at det er en til på som de med af for ikke der var jeg har et han hun den vi skal også',
+    'de': 'der die das und ist nicht ein eine zu den von mit sich des auf für im dem auch es ich wir sie',
+    'en': 'the and of to is in that it was for on are with as he she they this be at by have not',
+    'es': 'el la de que y en los las un una por con no es para se del al lo como más pero sus',
+    'nl': 'de het een en van is dat niet op te zijn met voor ik je er maar om ook als bij nog wel',
+    'pt': 'o a os as de que e do da em um uma para com não é no na por mais dos das se ao',
+    'se': 'och i att det är en som på den med av för inte jag har till de var ett om så vi men',
+}
+_stopwords = dict((language, frozenset(words.split())) for language, words in _stopwords.items())
+
+# Letters found in only some of the languages, each counting as a stopword match
+_letters = {
+    'da': 'æø', 'de': 'ßü', 'es': 'ñ¿¡', 'pt': 'ãõç', 'se': 'ä', 'nl': 'ĳ',
+}
+_word = re.compile(r'\w+', re.UNICODE)
+
+
+def detect_language(sentence, languages=_opennlp_languages, default=None):
+    """
+    Guess the language of a sentence from its function words and letters.
+    :param sentence: List of tokens, or a string
+    :param languages: Candidate language codes
+    :param default: Language returned when no candidate matches
+    :return: Language code
+    """
+    text = sentence if isinstance(sentence, str) else ' '.join(sentence)
+    words = _word.findall(text.lower())
+    best, best_score = default, 0
+    for language in languages:
+        stopwords = _stopwords.get(language, ())
+        score = sum(1 for word in words if word in stopwords)
+        score += sum(1 for c in text.lower() if c in _letters.get(language, ''))
+        if score > best_score:
+            best, best_score = language, score
+    return best
+
+
+class LanguageRouter(object):
+    """
+    Dispatches sentences to per-language backends, created on first use by a factory.
+    """
+
+    def __init__(self, factories, default_language=None, detect=detect_language):
+        """
+        :param factories: Dictionary of language code to function creating the backend of the language
+        :param default_language: Language of sentences whose language is not given and not detected;
+            by default the first of the factories
+        :param detect: Function taking a sentence, the candidate languages and the default language,
+            and returning the language of the sentence
+        """
+        if not factories:
+            raise ValueError('At least one language is required!')
+        for language in factories:
+            if language not in _opennlp_languages:
+                raise LookupError('Language not in language list!')
+        self._factories = factories
+        self._languages = sorted(factories)
+        self._default_language = default_language or next(iter(factories))
+        self._detect = detect
+        self._backends = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=len(factories))
+
+
+    def backend(self, language):
+        """
+        :param language: Language code
+        :return: Backend of the language, created if it is not running yet
+        """
+        with self._lock:
+            backend = self._backends.get(language)
+            if backend is None:
+                if language not in self._factories:
+                    raise LookupError('No model for language: {}'.format(language))
+                backend = self._backends[language] = self._factories[language]()
+            return backend
+
+
+    def languages(self, sentences, languages=None, text=None):
+        """
+        :param sentences: List of sentences
+        :param languages: List of language codes, one per sentence (None to detect), or None to detect all
+        :param text: Function returning the text of a sentence used for detection
+        :return: List of language codes, one per sentence
+        """
+        if languages is None:
+            languages = [None] * len(sentences)
+        elif len(languages) != len(sentences):
+            raise ValueError('Expected {} languages, got {}'.format(len(sentences), len(languages)))
+        return [language or self._detect(text(sentence) if text else sentence, self._languages,
+                                         self._default_language)
+                for sentence, language in zip(sentences, languages)]
+
+
+    def route(self, sentences, languages, process):
+        """
+        Process the sentences of each language as one batch, the languages in parallel.
+        :param sentences: List of sentences
+        :param languages: List of language codes, one per sentence
+        :param process: Function taking a backend and a list of sentences, and returning a list of results
+        :return: List of results in the order of the sentences
+        """
+        groups = {}
+        for i, language in enumerate(languages):
+            groups.setdefault(language, []).append(i)
+        # Create the backends first, so that unknown languages fail before any processing
+        backends = dict((language, self.backend(language)) for language in groups)
+        futures = dict((language, self._executor.submit(process, backends[language],
+                                                        [sentences[i] for i in indices]))
+                       for language, indices in groups.items())
+        results = [None] * len(sentences)
+        for language, indices in groups.items():
+            for i, result in zip(indices, futures[language].result()):
+                results[i] = result
+        return results
+
+
+    def running(self):
+        """:return: Languages whose backends have been created"""
+        with self._lock:
+            return sorted(self._backends)
+
+
+    def close(self):
+        """Close the backends created so far"""
+        with self._lock:
+            backends, self._backends = list(self._backends.values()), {}
+        for backend in backends:
+            backend.close()
+
+
+class MultilingualTagger(TaggerI):
+    """
+    POS tagger for sentences of several languages, with an OpenNLPTagger for each language.
+    """
+
+    def __init__(self, path_to_bin=None, models=None, default_language=None, detect=detect_language, **kwargs):
+        """
+        :param path_to_bin: Path to bin directory of OpenNLP installation
+        :param models: Dictionary of language code to the path of its OpenNLP POS tagger .bin file
+        :param default_language: Language of sentences whose language is not given and not detected
+        :param detect: Language detection function (see LanguageRouter)
+        :param kwargs: Other arguments of OpenNLPTagger, such as persistent or workers
+        """
+        if not models:
+            raise LookupError('OpenNLP model file is not set!')
+        factory = lambda language: lambda: OpenNLPTagger(path_to_bin, models[language], language, **kwargs)
+        self._router = LanguageRouter(dict((language, factory(language)) for language in models),
+                                      default_language, detect)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        """Stop the taggers started so far"""
+        self._router.close()
+
+
+    def running(self):
+        """:return: Languages whose taggers have been created"""
+        return self._router.running()
+
+
+    def tag(self, sentence, language=None):
+        """
+        :param sentence: List of tokens or a string
+        :param language: Language code; detected when not given
+        :return: List of (token, tag) tuples
+        """
+        return self.tag_sents([sentence], [language])[0]
+
+
+    def tag_sents(self, sentences, languages=None, output='tuples'):
+        """
+        Tag sentences of several languages.
+        :param sentences: List of sentences, each given as a list of tokens or as a string
+        :param languages: List of language codes, one per sentence; None entries (or None) are detected
+        :param output: 'tuples' or 'columnar', see OpenNLPTagger.tag_sents()
+        :return: List of lists of (token, tag) tuples, one per sentence, or a TaggedCorpus
+        """
+        if output not in ('tuples', 'columnar'):
+            raise ValueError('Unknown output type: {}'.format(output))
+        sentences = list(sentences)
+        languages = self._router.languages(sentences, languages)
+        tagged_sents = self._router.route(sentences, languages, lambda tagger, batch: tagger.tag_sents(batch))
+        return TaggedCorpus(tagged_sents) if output == 'columnar' else tagged_sents
+
+
+class MultilingualChunker(ChunkParserI):
+    """
+    Chunker for POS-tagged sentences of several languages, with a chunker (and NER models) for each language.
+    """
+
+    def __init__(self, path_to_bin=None, models=None, ner_models=None, default_language=None,
+                 detect=detect_language, **kwargs):
+        """
+        :param path_to_bin: Path to bin directory of OpenNLP installation
+        :param models: Dictionary of language code to the path of its OpenNLP chunker .bin file
+        :param ner_models: Dictionary of language code to a list of paths of its OpenNLP NER model .bin files
+        :param default_language: Language of sentences whose language is not given and not detected
+        :param detect: Language detection function (see LanguageRouter)
+        :param kwargs: Other arguments of OpenNLPChunker, such as persistent or workers
+        """
+        models = models or {}
+        ner_models = ner_models or {}
+        if not models and not ner_models:
+            raise LookupError('OpenNLP model file is not set!')
+        factory = lambda language: lambda: OpenNERChunkerMulti(ner_models.get(language, []), path_to_bin,
+                                                               models.get(language), **kwargs)
+        languages = list(models) + [language for language in ner_models if language not in models]
+        self._router = LanguageRouter(dict((language, factory(language)) for language in languages),
+                                      default_language, detect)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        """Stop the chunkers started so far"""
+        self._router.close()
+
+
+    def running(self):
+        """:return: Languages whose chunkers have been created"""
+        return self._router.running()
+
+
+    def parse(self, tokens, language=None, output='trees'):
+        """
+        :param tokens: List of (token, tag) tuples
+        :param language: Language code; detected from the tokens when not given
+        :param output: 'trees', 'spans' or 'iob', see OpenNLPChunker.parse()
+        :return: Parse tree or list of entity spans
+        """
+        return self.parse_sents([tokens], [language], output)[0]
+
+
+    def parse_sents(self, sentences, languages=None, output='trees'):
+        """
+        Chunk POS-tagged sentences of several languages.
+        :param sentences: List of sentences, each given as a list of (token, tag) tuples
+        :param languages: List of language codes, one per sentence; None entries (or None) are detected
+        :param output: 'trees', 'spans' or 'iob', see OpenNLPChunker.parse()
+        :return: List of parse trees or of lists of entity spans, one per sentence
+        """
+        sentences = list(sentences)
+        languages = self._router.languages(sentences, languages,
+                                           lambda sentence: [token if isinstance(token, str) else token[0]
+                                                             for token in sentence])
+        return self._router.route(sentences, languages,
+                                  lambda chunker, batch: chunker.parse_sents(batch, output=output))
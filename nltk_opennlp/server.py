@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: Shared OpenNLP daemon
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for sharing one set of running Apache OpenNLP tools (and loaded models) between
+many Python processes. The daemon owns the OpenNLP processes for a configured set of models and
+serves requests over a local Unix domain socket:
+
+    python -m nltk_opennlp.server --socket /tmp/opennlp.sock --bin /path/to/opennlp/bin/opennlp \\
+        --model POSTagger=/path/to/en-pos-maxent.bin --model ChunkerME=/path/to/en-chunker.bin
+
+Taggers and chunkers constructed with ``server='/tmp/opennlp.sock'`` send their input to the daemon
+instead of starting OpenNLP themselves. Each message is a 4-byte big-endian length followed by a UTF-8
+JSON object: requests are {"tool": ..., "model": ..., "lines": [...]}, and responses are
+{"lines": [...]} or {"error": ...}.
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import threading
+from nltk_opennlp.launcher import JavaLauncher
+from nltk_opennlp.workers import OpenNLPError, OpenNLPTimeoutError, create_worker
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+_header = struct.Struct('>I')
+_max_message = 1 << 30
+
+
+def _send(sock, message):
+    data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+    sock.sendall(_header.pack(len(data)) + data)
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _receive(sock):
+    # Return the next message, or None when the connection has been closed
+    header = _receive_exactly(sock, _header.size)
+    if header is None:
+        return None
+    size = _header.unpack(header)[0]
+    if size > _max_message:
+        raise OSError('OpenNLP server message is too large!')
+    data = _receive_exactly(sock, size)
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                request = _receive(self.request)
+            except (OSError, ValueError):
+                return
+            if request is None:
+                return
+            try:
+                lines = self.server.process(request['tool'], request['model'], request['lines'])
+                response = {'lines': lines}
+            except (OSError, LookupError, TypeError) as e:
+                response = {'error': str(e)}
+            try:
+                _send(self.request, response)
+            except OSError:
+                return
+
+
+class OpenNLPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Daemon owning persistent OpenNLP processes for a set of (tool, model) pairs and serving requests
+    from many clients, each connection in its own thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, opennlp_bin, models, workers=1):
+        """
+        Initialize the server and bind its socket; the OpenNLP processes are started by start().
+        :param socket_path: Path of the Unix domain socket
+        :param opennlp_bin: Path to the OpenNLP run file, or the command starting the OpenNLP CLI
+        :param models: List of (tool, model path) pairs to serve, such as ('POSTagger', 'en-pos-maxent.bin')
+        :param workers: Number of OpenNLP processes for each model
+        """
+        self._backends = dict(((tool, os.path.abspath(model)), create_worker(opennlp_bin, tool, model, workers))
+                              for tool, model in models)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        socketserver.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+
+
+    def start(self):
+        """Start the OpenNLP processes, so that the models are loaded before the first request"""
+        for backend in self._backends.values():
+            backend.start()
+
+
+    def process(self, tool, model, lines):
+        """
+        Run a served OpenNLP tool over a batch of lines.
+        :return: List of output lines, one per input line
+        """
+        backend = self._backends.get((tool, os.path.abspath(model)))
+        if backend is None:
+            raise LookupError('Model is not served: {} {}'.format(tool, model))
+        return backend.process(lines)
+
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        for backend in self._backends.values():
+            backend.close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+class OpenNLPClient(object):
+    """
+    Client of the OpenNLP daemon. Each thread uses its own connection, which is kept open between requests.
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        """
+        :param socket_path: Path of the Unix domain socket of the daemon
+        :param timeout: Socket timeout in seconds; OpenNLPTimeoutError is raised when it is exceeded
+        """
+        self._socket_path = socket_path
+        self._timeout = timeout
+        self._local = threading.local()
+        # Connections of all threads, so that close() can close them
+        self._sockets = set()
+        self._sockets_lock = threading.Lock()
+
+
+    def __connect__(self):
+        sock = getattr(self._local, 'socket', None)
+        with self._sockets_lock:
+            if sock is not None and sock in self._sockets:
+                return sock
+        # Not connected yet, or the connection was closed by close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self._timeout)
+            sock.connect(self._socket_path)
+        except OSError:
+            sock.close()
+            raise
+        with self._sockets_lock:
+            self._sockets.add(sock)
+        self._local.socket = sock
+        return sock
+
+
+    def __disconnect__(self):
+        # Close the connection of the current thread
+        sock = getattr(self._local, 'socket', None)
+        self._local.socket = None
+        if sock is not None:
+            with self._sockets_lock:
+                self._sockets.discard(sock)
+            sock.close()
+
+
+    def process(self, tool, model, lines):
+        """
+        Run an OpenNLP tool of the daemon over a batch of lines.
+        :param tool: OpenNLP command line tool name, such as POSTagger or ChunkerME
+        :param model: The path to the OpenNLP model .bin file, as configured in the daemon
+        :param lines: List of input lines (without line breaks)
+        :return: List of output lines, one per input line
+        """
+        request = {'tool': tool, 'model': os.path.abspath(model), 'lines': lines}
+        try:
+            sock = self.__connect__()
+            _send(sock, request)
+            response = _receive(sock)
+        except socket.timeout:
+            # The response of the timed out request would be read by the next one
+            self.__disconnect__()
+            raise OpenNLPTimeoutError('OpenNLP server did not answer in time!')
+        except (OSError, ValueError):
+            self.__disconnect__()
+            raise
+        if response is None:
+            self.__disconnect__()
+            raise OSError('OpenNLP server closed the connection!')
+        if 'error' in response:
+            raise OpenNLPError(response['error'])
+        return response['lines']
+
+
+    def close(self):
+        """Close the connections of all threads; they are opened again on next use"""
+        with self._sockets_lock:
+            sockets, self._sockets = self._sockets, set()
+        for sock in sockets:
+            sock.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Serve Apache OpenNLP tools over a Unix domain socket')
+    parser.add_argument('--socket', required=True, help='Path of the Unix domain socket')
+    parser.add_argument('--bin', required=True, help='Path to the OpenNLP run file')
+    parser.add_argument('--model', action='append', required=True, metavar='TOOL=PATH',
+                        help='Tool and model to serve, e.g. POSTagger=en-pos-maxent.bin; may be repeated')
+    parser.add_argument('--workers', type=int, default=1, help='Number of OpenNLP processes for each model')
+    parser.add_argument('--heap', help='Maximum JVM heap size, such as 2g; starts OpenNLP with java directly')
+    parser.add_argument('--jvm-option', action='append', default=[],
+                        help='JVM option, such as --jvm-option=-XX:+UseG1GC; may be repeated; starts OpenNLP '
+                             'with java directly')
+    args = parser.parse_args(args)
+    models = []
+    for model in args.model:
+        tool, _, path = model.partition('=')
+        if not path:
+            parser.error('Model must be given as TOOL=PATH: {}'.format(model))
+        models.append((tool, path))
+
+    opennlp_bin = args.bin
+    if args.heap or args.jvm_option:
+        launcher = JavaLauncher(heap=args.heap, jvm_options=args.jvm_option)
+        opennlp_bin = launcher.command(os.path.dirname(os.path.abspath(args.bin)))
+        if opennlp_bin is None:
+            parser.error('OpenNLP run file not found: {}'.format(args.bin))
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    server = OpenNLPServer(args.socket, opennlp_bin, models, args.workers)
+    # Stop on SIGTERM as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    try:
+        server.start()
+        logging.info('Serving %d models on %s', len(models), args.socket)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -8,50 +8,142 @@
 A Python module for interfacing with the Apache OpenNLP package
 """
 
-import os
-import sys
-import re
-import gc
-from subprocess import Popen, PIPE
-from nltk.internals import find_binary
+import asyncio
+from itertools import islice
 from nltk.tag.api import TaggerI
+from nltk_opennlp import engine, files
+from nltk_opennlp.aio import arun_tool, create_async_worker
+from nltk_opennlp.corpus import TaggedCorpus
+from nltk_opennlp.instrumentation import _disabled
+from nltk_opennlp.registry import default_registry, find_opennlp
+from nltk_opennlp.server import OpenNLPClient
+from nltk_opennlp.workers import create_worker, run_tool, stream_tool
 
 _opennlp_languages = ['da', 'de', 'en', 'es', 'nl', 'pt', 'se']
 
 class OpenNLPTagger(TaggerI):
 
-    def __init__(self, path_to_bin=None, path_to_model=None, language='en', verbose=False):
+    def __init__(self, path_to_bin=None, path_to_model=None, language='en', verbose=False, persistent=False,
+                 workers=1, instrumentation=None, cache=None, server=None, shared=False, timeout=None, hedge=None,
+                 launcher=None, backend='opennlp'):
         """
         Initialize the OpenNLPTagger.
 
         :param path_to_bin: Path to bin directory of OpenNLP installation
         :param path_to_model: The path to OpenNLP POS tagger .bin file.
         :param language: Language to use; default setting is 'en'.
+        :param persistent: Keep a single POSTagger process running between calls instead of
+            starting a new one for every call; call close() (or use the tagger as a context
+            manager) to stop it
+        :param workers: Number of POSTagger processes to keep running; batches passed to tag_sents()
+            are spread across them. Implies persistent mode when greater than 1. The asyncio methods
+            use a separate set of processes, started on first use
+        :param instrumentation: Collector receiving per-stage timings and counters, such as
+            nltk_opennlp.instrumentation.StatsCollector; disabled by default
+        :param cache: nltk_opennlp.cache.OutputCache used to memoize tagged sentences; only sentences
+            not found in it are sent to OpenNLP
+        :param server: Path of the socket of a running nltk_opennlp.server daemon (or an OpenNLPClient)
+            serving the model; sentences are then tagged by the daemon instead of local OpenNLP processes
+        :param shared: Use persistent POSTagger processes shared with other taggers of this process
+            using the same model: True for nltk_opennlp.registry.default_registry, or a BackendRegistry.
+            Shared processes do not report to instrumentation
+        :param timeout: Time limit in seconds for each call to OpenNLP; the process is killed (and replaced)
+            and nltk_opennlp.workers.OpenNLPTimeoutError raised when it is exceeded
+        :param hedge: With several workers, a latency percentile (e.g. 95) after which a batch is sent to
+            an idle worker as well, using the first answer
+        :param launcher: nltk_opennlp.launcher.JavaLauncher starting OpenNLP with java directly, with its
+            JVM options, instead of the opennlp run file
+        :param backend: 'opennlp' to run the OpenNLP POSTagger tool, or 'python' to tag in this process with
+            nltk_opennlp.engine, which reads maxent and perceptron POS models directly and needs no Java;
+            the options for OpenNLP processes are then ignored
 
         """
         if path_to_model is None:
             raise LookupError('OpenNLP model file is not set!')
         self._model_path = path_to_model
+        self._num_workers = workers
+        self._worker = None
+        self._async_worker = None
+        self._instrumentation = instrumentation or _disabled
+        self._cache = cache
+        self._timeout = timeout
+        self._client = OpenNLPClient(server, timeout) if isinstance(server, str) else server
+        self._opennlp_bin = None
+        self._engine = None
 
-        opennlp_paths = ['.', '/usr/bin', '/usr/local/apache-opennlp', '/opt/local/apache-opennlp', '~/apache-opennlp']
-        opennlp_paths = list(map(os.path.expanduser, opennlp_paths))
-
-        if language in _opennlp_languages:
-            opennlp_bin_name = "opennlp"
-            if sys.platform.startswith("win"):
-                opennlp_bin_name += ".bat"
-        else:
+        if language not in _opennlp_languages:
             raise LookupError('Language not in language list!')
-        try:
-            self._opennlp_bin = find_binary(opennlp_bin_name, os.path.join(path_to_bin, opennlp_bin_name),
-                                          env_vars=('OPENNLP_HOME', 'OPENNLP'),
-                                          searchpath=opennlp_paths, verbose=verbose)
-        except LookupError:
-            print('Unable to find the Apache OpenNLP run file!')
+        if backend not in ('opennlp', 'python'):
+            raise ValueError('Unknown backend: {}'.format(backend))
+        if backend == 'python':
+            # Models are loaded once and shared by the taggers using them
+            self._engine = engine.load_pos_model(path_to_model)
+            return
+        if self._client is not None:
+            # OpenNLP is run by the daemon
+            return
+        self._opennlp_bin = find_opennlp(path_to_bin, verbose) if launcher is None else \
+            launcher.command(path_to_bin, verbose)
+        if shared:
+            registry = default_registry if shared is True else shared
+            self._worker = registry.acquire(self._opennlp_bin, "POSTagger", self._model_path, workers)
+        elif persistent or workers > 1:
+            self._worker = create_worker(self._opennlp_bin, "POSTagger", self._model_path, workers,
+                                         instrumentation, hedge)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+    def close(self):
+        """Stop the persistent POSTagger processes (or close the connection to the daemon), if there are any"""
+        if self._client is not None:
+            self._client.close()
+        if self._worker is not None:
+            self._worker.close()
+        if self._async_worker is not None:
+            self._async_worker.close()
+
+
+    async def aclose(self):
+        """Stop the persistent POSTagger processes (or close the connection to the daemon) and wait for the
+        asyncio ones to exit"""
+        async_worker = self._async_worker
+        self.close()
+        if async_worker is not None:
+            await async_worker.aclose()
 
 
     def tag(self, sentences):
+        lines = [self.__tag_input__(sentences)]
+        return self.__parse_output__(lines, self.__run__(lines))[0]
 
+
+    async def atag(self, sentences, timeout=None):
+        """
+        Tag a sentence without blocking the event loop.
+        :param sentences: Sentence given as a list of tokens or as a string
+        :param timeout: Time limit in seconds, after which asyncio.TimeoutError is raised
+        :return: List of (token, tag) tuples
+        """
+        lines = [self.__tag_input__(sentences)]
+        return self.__parse_output__(lines, await self.__arun__(lines, timeout))[0]
+
+
+    def __tag_input__(self, sentences):
         if isinstance(sentences, list):
             _input = ''
             for sent in sentences:
@@ -63,19 +155,162 @@ class OpenNLPTagger(TaggerI):
             _input += '\n'
         else:
             _input = sentences
+        return _input.replace('\n', ' ').strip()
+
+
+    def tag_sents(self, sentences, batch_size=1000, output='tuples'):
+        """
+        Tag a sequence of sentences, keeping the tags of each sentence separate. Sentences are
+        sent to POSTagger newline-delimited, so a single process handles each batch.
+
+        :param sentences: Iterable of sentences, each given as a list of tokens or as a string
+        :param batch_size: Maximum number of sentences sent to a single POSTagger run
+        :param output: 'tuples' for lists of (token, tag) tuples, or 'columnar' for a compact
+            nltk_opennlp.corpus.TaggedCorpus, suited to large corpora
+        :return: List of lists of (token, tag) tuples, one per sentence, or a TaggedCorpus
+        """
+        self.__check_output__(output)
+        tagged_sents = TaggedCorpus() if output == 'columnar' else []
+        sentences = iter(sentences)
+        while True:
+            batch = [self.__sentence_line__(sent) for sent in islice(sentences, batch_size)]
+            if not batch:
+                break
+            self.__add_output__(tagged_sents, batch, self.__run__(batch))
+        return tagged_sents
+
+
+    def tag_stream(self, sentences, window=1000):
+        """
+        Tag an iterable of sentences of any length, yielding the tags of each sentence as soon as
+        they are available. A dedicated POSTagger process is started for the stream and at most
+        window sentences are in flight, so memory use does not depend on the number of sentences.
+
+        :param sentences: Iterable of sentences, each given as a list of tokens or as a string
+        :param window: Maximum number of sentences sent to POSTagger ahead of the tagged output read back
+        :return: Generator of lists of (token, tag) tuples, one per sentence
+        """
+        lines = (self.__sentence_line__(sentence) for sentence in sentences)
+        if self._client is not None or self._engine is not None:
+            # The daemon (or the Python engine) tags batches of window sentences
+            while True:
+                batch = list(islice(lines, window))
+                if not batch:
+                    return
+                for tagged in self.__parse_output__(batch, self.__run__(batch)):
+                    yield tagged
+        for output in stream_tool(self._opennlp_bin, "POSTagger", self._model_path, lines, window,
+                                  self._instrumentation):
+            tagged = self.__parse_tagged__(output) if output else []
+            self._instrumentation.count('sentences')
+            self._instrumentation.count('tokens', len(tagged))
+            yield tagged
+
+
+    def tag_file(self, input_path, output_path, format='conll', batch_size=10000, checkpoint=None):
+        """
+        POS-tag a file of tokenized sentences into an output file, without building (token, tag) tuples.
+        See nltk_opennlp.files for the formats.
+
+        :param input_path: Path of the input file, one sentence per line with tokens separated by spaces
+        :param output_path: Path of the output file
+        :param format: Output format: 'opennlp', 'conll' or 'jsonl'
+        :param batch_size: Number of sentences sent to POSTagger at once
+        :param checkpoint: Path of a checkpoint file recording the progress; an interrupted job resumes
+            from it when run again
+        :return: Number of sentences processed
+        """
+        return files.tag_file(self, input_path, output_path, format, batch_size, checkpoint)
+
+
+    async def atag_sents(self, sentences, timeout=None, output='tuples'):
+        """
+        Tag a list of sentences without blocking the event loop, keeping the tags of each sentence
+        separate.
+        :param sentences: List of sentences, each given as a list of tokens or as a string
+        :param timeout: Time limit in seconds, after which asyncio.TimeoutError is raised
+        :param output: 'tuples' or 'columnar', see tag_sents()
+        :return: List of lists of (token, tag) tuples, one per sentence, or a TaggedCorpus
+        """
+        self.__check_output__(output)
+        tagged_sents = TaggedCorpus() if output == 'columnar' else []
+        batch = [self.__sentence_line__(sent) for sent in sentences]
+        self.__add_output__(tagged_sents, batch, await self.__arun__(batch, timeout))
+        return tagged_sents
+
+
+    def __check_output__(self, output):
+        if output not in ('tuples', 'columnar'):
+            raise ValueError('Unknown output type: {}'.format(output))
+
+
+    def __sentence_line__(self, sentence):
+        if not isinstance(sentence, str):
+            sentence = ' '.join(sentence)
+        return ' '.join(sentence.split())
+
+
+    def __run__(self, lines):
+        if self._cache is not None:
+            return self._cache.process("POSTagger", self._model_path, lines, self.__process__)
+        return self.__process__(lines)
+
+
+    def __process__(self, lines):
+        if self._engine is not None:
+            with self._instrumentation.timer('engine'):
+                return self._engine.process(lines)
+        if self._client is not None:
+            return self._client.process("POSTagger", self._model_path, lines)
+        if self._worker is not None:
+            # The persistent processes answer with one line per input line
+            return self._worker.process(lines, self._timeout)
+        return run_tool(self._opennlp_bin, "POSTagger", self._model_path, lines, self._instrumentation, self._timeout)
+
+
+    async def __arun__(self, lines, timeout):
+        timeout = self._timeout if timeout is None else timeout
+        if self._cache is not None:
+            return await self._cache.aprocess("POSTagger", self._model_path, lines,
+                                              lambda missing: self.__aprocess__(missing, timeout))
+        return await self.__aprocess__(lines, timeout)
+
+
+    async def __aprocess__(self, lines, timeout):
+        if self._engine is not None or self._client is not None:
+            loop = asyncio.get_event_loop()
+            return await asyncio.wait_for(loop.run_in_executor(None, self.__process__, lines), timeout)
+        if self._worker is None:
+            return await arun_tool(self._opennlp_bin, "POSTagger", self._model_path, lines, timeout,
+                                   self._instrumentation)
+        if self._async_worker is None:
+            self._async_worker = create_async_worker(self._opennlp_bin, "POSTagger", self._model_path,
+                                                     self._num_workers, self._instrumentation)
+        return await self._async_worker.process(lines, timeout)
+
+
+    def __parse_output__(self, lines, output):
+        with self._instrumentation.timer('postprocess'):
+            tagged_sents = [self.__parse_tagged__(tagged) if line else [] for line, tagged in zip(lines, output)]
+        self._instrumentation.count('sentences', len(tagged_sents))
+        self._instrumentation.count('tokens', sum(map(len, tagged_sents)))
+        return tagged_sents
+
 
-        # Run the tagger and get the output
-        gc.collect()
-        p = Popen([self._opennlp_bin, "POSTagger", self._model_path],
-                  shell=False, stdin=PIPE, stdout=PIPE, stderr=PIPE, universal_newlines=True)
-        (stdout, stderr) = p.communicate(_input)
+    def __add_output__(self, tagged_sents, lines, output):
+        if not isinstance(tagged_sents, TaggedCorpus):
+            tagged_sents.extend(self.__parse_output__(lines, output))
+            return
+        # Columnar output is read without creating a tuple for each token
+        tokens = tagged_sents.num_tokens
+        with self._instrumentation.timer('postprocess'):
+            for line, tagged in zip(lines, output):
+                tagged_sents.__append_output__(tagged if line else '')
+        self._instrumentation.count('sentences', len(lines))
+        self._instrumentation.count('tokens', tagged_sents.num_tokens - tokens)
 
-        # Check the return code.
-        if p.returncode != 0:
-            raise OSError('OpenNLP command failed!')
 
-        # Clean the execution time information
-        output = re.sub(r"\nExecution time:(.*)$", "", stdout)
+    def __parse_tagged__(self, output):
         # Output the tagged sentences
         tagged_tokens = []
         for tagged_word in output.strip().split(' '):
@@ -0,0 +1,691 @@
+# -*- coding: utf-8 -*-
+# Natural Language Toolkit: Long-lived OpenNLP processes
+#
+# Copyright (C) Paulius Danenas
+# Author: Paulius Danenas <danpaulius@gmail.com>
+
+"""
+A Python module for keeping Apache OpenNLP command line tools running between calls, so that
+JVM startup and model loading is paid once instead of for every sentence
+"""
+
+import gc
+import re
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from subprocess import Popen, PIPE, TimeoutExpired
+from timeit import default_timer
+from nltk_opennlp.instrumentation import _disabled
+
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
+
+# Tools which keep adaptive data between lines until an empty line is read; an empty line is sent
+# after every input line so that each sentence is processed independently, as in separate runs
+_document_tools = ('TokenNameFinder',)
+
+# Tools which read paragraphs terminated by an empty line and answer each with any number of lines
+# (e.g. the sentences found), followed by an empty line
+_paragraph_tools = ('SentenceDetector',)
+
+# End of input marker
+_end = object()
+
+# Number of stderr lines kept for error reporting
+_stderr_lines = 100
+
+
+def _command(opennlp_bin, tool, model):
+    # opennlp_bin is the path of the OpenNLP run file, or the arguments starting the OpenNLP CLI
+    # directly (see nltk_opennlp.launcher)
+    if isinstance(opennlp_bin, (list, tuple)):
+        return list(opennlp_bin) + [tool, model]
+    return [opennlp_bin, tool, model]
+
+
+class OpenNLPError(OSError):
+    """
+    Failure of an OpenNLP process. The exit code (None if the process was still running) and the
+    last lines of its stderr output are kept as returncode and stderr.
+    """
+
+    def __init__(self, message='OpenNLP command failed!', returncode=None, stderr=''):
+        OSError.__init__(self, message)
+        self.message = message
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+    def __str__(self):
+        details = [] if self.returncode is None else ['exit code {}'.format(self.returncode)]
+        details += [line for line in self.stderr.splitlines() if line.strip()][-1:]
+        return '{} ({})'.format(self.message, '; '.join(details)) if details else self.message
+
+
+class OpenNLPTimeoutError(OpenNLPError, TimeoutError):
+    """An OpenNLP process did not answer in time and was killed"""
+
+    def __init__(self, message='OpenNLP command timed out!', returncode=None, stderr=''):
+        OpenNLPError.__init__(self, message, returncode, stderr)
+
+
+def _stderr_tail(stderr):
+    return '\n'.join(stderr.decode('utf-8', 'replace').splitlines()[-_stderr_lines:])
+
+
+def _remaining(deadline):
+    return None if deadline is None else max(deadline - default_timer(), 0)
+
+
+def _encode_input(tool, lines):
+    separator = '\n\n' if tool in _document_tools else '\n'
+    return ''.join(line + separator for line in lines).encode('utf-8')
+
+
+def _without_empty(process, lines):
+    # Empty lines are not sent to OpenNLP; their output is empty as well
+    output = iter(process([line for line in lines if line]) if any(lines) else [])
+    return [next(output) if line else '' for line in lines]
+
+
+def _drain(stream, lines):
+    # Keep reading stderr so that the process never blocks on a full pipe
+    for line in iter(stream.readline, b''):
+        lines.append(line.decode('utf-8', 'replace').rstrip())
+    stream.close()
+
+
+def _start_thread(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def create_worker(opennlp_bin, tool, model, workers=1, instrumentation=None, hedge=None):
+    """
+    Create a persistent backend for an OpenNLP tool: a single worker or a pool of them.
+    :param workers: Number of OpenNLP processes to keep running
+    :param instrumentation: Collector for timings and counters (see nltk_opennlp.instrumentation)
+    :param hedge: Latency percentile for hedged requests of a pool (see OpenNLPWorkerPool)
+    """
+    if workers > 1:
+        return OpenNLPWorkerPool(opennlp_bin, tool, model, workers=workers, instrumentation=instrumentation,
+                                 hedge=hedge)
+    return OpenNLPWorker(opennlp_bin, tool, model, instrumentation=instrumentation)
+
+
+def run_tool(opennlp_bin, tool, model, lines, instrumentation=None, timeout=None):
+    """
+    Run an OpenNLP command line tool once over a batch of lines.
+    :param opennlp_bin: Path to the OpenNLP run file, or the command starting the OpenNLP CLI
+    :param tool: OpenNLP command line tool name, such as POSTagger or ChunkerME
+    :param model: The path to the OpenNLP model .bin file used by the tool
+    :param lines: List of input lines (without line breaks)
+    :param instrumentation: Collector for timings and counters (see nltk_opennlp.instrumentation)
+    :param timeout: Time limit in seconds; the process is killed and OpenNLPTimeoutError raised when
+        it is exceeded
+    :return: List of output lines, one per input line
+    """
+    if not all(lines):
+        return _without_empty(lambda batch: run_tool(opennlp_bin, tool, model, batch, instrumentation, timeout),
+                              lines)
+
+    instrumentation = instrumentation or _disabled
+    with instrumentation.timer('gc'):
+        gc.collect()
+    with instrumentation.timer('spawn'):
+        p = Popen(_command(opennlp_bin, tool, model), shell=False, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    instrumentation.count('processes_spawned')
+    data = _encode_input(tool, lines)
+    try:
+        with instrumentation.timer('transfer'):
+            (stdout, stderr) = p.communicate(data, timeout=timeout)
+    except TimeoutExpired:
+        p.kill()
+        stderr = p.communicate()[1]
+        raise OpenNLPTimeoutError(stderr=_stderr_tail(stderr))
+    instrumentation.count('bytes_in', len(data))
+    instrumentation.count('bytes_out', len(stdout))
+    stdout = stdout.decode('utf-8')
+
+    # Check the return code.
+    if p.returncode != 0:
+        raise OpenNLPError(returncode=p.returncode, stderr=_stderr_tail(stderr))
+
+    # Clean the execution time information
+    output = re.sub(r"\nExecution time:(.*)$", "", stdout)
+    output = output.splitlines()
+    if tool in _document_tools:
+        output = output[::2]
+    if len(output) < len(lines):
+        raise OpenNLPError('OpenNLP command returned too few lines!', p.returncode, _stderr_tail(stderr))
+    return output[:len(lines)]
+
+
+def stream_tool(opennlp_bin, tool, model, lines, window=1000, instrumentation=None):
+    """
+    Run an OpenNLP command line tool over an iterable of lines of any length, yielding output lines
+    as they come back. A dedicated process is started for the stream; a writer thread feeds its stdin
+    while output is read, and at most window lines are in flight, so memory use does not depend on
+    the input size. The process is stopped when the generator is exhausted or closed. For tools
+    reading paragraphs, such as SentenceDetector, each input line is a paragraph and the output for
+    it is a list of lines.
+    :param opennlp_bin: Path to the OpenNLP run file, or the command starting the OpenNLP CLI
+    :param tool: OpenNLP command line tool name, such as POSTagger or ChunkerME
+    :param model: The path to the OpenNLP model .bin file used by the tool
+    :param lines: Iterable of input lines (without line breaks)
+    :param window: Maximum number of lines written to OpenNLP before their output has been read
+    :param instrumentation: Collector for timings and counters (see nltk_opennlp.instrumentation)
+    :return: Generator of output lines (or lists of lines for paragraph tools), one per input line
+    """
+    if window < 1:
+        raise ValueError('Window size must be positive!')
+    instrumentation = instrumentation or _disabled
+    # Every input line of document tools is followed by an empty one, which is answered too
+    responses = 2 if tool in _document_tools else 1
+    paragraphs = tool in _paragraph_tools
+    separator = '\n\n' if paragraphs else '\n' * responses
+    with instrumentation.timer('spawn'):
+        p = Popen(_command(opennlp_bin, tool, model), shell=False, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    instrumentation.count('processes_spawned')
+    stderr = deque(maxlen=_stderr_lines)
+    stderr_reader = _start_thread(_drain, p.stderr, stderr)
+    slots = threading.Semaphore(window)
+    # True for every line written, False for empty lines which are not sent, then _end
+    written = Queue()
+    stop = threading.Event()
+    errors = []
+
+    def write():
+        try:
+            for line in lines:
+                slots.acquire()
+                if stop.is_set():
+                    return
+                written.put(bool(line))
+                if line:
+                    data = (line + separator).encode('utf-8')
+                    p.stdin.write(data)
+                    p.stdin.flush()
+                    instrumentation.count('bytes_in', len(data))
+        except (OSError, ValueError) as e:
+            if p.poll() is None:
+                errors.append(e)
+            # Otherwise the process died; the reader notices it on EOF
+        except BaseException as e:
+            # Failure of the input iterable, raised to the reader
+            errors.append(e)
+        finally:
+            written.put(_end)
+            try:
+                p.stdin.close()
+            except (OSError, ValueError):
+                pass
+
+    def failure():
+        # Wait for the process to exit, so that its exit code and stderr are known
+        try:
+            p.wait(1)
+        except TimeoutExpired:
+            pass
+        stderr_reader.join(1)
+        return OpenNLPError(returncode=p.poll(), stderr='\n'.join(stderr))
+
+    def read():
+        line = p.stdout.readline()
+        if not line:
+            raise failure()
+        instrumentation.count('bytes_out', len(line))
+        return line.decode('utf-8').rstrip('\r\n')
+
+    _start_thread(write)
+    try:
+        while True:
+            sent = written.get()
+            if sent is _end:
+                break
+            if not sent:
+                output = [] if paragraphs else ''
+            elif paragraphs:
+                # Read until the empty line ending the paragraph
+                output = list(iter(read, ''))
+            else:
+                output = [read() for _ in range(responses)][0]
+            slots.release()
+            yield output
+        if errors:
+            raise errors[0]
+        # Skip the execution time information
+        p.stdout.read()
+        if p.wait() != 0:
+            raise failure()
+    finally:
+        stop.set()
+        slots.release()
+        if p.poll() is None:
+            p.kill()
+        p.wait()
+        p.stdout.close()
+
+
+class _FanOut(object):
+    """
+    Distributes the items of an iterable to several bounded iterators from a single feeder thread,
+    so that each item is read once and consumers in different threads progress in step.
+    """
+
+    def __init__(self, items, split, count, maxsize):
+        """
+        :param items: Iterable of items
+        :param split: Function mapping an item to a sequence of count values, one for each output
+        :param count: Number of outputs
+        :param maxsize: Maximum number of values waiting in each output
+        """
+        self._queues = [Queue(maxsize) for _ in range(count)]
+        self._stop = threading.Event()
+        self.outputs = [self.__consume__(queue) for queue in self._queues]
+        _start_thread(self.__feed__, items, split)
+
+
+    def __put__(self, queue, value):
+        while not self._stop.is_set():
+            try:
+                queue.put(value, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+
+    def __feed__(self, items, split):
+        try:
+            for item in items:
+                for queue, value in zip(self._queues, split(item)):
+                    if not self.__put__(queue, (value, None)):
+                        return
+        except BaseException as e:
+            for queue in self._queues:
+                self.__put__(queue, (_end, e))
+            return
+        for queue in self._queues:
+            self.__put__(queue, (_end, None))
+
+
+    def __consume__(self, queue):
+        while True:
+            value, error = queue.get()
+            if value is _end:
+                if error is not None:
+                    raise error
+                return
+            yield value
+
+
+    def close(self):
+        """Stop the feeder thread and end all outputs"""
+        self._stop.set()
+        for queue in self._queues:
+            try:
+                while True:
+                    queue.get_nowait()
+            except Empty:
+                pass
+            # The feeder may still add the value it was putting when stopped
+            while True:
+                try:
+                    queue.put_nowait((_end, None))
+                    break
+                except Full:
+                    try:
+                        queue.get_nowait()
+                    except Empty:
+                        pass
+
+
+class OpenNLPWorker(object):
+    """
+    A single long-lived OpenNLP command line tool process (e.g. ``opennlp POSTagger model.bin``).
+    Input lines are written to its stdin and exactly one output line is read back for each of them.
+    The process is started lazily and restarted automatically if it has died.
+    """
+
+    def __init__(self, opennlp_bin, tool, model, stderr_lines=_stderr_lines, instrumentation=None):
+        """
+        Initialize the worker; the process itself is started on first use.
+        :param opennlp_bin: Path to the OpenNLP run file, or the command starting the OpenNLP CLI
+        :param tool: OpenNLP command line tool name, such as POSTagger or ChunkerME
+        :param model: The path to the OpenNLP model .bin file used by the tool
+        :param stderr_lines: Number of most recent stderr lines to keep for error reporting
+        :param instrumentation: Collector for timings and counters (see nltk_opennlp.instrumentation)
+        """
+        self._args = _command(opennlp_bin, tool, model)
+        self._tool = tool
+        self._process = None
+        self._stderr_reader = None
+        self._instrumentation = instrumentation or _disabled
+        self._lock = threading.Lock()
+        self._stderr = deque(maxlen=stderr_lines)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def start(self):
+        """Start the OpenNLP process if it is not running"""
+        if self.alive():
+            return
+        self._stderr.clear()
+        with self._instrumentation.timer('spawn'):
+            self._process = Popen(self._args, shell=False, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        self._instrumentation.count('processes_spawned')
+        self._stderr_reader = _start_thread(_drain, self._process.stderr, self._stderr)
+
+
+    def alive(self):
+        """Check whether the OpenNLP process is running"""
+        return self._process is not None and self._process.poll() is None
+
+
+    def restart(self):
+        """Kill the OpenNLP process (if any) and start a new one"""
+        self.__terminate__()
+        self.start()
+
+
+    def stderr(self):
+        """Most recent stderr output of the OpenNLP process"""
+        return '\n'.join(self._stderr)
+
+
+    def __terminate__(self):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except (OSError, ValueError):
+            pass
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        process.stdout.close()
+
+
+    def cancel(self):
+        """
+        Kill the OpenNLP process, failing the request in progress; a new process is started for the
+        next request. Unlike close(), it does not wait for the request.
+        """
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+
+    def __failure__(self, process, timed_out):
+        # Stop a process which did not answer and build the exception describing it
+        try:
+            process.wait(0 if timed_out else 1)
+        except TimeoutExpired:
+            pass
+        returncode = process.poll()
+        self.__terminate__()
+        if self._stderr_reader is not None:
+            self._stderr_reader.join(1)
+        if timed_out:
+            return OpenNLPTimeoutError(stderr=self.stderr())
+        return OpenNLPError(returncode=returncode, stderr=self.stderr())
+
+
+    def __write__(self, process, data):
+        try:
+            process.stdin.write(data)
+            process.stdin.flush()
+        except (OSError, ValueError):
+            # The process died; the reader notices it on EOF
+            pass
+
+
+    def process(self, lines, timeout=None):
+        """
+        Send lines to the OpenNLP process and return its output, one line per input line.
+        :param lines: List of input lines (without line breaks)
+        :param timeout: Time limit in seconds, including the wait for a request in progress; the process
+            is killed (and restarted for the next request) and OpenNLPTimeoutError raised when it is exceeded
+        :return: List of output lines
+        """
+        if not all(lines):
+            return _without_empty(lambda batch: self.process(batch, timeout), lines)
+        # Every input line of document tools is followed by an empty one, which is answered too
+        responses = 2 if self._tool in _document_tools else 1
+        deadline = None if timeout is None else default_timer() + timeout
+        if not self._lock.acquire(*(() if timeout is None else (True, timeout))):
+            raise OpenNLPTimeoutError('OpenNLP worker is busy!')
+        try:
+            if not self.alive():
+                self.restart()
+            process = self._process
+            data = _encode_input(self._tool, lines)
+            received = 0
+            timed_out = threading.Event()
+            if deadline is not None:
+                # Kill the process when the deadline passes, which ends the reads below
+                timer = threading.Timer(_remaining(deadline), lambda: (timed_out.set(), process.kill()))
+                timer.daemon = True
+                timer.start()
+            try:
+                with self._instrumentation.timer('transfer'):
+                    # Feed stdin from a separate thread, as the tool may block writing to
+                    # stdout before it has read the whole input
+                    writer = _start_thread(self.__write__, process, data)
+                    output = []
+                    for _ in range(len(lines) * responses):
+                        line = process.stdout.readline()
+                        if not line:
+                            break
+                        received += len(line)
+                        output.append(line.decode('utf-8').rstrip('\r\n'))
+                    writer.join()
+            finally:
+                if deadline is not None:
+                    timer.cancel()
+            self._instrumentation.count('bytes_in', len(data))
+            self._instrumentation.count('bytes_out', received)
+            if len(output) < len(lines) * responses:
+                raise self.__failure__(process, timed_out.is_set())
+            return output[::responses]
+        finally:
+            self._lock.release()
+
+
+    def close(self):
+        """Stop the OpenNLP process"""
+        with self._lock:
+            self.__terminate__()
+
+
+class OpenNLPWorkerPool(object):
+    """
+    A pool of OpenNLP workers running the same tool and model. Batches of lines are spread across
+    the workers and processed concurrently; the output is returned in input order. Failed workers
+    are replaced, and a failed batch is retried once on the new process.
+
+    With hedging, a batch which is slower than the given percentile of recent batches is sent to an
+    idle worker as well; the first answer is used and the slower process is killed and replaced.
+    """
+
+    # Number of measured batches needed before requests are hedged
+    _hedge_samples = 20
+
+    def __init__(self, opennlp_bin, tool, model, workers=2, instrumentation=None, hedge=None):
+        """
+        Initialize the pool; the processes are started on first use.
+        :param opennlp_bin: Path to the OpenNLP run file, or the command starting the OpenNLP CLI
+        :param tool: OpenNLP command line tool name, such as POSTagger or ChunkerME
+        :param model: The path to the OpenNLP model .bin file used by the tool
+        :param workers: Number of OpenNLP processes
+        :param instrumentation: Collector for timings and counters (see nltk_opennlp.instrumentation)
+        :param hedge: Percentile (e.g. 95) of recent batch latencies after which a batch is sent to a
+            second worker; None disables hedging
+        """
+        if workers < 1:
+            raise ValueError('At least one worker is required!')
+        if hedge is not None and not 0 < hedge < 100:
+            raise ValueError('Hedging percentile must be between 0 and 100!')
+        self._args = (opennlp_bin, tool, model)
+        self._instrumentation = instrumentation
+        self._workers = [OpenNLPWorker(*self._args, instrumentation=instrumentation) for _ in range(workers)]
+        self._idle = Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._hedge = hedge
+        self._latencies = deque(maxlen=1000)
+        self._hedger = ThreadPoolExecutor(max_workers=2 * workers) if hedge is not None else None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def __len__(self):
+        return len(self._workers)
+
+
+    def __replace__(self, worker):
+        # Discard a failed worker and put a new one in its place
+        worker.close()
+        replacement = OpenNLPWorker(*self._args, instrumentation=self._instrumentation)
+        self._workers[self._workers.index(worker)] = replacement
+        return replacement
+
+
+    def __attempt__(self, worker, lines, deadline, finished):
+        # Process a batch on a worker taken from the idle queue, and return the worker to it
+        start = default_timer()
+        try:
+            try:
+                output = worker.process(lines, _remaining(deadline))
+            except OpenNLPTimeoutError:
+                worker = self.__replace__(worker)
+                raise
+            except OSError:
+                worker = self.__replace__(worker)
+                # Retry once on a fresh process before giving up, unless a hedged request has answered
+                if finished.is_set() or _remaining(deadline) == 0:
+                    raise
+                output = worker.process(lines, _remaining(deadline))
+            self._latencies.append(default_timer() - start)
+            return output
+        finally:
+            self._idle.put(worker)
+
+
+    def __hedge_delay__(self):
+        latencies = sorted(self._latencies)
+        if len(latencies) < self._hedge_samples:
+            return None
+        return latencies[min(int(len(latencies) * self._hedge / 100.0), len(latencies) - 1)]
+
+
+    def __process_batch__(self, lines, deadline):
+        # The deadline covers the wait for an idle worker as well
+        try:
+            worker = self._idle.get(timeout=_remaining(deadline))
+        except Empty:
+            raise OpenNLPTimeoutError('All OpenNLP workers are busy!')
+        finished = threading.Event()
+        delay = self.__hedge_delay__() if self._hedge is not None else None
+        if delay is None:
+            return self.__attempt__(worker, lines, deadline, finished)
+        attempts = {self._hedger.submit(self.__attempt__, worker, lines, deadline, finished): worker}
+        remaining = _remaining(deadline)
+        if not wait(attempts, min(delay, remaining) if remaining is not None else delay).done:
+            try:
+                spare = self._idle.get_nowait()
+                attempts[self._hedger.submit(self.__attempt__, spare, lines, deadline, finished)] = spare
+                (self._instrumentation or _disabled).count('hedged_requests')
+            except Empty:
+                pass
+        pending, error = set(attempts), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    finished.set()
+                    # Stop the slower worker, which is replaced when its request fails
+                    for other in pending:
+                        attempts[other].cancel()
+                    return attempt.result()
+                error = attempt.exception()
+        raise error
+
+
+    def start(self):
+        """Start the OpenNLP processes of all workers"""
+        for worker in self._workers:
+            worker.start()
+
+
+    def check_health(self):
+        """
+        Replace the workers whose processes have died. Idle workers that have not been started yet
+        are considered healthy.
+        :return: Number of replaced workers
+        """
+        replaced = 0
+        for _ in range(len(self._workers)):
+            worker = self._idle.get()
+            if worker._process is not None and not worker.alive():
+                worker = self.__replace__(worker)
+                replaced += 1
+            self._idle.put(worker)
+        return replaced
+
+
+    def process(self, lines, timeout=None):
+        """
+        Send lines to the pool and return the output, one line per input line.
+        :param lines: List of input lines (without line breaks)
+        :param timeout: Time limit in seconds for all lines, including the wait for an idle worker; workers
+            which exceed it are killed and replaced, and OpenNLPTimeoutError is raised
+        :return: List of output lines
+        """
+        if not lines:
+            return []
+        deadline = None if timeout is None else default_timer() + timeout
+        size = -(-len(lines) // len(self._workers))
+        batches = [lines[i:i + size] for i in range(0, len(lines), size)]
+        futures = [self._executor.submit(self.__process_batch__, batch, deadline) for batch in batches]
+        output = []
+        try:
+            for future in futures:
+                output.extend(future.result(_remaining(deadline)))
+        except OpenNLPTimeoutError:
+            raise
+        except FutureTimeoutError:
+            # The batches are still queued behind the requests of other callers
+            raise OpenNLPTimeoutError('All OpenNLP workers are busy!')
+        finally:
+            for future in futures:
+                future.cancel()
+        return output
+
+
+    def close(self):
+        """Stop all OpenNLP processes of the pool"""
+        for worker in self._workers:
+            worker.close()
@@ -17,6 +17,7 @@ setup(name='nltk-opennlp',
       py_modules=['nltk-opennlp'],
       packages=['nltk_opennlp'],
       install_requires=['nltk'],
+      python_requires='>=3.5',
       license='GPL Version 3',
     )
 
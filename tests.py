@@ -1,13 +1,51 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import zipfile
+from unittest import mock
 
+from nltk.chunk import tree2conlltags
+from nltk.tree import Tree
+from nltk_opennlp.aio import AsyncOpenNLPWorker, AsyncOpenNLPWorkerPool
+from nltk_opennlp.batching import MicroBatcher
+from nltk_opennlp.cache import OutputCache
 from nltk_opennlp.chunkers import OpenNLPChunker, OpenNERChunker, OpenNERChunkerMulti
+from nltk_opennlp import engine
+from nltk_opennlp.corpus import TaggedCorpus
+from nltk_opennlp.files import process_file
+from nltk_opennlp.instrumentation import StatsCollector
+from nltk_opennlp.launcher import JavaLauncher
+from nltk_opennlp.pipeline import OpenNLPPipeline
+from nltk_opennlp.registry import BackendRegistry
+from nltk_opennlp.router import LanguageRouter, detect_language
+from nltk_opennlp.server import OpenNLPServer
 from nltk_opennlp.taggers import OpenNLPTagger
+from nltk_opennlp.workers import OpenNLPError, OpenNLPTimeoutError, OpenNLPWorker, OpenNLPWorkerPool
 
 opennlp_dir = 'apache-opennlp'    # Path to Apache OpenNLP
 models_dir = 'opennlp_models'     # Path to OpenNLP models directory
 
+
+def _gis_model(outcomes, patterns, predicates, parameters):
+    # GIS model in OpenNLP's binary format; patterns are (number of predicates, outcome ids) pairs
+    def utf(text):
+        data = text.encode('utf-8')
+        return struct.pack('>H', len(data)) + data
+
+    data = utf('GIS') + struct.pack('>id', 1, 0.0) + struct.pack('>i', len(outcomes))
+    data += b''.join(map(utf, outcomes)) + struct.pack('>i', len(patterns))
+    data += b''.join(utf(' '.join(map(str, [count] + ids))) for count, ids in patterns)
+    data += struct.pack('>i', len(predicates)) + b''.join(map(utf, predicates))
+    return data + b''.join(struct.pack('>d', value) for value in parameters)
+
+
 class OpenNLPTest(unittest.TestCase):
 
     def test_opennlp_tagger(self):
@@ -33,6 +71,119 @@ class OpenNLPTest(unittest.TestCase):
         assert en_tags[0][0] == 'Pierre'
         assert en_tags[0][1] == 'NNP'
 
+    def test_opennlp_tagger_sents(self):
+        language = 'en'
+        tt = OpenNLPTagger(language=language,
+                           path_to_bin=os.path.join(opennlp_dir, 'bin'),
+                           path_to_model=os.path.join(models_dir, 'en-pos-maxent.bin'))
+        sentences = [['Pierre', 'Vinken', ',', '61', 'years', 'old', '.'],
+                     'Mr. Vinken is chairman of Elsevier N.V. , the Dutch publishing group .']
+        en_tags = tt.tag_sents(sentences)
+        print(en_tags)
+        assert len(en_tags) == 2
+        assert len(en_tags[0]) == 7
+        assert en_tags[0][0] == ('Pierre', 'NNP')
+        assert en_tags[1][0][0] == 'Mr.'
+
+
+    def test_python_tagger_parity(self):
+        # Tags recorded from the POSTagger tool
+        phrase = 'Pierre Vinken , 61 years old , will join the board as a nonexecutive director Nov. 29 .'
+        recorded = [('en-pos-maxent.bin', phrase,
+                     ['NNP', 'NNP', ',', 'CD', 'NNS', 'JJ', ',', 'MD', 'VB', 'DT', 'NN', 'IN', 'DT', 'JJ', 'NN', 'NNP',
+                      'CD', '.']),
+                    ('de-pos-maxent.bin', 'Das Haus hat einen großen hübschen Garten.',
+                     ['ART', 'NN', 'VAFIN', 'ART', 'ADJA', 'ADJA', 'NN'])]
+        for model, phrase, tags in recorded:
+            tt = OpenNLPTagger(language=model[:2], path_to_model=os.path.join(models_dir, model), backend='python')
+            assert [tag for _, tag in tt.tag(phrase)] == tags
+        # Same tags as the POSTagger tool, for maxent and perceptron models
+        sentences = ['Mr. Vinken is chairman of Elsevier N.V. , the Dutch publishing group .',
+                     'Rudolph Agnew , 55 years old and former chairman of Consolidated Gold Fields PLC , was named '
+                     'a director of this British industrial conglomerate .',
+                     'A form of asbestos once used to make Kent cigarette filters has caused a high percentage of '
+                     'cancer deaths among a group of workers exposed to it more than 30 years ago , researchers '
+                     'reported .', 'The well-known 3-D effects cost $ 1.5 million in 1989 .', '']
+        for model in ('en-pos-maxent.bin', 'en-pos-perceptron.bin'):
+            path = os.path.join(models_dir, model)
+            tt = OpenNLPTagger(path_to_bin=os.path.join(opennlp_dir, 'bin'), path_to_model=path)
+            assert OpenNLPTagger(path_to_model=path, backend='python').tag_sents(sentences) == tt.tag_sents(sentences)
+
+
+    def test_python_ner_parity(self):
+        # Same entities as the TokenNameFinder tool, for all English NER models together
+        sentences = [['Pierre', 'Vinken', ',', '61', 'years', 'old', ',', 'will', 'join', 'Martin', 'Vinken', 'as',
+                      'a', 'nonexecutive', 'director', 'Nov.', '29', '.'],
+                     'Mr. Vinken is chairman of Elsevier N.V. , the Dutch publishing group in Amsterdam .'.split(),
+                     'The company paid $ 1.5 million , or 12 % of its revenue , at 10:30 a.m. on Monday .'.split(), []]
+        models = [os.path.join(models_dir, 'en-ner-{}.bin'.format(name))
+                  for name in ('person', 'organization', 'location', 'date', 'time', 'money', 'percentage')]
+        cp = OpenNERChunkerMulti(models, path_to_bin=os.path.join(opennlp_dir, 'bin'))
+        expected = cp.parse_sents(sentences, output='spans')
+        assert OpenNERChunkerMulti(models, backend='python').parse_sents(sentences, output='spans') == expected
+        for model in models:
+            assert engine.load_name_finder_model(model).process([' '.join(tokens) for tokens in sentences]) == \
+                OpenNERChunker(model, path_to_bin=os.path.join(opennlp_dir, 'bin')).__run__(
+                    "TokenNameFinder", model, [' '.join(tokens) for tokens in sentences])
+
+
+    def test_opennlp_tagger_persistent(self):
+        language = 'en'
+        phrase = 'Pierre Vinken , 61 years old , will join the board as a nonexecutive director Nov. 29 .'
+        with OpenNLPTagger(language=language,
+                           path_to_bin=os.path.join(opennlp_dir, 'bin'),
+                           path_to_model=os.path.join(models_dir, 'en-pos-maxent.bin'),
+                           persistent=True) as tt:
+            first = tt.tag(phrase)
+            second = tt.tag(phrase)
+            print(second)
+            assert first == second
+            assert second[0] == ('Pierre', 'NNP')
+
+
+    def test_opennlp_tagger_cache(self):
+        cache = OutputCache()
+        tt = OpenNLPTagger(language='en',
+                           path_to_bin=os.path.join(opennlp_dir, 'bin'),
+                           path_to_model=os.path.join(models_dir, 'en-pos-maxent.bin'),
+                           cache=cache)
+        phrase = 'Pierre Vinken , 61 years old , will join the board as a nonexecutive director Nov. 29 .'
+        tagged = tt.tag_sents([phrase, phrase])
+        assert tagged[0] == tagged[1] == tt.tag(phrase)
+        assert cache.stats()['misses'] == 1
+
+
+    def test_opennlp_stream(self):
+        tt = OpenNLPTagger(language='en',
+                           path_to_bin=os.path.join(opennlp_dir, 'bin'),
+                           path_to_model=os.path.join(models_dir, 'en-pos-maxent.bin'))
+        cp = OpenNERChunker(path_to_bin=os.path.join(opennlp_dir, 'bin'),
+                            path_to_chunker=os.path.join(models_dir, 'en-chunker.bin'),
+                            path_to_ner_model=os.path.join(models_dir, 'en-ner-person.bin'))
+        phrases = ['Pierre Vinken , 61 years old , will join the board as a nonexecutive director Nov. 29 .',
+                   'Mr. Vinken is chairman of Elsevier N.V. , the Dutch publishing group .'] * 50
+        tagged = list(tt.tag_stream(iter(phrases), window=10))
+        assert tagged == tt.tag_sents(phrases)
+        assert list(cp.parse_stream(iter(tagged), window=10)) == cp.parse_sents(tagged)
+
+
+    def test_opennlp_pipeline(self):
+        document = 'Pierre Vinken, 61 years old, will join the board as a nonexecutive director Nov. 29.\n\n' \
+                   'Mr. Vinken is chairman of Elsevier N.V., the Dutch publishing group.'
+        with OpenNLPPipeline(path_to_bin=os.path.join(opennlp_dir, 'bin'),
+                             path_to_sentence_model=os.path.join(models_dir, 'en-sent.bin'),
+                             path_to_tokenizer=os.path.join(models_dir, 'en-token.bin'),
+                             path_to_pos_model=os.path.join(models_dir, 'en-pos-maxent.bin'),
+                             path_to_chunker=os.path.join(models_dir, 'en-chunker.bin'),
+                             ner_models=[os.path.join(models_dir, 'en-ner-person.bin')],
+                             persistent=True) as pipeline:
+            sentences = pipeline.parse(document)
+            assert len(sentences) == 2
+            tree, offsets = sentences[0]
+            assert [document[start:end] for start, end in offsets] == [leaf[0] for leaf in tree.leaves()]
+            spans = pipeline.parse(document, output='spans')
+            assert document[spans[0][0]:spans[0][1]] == 'Pierre Vinken'
+
 
     def test_opennlp_chunker(self):
         language = 'en'
@@ -44,6 +195,7 @@ class OpenNLPTest(unittest.TestCase):
         cp = OpenNLPChunker(path_to_bin=os.path.join(opennlp_dir, 'bin'),
                             path_to_chunker=os.path.join(models_dir, 'en-chunker.bin'))
         print(cp.parse(sentence))
+        assert cp.parse(sentence, output='iob') == tree2conlltags(cp.parse(sentence))
 
 
     def test_opennlp_chunker_de(self):
@@ -127,5 +279,553 @@ class OpenNLPTest(unittest.TestCase):
         print(cp.parse(sentence))
 
 
+    def test_opennlp_ner_chunker_workers(self):
+        language = 'en'
+        tt = OpenNLPTagger(language=language,
+                           path_to_bin=os.path.join(opennlp_dir, 'bin'),
+                           path_to_model=os.path.join(models_dir, 'en-pos-maxent.bin'),
+                           workers=2)
+        phrases = ['Pierre Vinken , 61 years old , will join Martin Vinken as a nonexecutive director Nov. 29 .',
+                   'John Haddock , 32 years old male , travelled to Cambridge , USA in October 20 .'] * 4
+        sentences = tt.tag_sents(phrases)
+        tt.close()
+        with OpenNERChunker(path_to_bin=os.path.join(opennlp_dir, 'bin'),
+                            path_to_chunker=os.path.join(models_dir,
+                                                         '{}-chunker.bin'.format(language)),
+                            path_to_ner_model=os.path.join(models_dir,
+                                                           '{}-ner-person.bin'.format(language)),
+                            workers=2) as cp:
+            parses = cp.parse_sents(sentences)
+            print(parses)
+            assert len(parses) == len(phrases)
+            assert parses[0] == parses[2] == cp.parse(sentences[0])
+
+
+    def test_opennlp_async(self):
+        language = 'en'
+        phrases = ['Pierre Vinken , 61 years old , will join Martin Vinken as a nonexecutive director Nov. 29 .',
+                   'John Haddock , 32 years old male , travelled to Cambridge , USA in October 20 .']
+
+        async def run():
+            async with OpenNLPTagger(language=language,
+                                     path_to_bin=os.path.join(opennlp_dir, 'bin'),
+                                     path_to_model=os.path.join(models_dir, 'en-pos-maxent.bin'),
+                                     persistent=True) as tt, \
+                    OpenNERChunker(path_to_bin=os.path.join(opennlp_dir, 'bin'),
+                                   path_to_chunker=os.path.join(models_dir, '{}-chunker.bin'.format(language)),
+                                   path_to_ner_model=os.path.join(models_dir, '{}-ner-person.bin'.format(language)),
+                                   persistent=True) as cp:
+                sentences = await asyncio.gather(*(tt.atag(phrase) for phrase in phrases))
+                assert sentences == await tt.atag_sents(phrases)
+                parses = await asyncio.gather(*(cp.aparse(sentence) for sentence in sentences))
+                assert parses == await cp.aparse_sents(sentences, timeout=60)
+                return parses
+
+        parses = asyncio.run(run())
+        print(parses)
+        assert len(parses) == 2
+
+
+class OpenNLPOutputTest(unittest.TestCase):
+    """Processing of OpenNLP output, which does not need an OpenNLP installation"""
+
+    def setUp(self):
+        self.cp = OpenNLPChunker.__new__(OpenNLPChunker)
+        self.cp.use_punc_tag = False
+
+
+    def test_chunker_output_tree(self):
+        output = '[NP Pierre_NNP Vinken_NNP ] ,_, (_-LRB- [NP 61_CD years_NNS ] )_-RRB- [VP will_MD join_VB ] ' \
+                 '[NP the_DT board_NN ] [NP e_mail_NN ] ._.'
+        expected = Tree.fromstring('(S (NP (NNP Pierre) (NNP Vinken)) (, ,) (-LRB- LRB) (NP (CD 61) (NNS years)) '
+                                   '(-RRB- RRB) (VP (MD will) (VB join)) (NP (DT the) (NN board)) '
+                                   '(NP (NN e_mail)) (. .))')
+        expected[2][0] = '('
+        expected[4][0] = ')'
+        assert self.cp.__chunker_output_tree__(output) == expected
+        self.cp.use_punc_tag = True
+        assert self.cp.__chunker_output_tree__(',_, ._.') == Tree.fromstring('(S (PUNC ,) (PUNC .))')
+        assert self.cp.__chunker_output_tree__('[NP a_DT') is None
+
+
+    def test_chunker_output_iob(self):
+        output = '[NP Pierre_NNP Vinken_NNP ] ,_, [NP 61_CD years_NNS ] [ADJP old_JJ ] [VP will_MD join_VB ] ._.'
+        for use_punc_tag in (False, True):
+            self.cp.use_punc_tag = use_punc_tag
+            tree = self.cp.__get_nltk_parse_tree__(self.cp.__chunker_output_tree__(output))
+            assert self.cp.__chunker_output_iob__(output) == tree2conlltags(Tree.convert(tree))
+        assert self.cp.__chunker_output_iob__(output)[:3] == [('Pierre', 'NNP', 'B-NP'), ('Vinken', 'NNP', 'I-NP'),
+                                                              (',', 'PUNC', 'O')]
+        # Punctuation words are kept, while the parse trees replace them by their tags
+        assert self.cp.__chunker_output_iob__('[VP rose_VBD ] --_: ..._:') == [('rose', 'VBD', 'B-VP'),
+                                                                              ('--', 'PUNC', 'O'), ('...', 'PUNC', 'O')]
+        assert self.cp.__chunker_output_iob__('[NP a_DT') is None
+        assert self.cp.__build_output__([[('a', 'DT')], []], [['[NP a_DT ]', '']], 'iob') == [[('a', 'DT', 'B-NP')], []]
+        self.assertRaises(ValueError, self.cp.__check_output__, 'conll')
+
+
+    def test_parse_tree_flat(self):
+        tree = Tree.fromstring('(S (NP (NNP Pierre) (NNP Vinken)) (, ,) (NP (DT a) (JJ nonexecutive) (NN director)) '
+                               '(NP (NNP Nov.) (CD 29)) (. .))')
+        parse = Tree.convert(self.cp.__get_nltk_parse_tree__(tree))
+        assert parse == Tree('S', [Tree('NP', [('Pierre', 'NNP'), ('Vinken', 'NNP')]), (',', ','),
+                                   Tree('NP', [('a', 'DT'), ('nonexecutive', 'JJ'), ('director', 'NN')]),
+                                   Tree('NP', [('Nov.', 'NNP'), ('29', 'CD')]), ('.', '.')])
+
+
+    def test_parse_tree_nested(self):
+        tree = Tree.fromstring('(S (PERSON (NNP Pierre) (NNP Vinken)) (VP (MD will) (VB join)) '
+                               '(NP (DT the) (NN board) (PERSON (NNP Martin) (NNP Vinken)) (NN x)) '
+                               '(NP (DT the) (DATE (NNP Nov.) (CD 29)) (DATE (NNP Dec.) (CD 1))) (. .))')
+        parse = Tree.convert(self.cp.__get_nltk_parse_tree__(tree))
+        assert parse == Tree('S', [Tree('PERSON', [('Pierre', 'NNP'), ('Vinken', 'NNP')]),
+                                   Tree('VP', [('will', 'MD'), ('join', 'VB')]),
+                                   Tree('NP', [('the', 'DT'), ('board', 'NN'),
+                                               Tree('PERSON', [('Martin', 'NNP'), ('Vinken', 'NNP')]),
+                                               ('x', 'NN')]),
+                                   Tree('NP', [('the', 'DT'), Tree('DATE', [('Nov.', 'NNP'), ('29', 'CD')]),
+                                               Tree('DATE', [('Dec.', 'NNP'), ('1', 'CD')])]),
+                                   ('.', '.')])
+        # Token order is kept and leaves are attached once
+        assert [leaf[0] for leaf in parse.leaves()] == tree.leaves()
+
+
+    def test_parse_tree_entities(self):
+        chunks = '[NP a_DT director_NN ] ,_, [NP the_DT board_NN Martin_NNP Vinken_NNP ] [NP Pierre_NNP Vinken_NNP ]'
+        tokens = [tuple(token.split('_')) for token in chunks.split() if '_' in token]
+        parse = self.cp.__build_parses__([tokens], [[chunks], ['a director , the board <START:person> Martin Vinken '
+                                                               '<END> <START:person> Pierre Vinken <END>']])[0]
+        parse = Tree.convert(parse)
+        assert parse == Tree('S', [Tree('NP', [('a', 'DT'), ('director', 'NN')]), (',', ','),
+                                   Tree('NP', [('the', 'DT'), ('board', 'NN'),
+                                               Tree('PERSON', [('Martin', 'NNP'), ('Vinken', 'NNP')])]),
+                                   Tree('PERSON', [('Pierre', 'NNP'), ('Vinken', 'NNP')])])
+
+
+    def test_instrumentation(self):
+        stats = StatsCollector()
+        self.cp._instrumentation = stats
+        chunks = '[NP a_DT director_NN ] ,_, [NP the_DT board_NN ]'
+        tokens = [tuple(token.split('_')) for token in chunks.split() if '_' in token]
+        self.cp.__build_parses__([tokens, tokens], [[chunks, chunks]])
+        summary = stats.summary()
+        assert set(summary) == {'chunk_tree', 'normalize'}
+        assert summary['chunk_tree']['count'] == 1
+        assert summary['normalize']['p99'] <= summary['normalize']['max']
+        assert stats.counters == {'sentences': 2, 'tokens': 10}
+        assert 'chunk_tree' in stats.report()
+
+
+    def test_name_spans(self):
+        spans = self.cp.__name_spans__('<START:person> Pierre Vinken <END> , 61 years old , '
+                                       'will join the board <START:date> Nov. 29 <END> .')
+        assert spans == [(0, 2, 'person'), (11, 13, 'date')]
+
+
+    def test_merge_overlapping_spans(self):
+        # Leftmost, then longest span wins; identical ranges keep the label of the first model
+        spans = [(0, 2, 'person'), (1, 3, 'organization'), (0, 2, 'location'), (5, 6, 'date')]
+        assert self.cp.__merge_spans__(spans) == [(0, 2, 'person'), (5, 6, 'date')]
+        assert self.cp.__merge_spans__([(1, 2, 'time'), (0, 3, 'date')]) == [(0, 3, 'date')]
+
+
+    def test_entity_spans_output(self):
+        # Repeated tokens and regex metacharacters are found at their own positions
+        sentences = [['A', '(', 'B', ')', 'A', '(', 'B', ')'], ['x']]
+        outputs = [['<START:person> A ( <END> B ) <START:person> A ( B ) <END>', 'x'],
+                   ['A ( B ) A ( <START:date> B ) <END>', 'x']]
+        assert self.cp.__build_output__(sentences, outputs, 'spans') == [[(0, 2, 'person'), (4, 8, 'person')], []]
+
+
+    def test_attach_entities(self):
+        tree = Tree.fromstring('(S (NP (NNP Pierre) (NNP Vinken)) (, ,) (VP (MD will) (VB join)) '
+                               '(NP (DT the) (NNP Big) (NNP Apple)) (NP (NNP Nov.)) (NP (CD 29)))')
+        spans = [(0, 2, 'person'), (6, 8, 'organization'), (8, 10, 'date')]
+        expected = Tree.fromstring('(S (PERSON (NNP Pierre) (NNP Vinken)) (, ,) (VP (MD will) (VB join)) '
+                                   '(NP (DT the) (ORGANIZATION (NNP Big) (NNP Apple))) (DATE (NNP Nov.) (CD 29)))')
+        assert self.cp.__attach_entities__(tree, spans) == expected
+        # Entities crossing a chunk boundary are left out
+        assert self.cp.__attach_entities__(tree, [(1, 3, 'person')]) == tree
+
+
+    def test_pipeline_offsets(self):
+        pipeline = OpenNLPPipeline.__new__(OpenNLPPipeline)
+        document = 'Pierre Vinken is 61.\nHe joined\n \nthe board.'
+        paragraphs = list(pipeline.__paragraphs__([document, '']))
+        assert paragraphs == [(0, 'Pierre Vinken is 61. He joined'), (33, 'the board.'), None, None]
+        sentences = list(pipeline.__sentences__([(paragraphs[0], (['Pierre Vinken is 61.', 'He joined'],)),
+                                                 (None, ([],))]))
+        assert sentences == [(0, 'Pierre Vinken is 61.'), (21, 'He joined'), None]
+        tokens = list(pipeline.__tokens__([(sentences[0], ('Pierre Vinken is 61 .',))]))
+        assert [document[start:end] for start, end in tokens[0][1]] == ['Pierre', 'Vinken', 'is', '61', '.']
+
+
+    def test_pipeline_ner_only(self):
+        class Launcher(object):
+            def command(self, path_to_bin=None, verbose=False):
+                return sys.executable, '-c', ''
+
+        # Entity spans do not need the POS tagger and chunker models
+        pipeline = OpenNLPPipeline(path_to_sentence_model='en-sent.bin', path_to_tokenizer='en-token.bin',
+                                   ner_models=['en-ner-person.bin'], launcher=Launcher())
+        assert pipeline._tagger is None and pipeline._opennlp_bin == (sys.executable, '-c', '')
+        pipeline.__check_output__('spans')
+        self.assertRaises(LookupError, pipeline.__check_output__, 'trees')
+
+
+    def test_output_cache(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            model = os.path.join(tmp, 'model.bin')
+            with open(model, 'w') as f:
+                f.write('model')
+            sent = []
+            def run(lines):
+                sent.append(lines)
+                return [line.upper() for line in lines]
+
+            with OutputCache(maxsize=2, path=os.path.join(tmp, 'cache.db')) as cache:
+                assert cache.process('POSTagger', model, ['a', 'b', 'a'], run) == ['A', 'B', 'A']
+                assert cache.process('POSTagger', model, ['b', 'c'], run) == ['B', 'C']
+                # Duplicates are sent once, and only the lines missing from the cache
+                assert sent == [['a', 'b'], ['c']]
+                assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 3
+                assert len(cache) == 2
+            with OutputCache(path=os.path.join(tmp, 'cache.db')) as cache:
+                # Evicted from memory earlier, but kept in the persistent store
+                assert cache.process('POSTagger', model, ['a'], run) == ['A']
+                assert len(sent) == 2
+                # A changed model invalidates its entries
+                with open(model, 'w') as f:
+                    f.write('retrained model')
+                assert cache.process('POSTagger', model, ['a'], run) == ['A']
+                assert sent[-1] == ['a']
+        finally:
+            shutil.rmtree(tmp)
+
+
+    def test_tagged_corpus(self):
+        corpus = TaggedCorpus([[('Pierre', 'NNP'), ('Vinken', 'NNP')], [], [('join', 'VB'), ('the', 'DT')]])
+        corpus.__append_output__('board_NN ,_, N_A_NNP')
+        assert len(corpus) == 4 and corpus.num_tokens == 7
+        assert corpus[3] == [('board', 'NN'), (',', ','), ('N_A', 'NNP')]
+        assert corpus.tagset == ('NNP', 'VB', 'DT', 'NN', ',')
+        assert list(corpus.tag_ids(2)) == [1, 2]
+        view = corpus[1:3]
+        assert len(view) == 2 and view.num_tokens == 2
+        assert view.to_lists() == [[], [('join', 'VB'), ('the', 'DT')]]
+        self.assertRaises(ValueError, view.append, [('a', 'DT')])
+
+
+    def test_process_file_checkpoint(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            input_path, output_path = os.path.join(tmp, 'input.txt'), os.path.join(tmp, 'output.txt')
+            checkpoint = os.path.join(tmp, 'checkpoint')
+            with open(input_path, 'w') as f:
+                f.write(''.join('sentence {}\n'.format(i) for i in range(10)))
+            record = lambda line, output: output + '\n'
+            def failing(lines):
+                if 'sentence 6' in lines:
+                    raise OSError('OpenNLP command failed!')
+                return [line.upper() for line in lines]
+
+            self.assertRaises(OSError, process_file, input_path, output_path, failing, record, 3, checkpoint)
+            assert os.path.exists(checkpoint)
+            # Resumed after the last completed batch
+            sent = []
+            def run(lines):
+                sent.extend(lines)
+                return [line.upper() for line in lines]
+            assert process_file(input_path, output_path, run, record, 3, checkpoint) == 4
+            assert sent[0] == 'sentence 6' and not os.path.exists(checkpoint)
+            with open(output_path) as f:
+                assert f.read() == ''.join('SENTENCE {}\n'.format(i) for i in range(10))
+        finally:
+            shutil.rmtree(tmp)
+
+
+    def test_worker_failures(self):
+        # Python scripts standing in for OpenNLP processes which crash or hang
+        crashing = OpenNLPWorker(sys.executable, '-c', 'import sys; sys.stderr.write("Out of memory\\n"); sys.exit(3)')
+        with self.assertRaises(OpenNLPError) as context:
+            crashing.process(['a'])
+        assert context.exception.returncode == 3 and context.exception.stderr == 'Out of memory'
+        assert str(context.exception) == 'OpenNLP command failed! (exit code 3; Out of memory)'
+        hanging = OpenNLPWorker(sys.executable, '-c', 'import time; time.sleep(60)')
+        self.assertRaises(OpenNLPTimeoutError, hanging.process, ['a'], 0.2)
+        assert not hanging.alive()
+        assert issubclass(OpenNLPTimeoutError, TimeoutError) and issubclass(OpenNLPError, OSError)
+        # The deadline covers the wait for a worker busy with a request without one
+        with OpenNLPWorkerPool(sys.executable, '-c', 'import time; time.sleep(1)', workers=1) as pool:
+            busy = threading.Thread(target=self.assertRaises, args=(OpenNLPError, pool.process, ['a']))
+            busy.start()
+            time.sleep(0.1)
+            start = time.time()
+            self.assertRaises(OpenNLPTimeoutError, pool.process, ['b'], 0.2)
+            assert time.time() - start < 0.8
+            busy.join()
+
+
+    def test_async_worker_timeout(self):
+        class HangingLauncher(object):
+            def command(self, path_to_bin=None, verbose=False):
+                return sys.executable, '-c', 'import time; time.sleep(60)'
+
+        async def run():
+            worker = AsyncOpenNLPWorker(sys.executable, '-c', 'import time; time.sleep(60)')
+            with self.assertRaises(asyncio.TimeoutError):
+                await worker.process(['a'], 0.2)
+            assert not worker.alive()
+            stopped = worker._stopped[0]
+            await worker.aclose()
+            assert stopped.returncode is not None
+            # Cancelled by an outer deadline instead of its own
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(worker.process(['a']), 0.2)
+            assert not worker.alive()
+            # A cancelled request does not fail the other requests in flight
+            script = 'import sys, time\nfor line in sys.stdin:\n    time.sleep(0.3)\n    print(line.strip(), flush=True)'
+            async with AsyncOpenNLPWorker(sys.executable, '-c', script) as worker:
+                cancelled = asyncio.ensure_future(worker.process(['a']))
+                other = asyncio.ensure_future(worker.process(['b']))
+                await asyncio.sleep(0.1)
+                cancelled.cancel()
+                assert await other == ['b'] and worker.alive()
+                assert await worker.process(['c']) == ['c']
+            pool = AsyncOpenNLPWorkerPool(sys.executable, '-c', 'import time; time.sleep(60)', workers=2)
+            with self.assertRaises(asyncio.TimeoutError):
+                await pool.process(['a', 'b'], 0.2)
+            assert not any(worker.alive() for worker in pool._workers)
+            cp = OpenNLPChunker(path_to_chunker='model.bin', persistent=True, launcher=HangingLauncher())
+            with self.assertRaises(asyncio.TimeoutError):
+                await cp.aparse_sents([[('a', 'DT')]], timeout=0.2)
+            assert not any(backend.alive() for backend in cp._async_backends.values())
+            await cp.aclose()
+
+        asyncio.run(run())
+
+
+    def test_async_worker_long_lines(self):
+        # Answers each line with a line of 200 KB, over the default limit of asyncio streams
+        script = 'import sys\nfor line in sys.stdin:\n    print(line.strip() * 100000, flush=True)'
+
+        async def run():
+            async with AsyncOpenNLPWorker(sys.executable, '-c', script) as worker:
+                assert await worker.process(['ab', 'cd']) == ['ab' * 100000, 'cd' * 100000]
+            with mock.patch('nltk_opennlp.aio._stream_limit', 1024):
+                worker = AsyncOpenNLPWorker(sys.executable, '-c', script)
+                with self.assertRaises(OpenNLPError):
+                    await asyncio.wait_for(worker.process(['ab']), 10)
+                assert not worker.alive()
+
+        asyncio.run(run())
+
+
+    def test_micro_batcher(self):
+        batches = []
+        def process(items):
+            batches.append(list(items))
+            if 'error' in items:
+                raise ValueError('Bad item')
+            return [item.upper() for item in items]
+
+        with MicroBatcher(process, max_batch_size=3, max_delay=0.2) as batcher:
+            futures = [batcher.submit(item) for item in 'abcde']
+            assert [future.result() for future in futures] == ['A', 'B', 'C', 'D', 'E']
+            assert batches == [['a', 'b', 'c'], ['d', 'e']]
+            self.assertRaises(ValueError, batcher.submit('error').result)
+            stats = batcher.stats()
+            assert stats['requests'] == 6 and stats['batches'] == 3 and stats['max_batch_size'] == 3
+        self.assertRaises(RuntimeError, batcher.submit, 'f')
+
+
+    def test_java_launcher(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            for path in ('bin/opennlp', 'lib/opennlp-tools.jar', 'lib/opennlp-uima.jar', 'lib/opennlp.jsa'):
+                os.makedirs(os.path.dirname(os.path.join(tmp, path)), exist_ok=True)
+                open(os.path.join(tmp, path), 'w').close()
+            jars = os.pathsep.join(os.path.join(tmp, 'lib', jar) for jar in ('opennlp-tools.jar', 'opennlp-uima.jar'))
+            launcher = JavaLauncher(heap='1g', tiered_stop_at_level=1, gc='serial', java='java')
+            assert launcher.command(os.path.join(tmp, 'bin')) == (
+                'java', '-Xmx1g', '-XX:TieredStopAtLevel=1', '-XX:+UseSerialGC',
+                '-XX:SharedArchiveFile=' + os.path.join(tmp, 'lib', 'opennlp.jsa'),
+                '-cp', jars, 'opennlp.tools.cmdline.CLI')
+            assert JavaLauncher(java='java', cds_archive=False).command(os.path.join(tmp, 'bin')) == (
+                'java', '-cp', jars, 'opennlp.tools.cmdline.CLI')
+            self.assertRaises(ValueError, JavaLauncher, gc='none')
+        finally:
+            shutil.rmtree(tmp)
+
+
+    def test_language_router(self):
+        assert detect_language('The board will join the company') == 'en'
+        assert detect_language('Das Haus hat einen großen Garten') == 'de'
+        assert detect_language('Jeg har en hund og en kat') == 'da'
+        assert detect_language('xyz', default='nl') == 'nl'
+
+        class Backend(object):
+            def __init__(self, language):
+                self.language = language
+            def close(self):
+                pass
+
+        factories = dict((language, lambda language=language: Backend(language)) for language in ('en', 'da', 'de'))
+        router = LanguageRouter(factories, default_language='en')
+        sentences = ['the board will join', 'Jeg har en kat', 'xyz', 'the end']
+        languages = router.languages(sentences)
+        assert languages == ['en', 'da', 'en', 'en']
+        results = router.route(sentences, languages,
+                               lambda backend, batch: ['{}:{}'.format(backend.language, len(batch))] * len(batch))
+        assert results == ['en:3', 'da:1', 'en:3', 'en:3']
+        assert router.running() == ['da', 'en']
+        self.assertRaises(LookupError, router.route, ['x'], ['pt'], lambda backend, batch: batch)
+        router.close()
+        assert router.running() == []
+
+
+    def test_python_pos_engine(self):
+        # 't=DT' and 'w=runs' share the outcome pattern of NN and VB
+        data = _gis_model(['DT', 'NN', 'VB'], [(1, [1]), (1, [0]), (2, [1, 2])],
+                          ['default', 'w=the', 't=DT', 'w=runs'], [1.0, 5.0, 2.0, 0.0, 0.0, 3.0])
+        tag_dictionary = '<dictionary case_sensitive="false"><entry tags="VB"><token>Dog</token></entry></dictionary>'
+
+        tmp = tempfile.mkdtemp()
+        try:
+            model_path, dictionary_model_path = os.path.join(tmp, 'pos.bin'), os.path.join(tmp, 'pos-dict.bin')
+            for path, entries in ((model_path, {}), (dictionary_model_path, {'tags.tagdict': tag_dictionary})):
+                with zipfile.ZipFile(path, 'w') as archive:
+                    archive.writestr('manifest.properties', 'Manifest-Version=1.0\nLanguage=en\n')
+                    archive.writestr('pos.model', data)
+                    for name, content in entries.items():
+                        archive.writestr(name, content)
+            model = engine.load_pos_model(model_path)
+            assert engine.load_pos_model(model_path) is model and model.language == 'en'
+            assert model.context(1, ['the', 'dog', 'runs'], ['DT']) == [
+                'default', 'w=dog', 'suf=g', 'suf=og', 'suf=dog', 'suf=dog', 'pre=d', 'pre=do', 'pre=dog',
+                'pre=dog', 'p=the', 't=DT', 'pp=*SB*', 'n=runs', 'nn=*SE*']
+            tt = OpenNLPTagger(path_to_model=model_path, backend='python')
+            assert tt.tag_sents(['the dog runs', '']) == [[('the', 'DT'), ('dog', 'NN'), ('runs', 'VB')], []]
+            tt = OpenNLPTagger(path_to_model=dictionary_model_path, backend='python')
+            assert tt.tag('the dog runs') == [('the', 'DT'), ('dog', 'VB'), ('runs', 'VB')]
+            # Scores are the same with and without NumPy
+            context = model.context(2, ['the', 'dog', 'runs'], ['DT', 'NN'])
+            scores = model.model.eval(context)
+            numpy, engine.numpy = engine.numpy, None
+            try:
+                for score, expected in zip(model.model.eval(context), scores):
+                    self.assertAlmostEqual(score, expected)
+                assert tt.tag('the dog runs') == [('the', 'DT'), ('dog', 'VB'), ('runs', 'VB')]
+            finally:
+                engine.numpy = numpy
+            self.assertRaises(ValueError, OpenNLPTagger, path_to_model=model_path, backend='jython')
+        finally:
+            shutil.rmtree(tmp)
+
+
+    def test_python_ner_engine(self):
+        assert [engine.token_class(token) for token in ('über', '61', '1989', 'A4', '3.25', '1-2-3', 'I', 'IBM',
+                                                        'J.', 'Vinken', '$')] == \
+            ['lc', '2d', '4d', 'an', 'dp', 'dd', 'sc', 'ac', 'cp', 'ic', 'other']
+        # Capitalized tokens start person names, which continue over the following ones; a dangling
+        # continuation is not valid. Upper-case tokens are organizations
+        person = _gis_model(['person-start', 'person-cont', 'other'], [(1, [2]), (1, [0]), (2, [1])],
+                            ['def', 'wc=ic', 'po=person-start', 'w=dangling'], [2.0, 3.0, 5.0, 10.0])
+        organization = _gis_model(['organization-start', 'organization-cont', 'other'], [(1, [2]), (1, [0])],
+                                  ['def', 'wc=ac'], [2.0, 3.0])
+        tmp = tempfile.mkdtemp()
+        try:
+            paths = [os.path.join(tmp, name) for name in ('en-ner-person.bin', 'en-ner-organization.bin')]
+            for path, data in zip(paths, (person, organization)):
+                with zipfile.ZipFile(path, 'w') as archive:
+                    archive.writestr('manifest.properties', 'Manifest-Version=1.0\nLanguage=en\n')
+                    archive.writestr('nameFinder.model', data)
+            model = engine.load_name_finder_model(paths[0])
+            assert model.features(['Pierre', 'Vinken']).features[0] == [
+                'wc=ic', 'w&c=pierre,ic', 'n1wc=ic', 'n1w&c=vinken,ic', 'w=pierre', 'n1w=vinken', 'def', 'pd=null',
+                'w,nw=Pierre,Vinken', 'wc,nc=ic,ic', 'S=begin']
+            assert model.process(['Pierre Vinken joined IBM .', 'dangling Vinken', '']) == [
+                '<START:person> Pierre Vinken <END> joined IBM .', 'dangling <START:person> Vinken <END>', '']
+            cp = OpenNERChunkerMulti(paths, backend='python')
+            sentences = [['Pierre', 'Vinken', 'joined', 'IBM', '.'], []]
+            assert cp.parse_sents(sentences, output='spans') == [[(0, 2, 'person'), (3, 4, 'organization')], []]
+            assert asyncio.run(cp.aparse_sents(sentences, output='spans')) == cp.parse_sents(sentences, output='spans')
+            self.assertRaises(ValueError, OpenNERChunkerMulti, paths, backend='jython')
+        finally:
+            shutil.rmtree(tmp)
+
+
+    def test_registry(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            models = [os.path.join(tmp, name) for name in ('pos.bin', 'chunker.bin')]
+            for model in models:
+                with open(model, 'wb') as f:
+                    f.write(b'0' * 10)
+            registry = BackendRegistry(idle_ttl=60, max_memory=15)
+            first = registry.acquire('opennlp', 'POSTagger', models[0])
+            second = registry.acquire('opennlp', 'POSTagger', models[0])
+            chunker = registry.acquire('opennlp', 'ChunkerME', models[1])
+            stats = dict((entry['tool'], entry) for entry in registry.stats())
+            assert len(stats) == 2 and stats['POSTagger']['references'] == 2
+            # Using the chunker exceeds the memory budget, so the least recently used tagger is stopped
+            registry.__use__(first._key)
+            registry.__use__(chunker._key)
+            stats = dict((entry['tool'], entry) for entry in registry.stats())
+            assert not stats['POSTagger']['running'] and stats['ChunkerME']['running']
+            first.close()
+            second.close()
+            assert registry.evict_idle(0) == 2
+            assert [entry['tool'] for entry in registry.stats()] == ['ChunkerME']
+            registry.close()
+        finally:
+            shutil.rmtree(tmp)
+
+
+    def test_server(self):
+        class UpperCaseBackend(object):
+            def process(self, lines):
+                return [line.upper() for line in lines]
+            def close(self):
+                pass
+
+        tmp = tempfile.mkdtemp()
+        socket_path = os.path.join(tmp, 'opennlp.sock')
+        server = OpenNLPServer(socket_path, 'opennlp', [])
+        server._backends[('POSTagger', os.path.abspath('model.bin'))] = UpperCaseBackend()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            tt = OpenNLPTagger(path_to_model='model.bin', server=socket_path)
+            assert tt.tag_sents(['a_b c_d', 'e_f']) == [[('A', 'B'), ('C', 'D')], [('E', 'F')]]
+            self.assertRaises(OSError, OpenNLPTagger(path_to_model='other.bin', server=socket_path).tag, 'a')
+            # Connections opened by other threads are closed as well
+            threads = [threading.Thread(target=tt.tag, args=('a_b',)) for _ in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            sockets = list(tt._client._sockets)
+            assert len(sockets) == 4
+            tt.close()
+            assert not tt._client._sockets and all(sock.fileno() == -1 for sock in sockets)
+            assert tt.tag('e_f') == [('E', 'F')]
+            tt.close()
+
+            async def run():
+                async with OpenNLPTagger(path_to_model='model.bin', server=socket_path) as tt:
+                    assert await tt.atag('a_b') == [('A', 'B')] and tt._client._sockets
+                return tt._client._sockets
+
+            # The connections are closed at the end of an async with block as well
+            assert not asyncio.run(run())
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+            shutil.rmtree(tmp)
+
+
 if __name__ == '__main__':
     unittest.main()